@@ -1,6 +1,6 @@
+from functools import lru_cache
 import numpy as np
 import scipy.signal as signal
-import librosa
 
 
 def roll(wav, shift):
@@ -17,11 +17,12 @@ def shift(wav, shift):
     
 
 def strech(wav, rate=1):
-    if len(wav) == 16000:
-        raise("wav length is not 16000")
+    if len(wav) != 16000:
+        raise ValueError("wav length is not 16000")
 
+    import librosa
     input_length = 16000
-    wav = librosa.effects.time_stretch(wav, rate)
+    wav = librosa.effects.time_stretch(wav, rate=rate)
     if len(wav) > input_length:
         wav = wav[:input_length]
     else:
@@ -50,10 +51,17 @@ def mix_two_wav(wav1, wav2, mix_rate=0.5):
     return wav
 
 
-def lowpass_filter(cutoff, samples, sample_rate, numtaps=255):
+@lru_cache(maxsize=None)
+def lowpass_coefficients(cutoff, sample_rate, numtaps=255):
     nyq_freq = sample_rate/2
     cutoff_normalized = cutoff/nyq_freq
     fir_filter = signal.firwin(numtaps, cutoff_normalized)
+    fir_filter.flags.writeable = False
+    return fir_filter
+
+
+def lowpass_filter(cutoff, samples, sample_rate, numtaps=255):
+    fir_filter = lowpass_coefficients(cutoff, sample_rate, numtaps)
     filterred_samples = signal.lfilter(fir_filter, 1, samples)
     return filterred_samples
 
@@ -105,8 +113,289 @@ def clip_random(wav, sample_rate):
     return wav[rand:(rand+sample_rate)]
 
 
-class Augmentation():
+def fit_length(wav, length):
+    """random crop or random zero padding to length"""
+    if len(wav) > length:
+        wav = clip_random(wav, length)
+    elif len(wav) < length:
+        wav = zero_padding_random(wav, length)
+    return wav
+
+
+class BatchOp():
+    """one augmentation over a (batch, length) float32 array
+
+    sample() draws every random choice for the batch at once, apply()
+    uses them, and only rows in params["mask"] (drawn with probability p)
+    are modified. touched() lists the rows whose waveform apply() reads.
+    paths, the batch's clip paths, are passed to both for ops that look
+    clips up by path.
+    """
+
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def sample(self, n, rng=np.random, paths=None):
+        return {"mask": rng.rand(n) < self.p}
+
+    def touched(self, params):
+        return params["mask"]
+
+    def apply(self, wavs, params, paths=None):
+        raise NotImplementedError
+
+    def __call__(self, wavs, rng=np.random, paths=None):
+        return self.apply(wavs, self.sample(len(wavs), rng, paths), paths)
+
+
+class NoiseMix(BatchOp):
+    """mix background noise into a (batch, length) array at random SNRs
+
+    bank is a generator.NoiseBank. Each row is mixed with probability p,
+    using its own noise segment and an SNR drawn from snr_range (dB).
+    """
+
+    def __init__(self, bank, p=0.5, snr_range=(0, 20)):
+        super().__init__(p)
+        self.bank = bank
+        self.snr_range = snr_range
+
+    def sample(self, n, rng=np.random, paths=None):
+        params = super().sample(n, rng, paths)
+        params["position"] = rng.rand(n)
+        params["snr"] = rng.uniform(self.snr_range[0],
+                                    self.snr_range[1],
+                                    size=n)
+        return params
+
+    def apply(self, wavs, params, paths=None):
+        rows = np.flatnonzero(params["mask"])
+        if len(rows) == 0:
+            return wavs
+
+        length = wavs.shape[1]
+        offsets = params["position"][rows] * (len(self.bank) - length)
+        noise = self.bank.segments(offsets.astype(np.int64), length)
+
+        signal_power = np.mean(wavs[rows] ** 2, axis=1)
+        noise_power = np.mean(noise ** 2, axis=1) + 1e-10
+        snr = 10 ** (params["snr"][rows] / 10)
+        gain = np.sqrt(signal_power / (noise_power * snr))
+        wavs[rows] += gain[:, None].astype(np.float32) * noise
+        return wavs
+
+
+class Shift(BatchOp):
+    """shift rows by up to max_shift samples, zero filled (roll=True wraps)"""
+
+    def __init__(self, p=0.5, max_shift=1600, roll=False):
+        super().__init__(p)
+        self.max_shift = max_shift
+        self.roll = roll
+
+    def sample(self, n, rng=np.random, paths=None):
+        params = super().sample(n, rng, paths)
+        params["shift"] = rng.randint(-self.max_shift, self.max_shift + 1,
+                                      size=n)
+        return params
+
+    def apply(self, wavs, params, paths=None):
+        rows = np.flatnonzero(params["mask"])
+        if len(rows) == 0:
+            return wavs
+
+        length = wavs.shape[1]
+        index = np.arange(length)[None, :] - params["shift"][rows, None]
+        if self.roll:
+            wavs[rows] = wavs[rows[:, None], index % length]
+        else:
+            inside = (index >= 0) & (index < length)
+            shifted = wavs[rows[:, None], np.clip(index, 0, length - 1)]
+            wavs[rows] = np.where(inside, shifted, 0)
+        return wavs
+
+
+class WhiteNoise(BatchOp):
+
+    def __init__(self, p=0.5, rate_range=(0.001, 0.01)):
+        super().__init__(p)
+        self.rate_range = rate_range
+
+    def sample(self, n, rng=np.random, paths=None):
+        params = super().sample(n, rng, paths)
+        params["rate"] = rng.uniform(self.rate_range[0],
+                                     self.rate_range[1],
+                                     size=n)
+        # apply() draws noise for the masked rows only from this seed
+        params["noise_seed"] = rng.randint(2 ** 31)
+        return params
+
+    def apply(self, wavs, params, paths=None):
+        rows = np.flatnonzero(params["mask"])
+        if len(rows) == 0:
+            return wavs
+
+        noise_rng = np.random.RandomState(params["noise_seed"])
+        noise = noise_rng.randn(len(rows), wavs.shape[1]).astype(np.float32)
+        wavs[rows] += params["rate"][rows, None].astype(np.float32) * noise
+        return wavs
+
 
-    def __init__(self, wav, sample_rate):
-        self.wav = wav
+class Distortion(BatchOp):
+
+    def __init__(self, p=0.5, threshold=0.5, level_range=(1, 4)):
+        super().__init__(p)
+        self.threshold = threshold
+        self.level_range = level_range
+
+    def sample(self, n, rng=np.random, paths=None):
+        params = super().sample(n, rng, paths)
+        params["level"] = rng.uniform(self.level_range[0],
+                                      self.level_range[1],
+                                      size=n)
+        return params
+
+    def apply(self, wavs, params, paths=None):
+        rows = np.flatnonzero(params["mask"])
+        if len(rows) == 0:
+            return wavs
+
+        level = params["level"][rows, None].astype(np.float32)
+        wavs[rows] = np.clip(level * wavs[rows],
+                             -self.threshold, self.threshold)
+        return wavs
+
+
+class LowPass(BatchOp):
+    """FIR lowpass with a cutoff picked from cutoffs, coefficients cached"""
+
+    def __init__(self, p=0.5, cutoffs=(2000, 3000, 4000, 6000),
+                 sample_rate=16000, numtaps=255):
+        super().__init__(p)
+        self.cutoffs = cutoffs
         self.sample_rate = sample_rate
+        self.numtaps = numtaps
+
+    def sample(self, n, rng=np.random, paths=None):
+        params = super().sample(n, rng, paths)
+        params["cutoff"] = rng.randint(len(self.cutoffs), size=n)
+        return params
+
+    def apply(self, wavs, params, paths=None):
+        for i, cutoff in enumerate(self.cutoffs):
+            rows = np.flatnonzero(params["mask"] & (params["cutoff"] == i))
+            if len(rows) == 0:
+                continue
+            fir_filter = lowpass_coefficients(cutoff,
+                                              self.sample_rate,
+                                              self.numtaps)
+            wavs[rows] = signal.lfilter(fir_filter, 1, wavs[rows], axis=1)
+        return wavs
+
+
+class MixTwo(BatchOp):
+    """mix each selected row with another row of the same batch
+
+    mix_rate is the weight of the row itself, keep it above 0.5 so its
+    label stays the dominant one.
+    """
+
+    def __init__(self, p=0.5, mix_range=(0.7, 0.95)):
+        super().__init__(p)
+        self.mix_range = mix_range
+
+    def sample(self, n, rng=np.random, paths=None):
+        params = super().sample(n, rng, paths)
+        params["partner"] = rng.randint(n, size=n)
+        params["mix_rate"] = rng.uniform(self.mix_range[0],
+                                         self.mix_range[1],
+                                         size=n)
+        return params
+
+    def touched(self, params):
+        touched = params["mask"].copy()
+        touched[params["partner"][params["mask"]]] = True
+        return touched
+
+    def apply(self, wavs, params, paths=None):
+        rows = np.flatnonzero(params["mask"])
+        if len(rows) == 0:
+            return wavs
+
+        mix_rate = params["mix_rate"][rows, None].astype(np.float32)
+        partners = wavs[params["partner"][rows]]
+        wavs[rows] = mix_two_wav(wavs[rows], partners, mix_rate)
+        return wavs
+
+
+class Stretch(BatchOp):
+    """swap rows for a precomputed time stretched version
+
+    banks maps a stretch rate to a packed.PackedReader written by
+    make_stretch_bank.py, which keeps the whole stretched clip; it gets
+    the same random crop/pad as generator.fit_length. Both sample() and
+    apply() need the batch paths. Rows whose clip is missing from the
+    drawn bank (e.g. silence) are dropped from the mask, so they stay
+    untouched. Put it first in an Augmentation, it replaces the whole
+    waveform.
+    """
+
+    def __init__(self, banks, p=0.5):
+        super().__init__(p)
+        self.rates = sorted(banks)
+        self.banks = banks
+
+    def _check_paths(self, paths):
+        if paths is None:
+            raise ValueError("Stretch looks clips up by path, pass paths "
+                             "to sample() and apply()")
+
+    def sample(self, n, rng=np.random, paths=None):
+        self._check_paths(paths)
+        params = super().sample(n, rng, paths)
+        params["rate"] = rng.randint(len(self.rates), size=n)
+        for row in np.flatnonzero(params["mask"]):
+            if paths[row] not in self.banks[self.rates[params["rate"][row]]]:
+                params["mask"][row] = False
+        return params
+
+    def apply(self, wavs, params, paths=None):
+        self._check_paths(paths)
+        for row in np.flatnonzero(params["mask"]):
+            bank = self.banks[self.rates[params["rate"][row]]]
+            wavs[row] = fit_length(bank.read_wav_file(paths[row])[0],
+                                   wavs.shape[1])
+        return wavs
+
+
+class Augmentation():
+    """composable batch augmentation pipeline
+
+    ops are BatchOp instances applied in order. Randomness for every op is
+    drawn per batch by sample(), before any clip is loaded, so callers can
+    tell from touched() which clips stay unaugmented.
+
+    >>> augmentation = Augmentation([Shift(p=0.5), LowPass(p=0.2)])
+    >>> wavs = augmentation(wavs)
+    """
+
+    def __init__(self, ops):
+        self.ops = list(ops)
+
+    def sample(self, n, rng=np.random, paths=None):
+        return {"n": n,
+                "ops": [op.sample(n, rng, paths) for op in self.ops]}
+
+    def touched(self, params):
+        touched = np.zeros(params["n"], dtype=bool)
+        for op, op_params in zip(self.ops, params["ops"]):
+            touched |= op.touched(op_params)
+        return touched
+
+    def apply(self, wavs, params, paths=None):
+        for op, op_params in zip(self.ops, params["ops"]):
+            wavs = op.apply(wavs, op_params, paths)
+        return wavs
+
+    def __call__(self, wavs, rng=np.random, paths=None):
+        return self.apply(wavs, self.sample(len(wavs), rng, paths), paths)
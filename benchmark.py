@@ -0,0 +1,225 @@
+import json
+import resource
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.io import wavfile
+import augment
+import config
+import frontend
+import generator
+import utils
+
+"""
+Throughput benchmark for the data and training pipeline.
+
+Runs every stage against a synthetic corpus written to a local directory
+(same layout, clip lengths and label mix as the competition data), so it
+needs no dataset and runs on CPU only machines. Results are written to
+bench/<version>.json; compare() prints the ratio between two runs.
+"""
+
+CORE_WORDS = [x for x in config.POSSIBLE_LABELS
+              if x not in ("silence", "unknown")]
+UNKNOWN_WORDS = ["bed", "bird", "cat", "dog", "eight", "five", "four",
+                 "happy", "house", "marvin", "nine", "one", "seven",
+                 "sheila", "six", "three", "tree", "two", "wow", "zero"]
+
+
+def make_synthetic_corpus(root, n_clips=2000, n_noise=2, seed=2017):
+    """write a fake train/audio tree, return file info style rows
+
+    Labels are spread evenly over the 30 words as in the real data (so
+    about 2/3 end up as unknown), 90% of the clips are exactly one second
+    and the rest are shorter.
+    """
+    rng = np.random.RandomState(seed)
+    label2n = dict(zip(config.POSSIBLE_LABELS,
+                       range(len(config.POSSIBLE_LABELS))))
+    audio_path = Path(root)/"train"/"audio"
+    words = CORE_WORDS + UNKNOWN_WORDS
+
+    rows = list()
+    for i in range(n_clips):
+        word = words[rng.randint(len(words))]
+        length = generator.SAMPLE_RATE
+        if rng.rand() < 0.1:
+            length = rng.randint(generator.SAMPLE_RATE // 2,
+                                 generator.SAMPLE_RATE)
+        fname = "{:08x}_nohash_{}.wav".format(rng.randint(2 ** 31), i % 5)
+        path = audio_path/word/fname
+        path.parent.mkdir(parents=True, exist_ok=True)
+        wav = (rng.randn(length) * 3000).astype(np.int16)
+        wavfile.write(str(path), generator.SAMPLE_RATE, wav)
+        possible_label = word if word in CORE_WORDS else "unknown"
+        rows.append((str(path), possible_label, label2n[possible_label]))
+
+    noise_path = audio_path/"_background_noise_"
+    noise_path.mkdir(parents=True, exist_ok=True)
+    for i in range(n_noise):
+        path = noise_path/"noise_{}.wav".format(i)
+        wav = (rng.randn(60 * generator.SAMPLE_RATE) * 3000).astype(np.int16)
+        wavfile.write(str(path), generator.SAMPLE_RATE, wav)
+        rows.append((str(path), "_background_noise_", -1))
+
+    return pd.DataFrame(rows, columns=["path", "possible_label", "plnum"])
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timeit(fn, items_per_call, repeat):
+    """run fn repeat times, return throughput and latency stats"""
+    latencies = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies)
+    total = latencies.sum()
+    return {"calls": repeat,
+            "items_per_sec": items_per_call * repeat / total,
+            "calls_per_sec": repeat / total,
+            "latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+            "latency_ms_p90": float(np.percentile(latencies, 90) * 1000),
+            "latency_ms_p99": float(np.percentile(latencies, 99) * 1000),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def data_stages(file_df, batch_size=64, repeat=20, seed=2017):
+    rng = np.random.RandomState(seed)
+    clips = file_df[file_df.plnum >= 0].reset_index(drop=True)
+    bg_paths = file_df[file_df.plnum < 0]
+    bank = generator.load_noise_bank(bg_paths.path)
+    paths = clips.path.values
+
+    def batch_paths():
+        return paths[rng.randint(len(paths), size=batch_size)]
+
+    raw = [generator.read_wav_file(x)[0] for x in batch_paths()]
+    wavs = np.stack([generator.fit_length(x, generator.SAMPLE_RATE)
+                     for x in raw])
+    augmentation = augment.Augmentation([augment.NoiseMix(bank),
+                                         augment.Shift(),
+                                         augment.LowPass(p=0.2)])
+    train_gen = generator.batch_generator(clips, batch_size,
+                                          len(config.POSSIBLE_LABELS),
+                                          bg_paths,
+                                          sampling_size=min(
+                                              20, clips.plnum.value_counts()
+                                              .min()))
+
+    stages = [
+        ("decode",
+         lambda: [generator.read_wav_file(x) for x in batch_paths()]),
+        ("crop_pad",
+         lambda: [generator.fit_length(x, generator.SAMPLE_RATE)
+                  for x in raw]),
+        ("augmentation", lambda: augmentation(wavs.copy(), rng)),
+        ("stft_per_clip",
+         lambda: [generator.spectrogram(x, generator.SAMPLE_RATE)
+                  for x in wavs]),
+        ("stft_batch", lambda: generator.featurize_batch(wavs)),
+        ("batch_assembly", lambda: generator.make_batch(batch_paths())),
+        ("batch_generator", lambda: next(train_gen)),
+    ]
+    for name in sorted(frontend.FRONTENDS):
+        front_end = frontend.get(name)
+        stages.append(("frontend_" + name,
+                       lambda front_end=front_end: front_end.featurize(wavs)))
+    return {name: timeit(fn, batch_size, repeat) for name, fn in stages}
+
+
+def model_stages(file_df, batch_size=64, repeat=10, seed=2017,
+                 frontends=("stft",)):
+    """train step, inference and submit.predict per front end
+
+    The stft front end keeps the unsuffixed stage names of earlier runs,
+    the others get a _<front end> suffix.
+    """
+    import model
+    import submit
+
+    rng = np.random.RandomState(seed)
+    y_batch = np.eye(len(config.POSSIBLE_LABELS))[
+        rng.randint(len(config.POSSIBLE_LABELS), size=batch_size)]
+    test_paths = file_df[file_df.plnum >= 0][["path"]].iloc[:4 * batch_size]
+    test_paths = test_paths.reset_index(drop=True)
+    bg_paths = file_df[file_df.plnum < 0]
+
+    stages = dict()
+    for name in frontends:
+        suffix = "" if name == "stft" else "_" + name
+        cnn = model.STFTCNN(frontend=name)
+        cnn.model_init()
+        x_batch = rng.randn(batch_size, *frontend.get(name).feature_shape)
+        x_batch = x_batch.astype(np.float32)
+        # the first call builds the graph, keep it out of the numbers
+        cnn.model.train_on_batch(x_batch, y_batch)
+        cnn.model.predict_on_batch(x_batch)
+
+        stages["model_step" + suffix] = timeit(
+            lambda: cnn.model.train_on_batch(x_batch, y_batch),
+            batch_size, repeat)
+        stages["inference" + suffix] = timeit(
+            lambda: cnn.model.predict_on_batch(x_batch),
+            batch_size, repeat)
+        stages["submit_predict" + suffix] = timeit(
+            lambda: submit.predict(test_paths, bg_paths, cnn),
+            len(test_paths), max(1, repeat // 5))
+    return stages
+
+
+def run(corpus_path="bench/corpus", n_clips=2000, batch_size=64,
+        repeat=20, with_model=True, bench_path="bench",
+        frontends=("stft",)):
+    utils.set_seed(2017, tensorflow=with_model)
+    file_df = make_synthetic_corpus(corpus_path, n_clips)
+
+    results = {"version": utils.now(),
+               "batch_size": batch_size,
+               "n_clips": n_clips,
+               "stages": data_stages(file_df, batch_size, repeat)}
+    if with_model:
+        results["stages"].update(model_stages(file_df, batch_size,
+                                              repeat // 2,
+                                              frontends=frontends))
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    Path(bench_path).mkdir(parents=True, exist_ok=True)
+    with open(str(Path(bench_path)/"{}.json".format(results["version"])),
+              "w") as fout:
+        json.dump(results, fout, indent=2)
+    return results
+
+
+def compare(old_path, new_path):
+    """items/sec of new relative to old, per stage"""
+    with open(str(old_path)) as fin:
+        old = json.load(fin)["stages"]
+    with open(str(new_path)) as fin:
+        new = json.load(fin)["stages"]
+    for name in new:
+        if name in old:
+            ratio = new[name]["items_per_sec"] / old[name]["items_per_sec"]
+            print("{:16s} {:10.1f} -> {:10.1f} clips/s  x{:.2f}".format(
+                name, old[name]["items_per_sec"],
+                new[name]["items_per_sec"], ratio))
+
+
+def main(**kwargs):
+    """run() and print its stages, kwargs go to run()"""
+    results = run(**kwargs)
+    for name, stage in results["stages"].items():
+        print("{:16s} {:10.1f} clips/s {:8.2f} batches/s "
+              "p50 {:8.2f} ms p99 {:8.2f} ms".format(
+                  name, stage["items_per_sec"], stage["calls_per_sec"],
+                  stage["latency_ms_p50"], stage["latency_ms_p99"]))
+    print("peak rss {:.0f} MB".format(results["peak_rss_mb"]))
+    return results
+
+
+if __name__ == "__main__":
+    main()
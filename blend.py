@@ -0,0 +1,188 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+import config
+import oof
+import utils
+
+"""
+Blending and stacking on the out-of-fold store (see oof.py).
+
+A run is (model name, cv version). Runs are aligned on the clips they all
+scored, weights or a stacker are fitted on the out-of-fold probabilities
+and the test probabilities (fold mean per run) are blended into a
+submission, without a forward pass.
+
+>>> runs = [("STFTCNN", "2017_12_11_13_14_00"),
+...         ("STFTCNN_logmel40", "2017_12_14_09_30_00")]
+>>> blended = load_runs(runs)
+>>> weights = fit_weights(blended.oof, blended.labels)
+>>> write_submission(blend(blended.test, weights), blended.fnames,
+...                  "sub/blend", "submit/blend.csv")
+"""
+
+
+class Blended():
+    """aligned arrays of several runs
+
+    oof (runs, clips, labels) and labels of the clips every run scored,
+    test (runs, test clips, labels) fold mean probabilities and fnames.
+    """
+
+    def __init__(self, runs, clips, labels, oof_probs, fnames, test_probs):
+        self.runs = runs
+        self.clips = clips
+        self.labels = labels
+        self.oof = oof_probs
+        self.fnames = fnames
+        self.test = test_probs
+
+
+def load_runs(runs, root=config.OOF_STORE_PATH):
+    stores = [oof.OOFStore(model_name, cv_version, root)
+              for model_name, cv_version in runs]
+    loaded = [store.oof() for store in stores]
+    clips = loaded[0][0]["clip"].values
+    for index, _ in loaded[1:]:
+        clips = clips[np.isin(clips, index["clip"].values)]
+    # filled run by run straight from the fold memmaps
+    oof_probs = np.empty((len(stores), len(clips),
+                          len(config.POSSIBLE_LABELS)), dtype=np.float32)
+    for run, (index, fold_probs) in enumerate(loaded):
+        oof.gather(fold_probs, index.set_index("clip").loc[clips],
+                   out=oof_probs[run])
+    labels = loaded[0][0].set_index("clip").plnum[clips].values
+
+    fnames, test_probs = None, list()
+    for store in stores:
+        store_fnames, probs = store.test()
+        if fnames is None:
+            fnames = store_fnames
+        elif not np.array_equal(fnames, store_fnames):
+            rows = pd.Series(np.arange(len(store_fnames)),
+                             index=store_fnames)
+            probs = probs[:, rows[fnames].values]
+        test_probs.append(probs.mean(axis=0, dtype=np.float32))
+
+    return Blended(list(runs), clips, labels, oof_probs,
+                   fnames, np.stack(test_probs))
+
+
+def log_loss(probs, labels):
+    return float(-np.mean(np.log(np.maximum(
+        probs[np.arange(len(labels)), labels], 1e-7))))
+
+
+def accuracy(probs, labels):
+    return float(np.mean(np.argmax(probs, axis=1) == labels))
+
+
+def blend(probs, weights):
+    """weighted mean over the runs axis of (runs, clips, labels)"""
+    return np.tensordot(weights, probs, axes=1)
+
+
+def fit_weights(oof_probs, labels):
+    """non-negative run weights summing to one, minimizing log loss"""
+    n_runs = len(oof_probs)
+
+    def objective(logits):
+        weights = np.exp(logits - logits.max())
+        return log_loss(blend(oof_probs, weights / weights.sum()), labels)
+
+    logits = minimize(objective, np.zeros(n_runs), method="Nelder-Mead").x
+    weights = np.exp(logits - logits.max())
+    return weights / weights.sum()
+
+
+def stack_features(probs):
+    """(clips, runs * labels) log probabilities"""
+    return np.log(np.maximum(probs, 1e-7)).transpose(1, 0, 2).reshape(
+        probs.shape[1], -1)
+
+
+def fit_stacker(oof_probs, labels, C=1.0, seed=2017):
+    """multinomial logistic regression on the runs' log probabilities
+
+    Returns the stacker fitted on all clips and its 5 fold cross
+    validated out-of-fold probabilities.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import cross_val_predict
+    # lbfgs fits the multinomial model
+    stacker = LogisticRegression(C=C, solver="lbfgs", max_iter=500,
+                                 random_state=seed)
+    features = stack_features(oof_probs)
+    stacked_oof = cross_val_predict(stacker, features, labels, cv=5,
+                                    method="predict_proba")
+    stacker.fit(features, labels)
+    return stacker, stacked_oof
+
+
+def stacker_predict(stacker, probs):
+    """(clips, labels) with columns for every label, seen in fit or not"""
+    out = np.zeros((probs.shape[1], len(config.POSSIBLE_LABELS)),
+                   dtype=np.float32)
+    out[:, stacker.classes_] = stacker.predict_proba(stack_features(probs))
+    return out
+
+
+def report(blended, weights=None, stacked_oof=None):
+    """out-of-fold accuracy and log loss per run and per blend"""
+    def scores(probs):
+        return {"accuracy": accuracy(probs, blended.labels),
+                "log_loss": log_loss(probs, blended.labels)}
+
+    result = {"clips": len(blended.clips)}
+    for run, probs in zip(blended.runs, blended.oof):
+        result["/".join(run)] = scores(probs)
+    result["mean"] = scores(blended.oof.mean(axis=0))
+    if weights is not None:
+        result["weighted"] = dict(scores(blend(blended.oof, weights)),
+                                  weights=[float(x) for x in weights])
+    if stacked_oof is not None:
+        result["stacked"] = scores(stacked_oof)
+    return result
+
+
+def write_submission(test_probs, fnames, sub_path, submit_file):
+    """submission and sub_path/0_probs.npy from blended test probs"""
+    import submit
+    Path(sub_path).mkdir(parents=True, exist_ok=True)
+    with submit.SubmissionWriter(sub_path, submit_file,
+                                 len(fnames), 1) as writer:
+        writer.write(fnames, test_probs[None])
+    return submit_file
+
+
+def main(runs=(("STFTCNN", "2017_12_11_13_14_00"),), method="stack",
+         submit_file=None):
+    """submission from the cached probabilities of runs
+
+    method "mean", "weights" (fit_weights) or "stack" (fit_stacker).
+    Returns the submission file.
+    """
+    version = utils.now()
+    blended = load_runs(runs)
+    weights, stacked_oof = None, None
+    if method == "weights":
+        weights = fit_weights(blended.oof, blended.labels)
+        test_probs = blend(blended.test, weights)
+    elif method == "stack":
+        stacker, stacked_oof = fit_stacker(blended.oof, blended.labels)
+        test_probs = stacker_predict(stacker, blended.test)
+    elif method == "mean":
+        test_probs = blended.test.mean(axis=0)
+    else:
+        raise ValueError("unknown blend method {}".format(method))
+    print(report(blended, weights, stacked_oof))
+
+    submit_file = submit_file or "submit/blend_{}.csv".format(version)
+    Path(submit_file).parent.mkdir(parents=True, exist_ok=True)
+    return write_submission(test_probs, blended.fnames,
+                            Path("sub/blend")/version, submit_file)
+
+
+if __name__ == "__main__":
+    main()
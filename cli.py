@@ -0,0 +1,352 @@
+import argparse
+import os
+import sys
+import config
+
+"""
+Command line entry point for every stage of the pipeline.
+
+python cli.py index
+python cli.py make-silence --size 2500
+python cli.py train-cv --silence-version virtual --fold-workers 5
+python cli.py predict --cv-path cv/STFTCNN/<version> --runtime tflite
+python cli.py submit --run STFTCNN/<version> --run STFTCNN_logmel40/<v2>
+python cli.py plot cv/STFTCNN/<version> --fold 0
+python cli.py bench --no-model
+python cli.py --packed-audio data/packed pack --sources train test
+python cli.py stretch-bank --rates 0.9 1.1 --workers 8
+python cli.py feature-store --dtype uint8 --channels amp
+python cli.py export --cv-path cv/STFTCNN/<version> --no-quantize
+python cli.py serve --cv-path cv/STFTCNN/<version> --runtime pb --port 8000
+python cli.py stream --weights cv/STFTCNN/<version>/fold_0.hdf5 clip.wav
+python cli.py sweep --method halving --trials 27 --trial-workers 4
+
+Path flags before the subcommand override config.py for the run, also in
+spawned worker processes (or set CONFIG_<NAME> directly). Modules
+are imported inside the subcommands, after the overrides, so TensorFlow,
+keras and librosa are only loaded by the commands that use them.
+"""
+
+# flag -> config attribute
+CONFIG_FLAGS = {"train_audio": "TRAIN_AUDIO_PATH",
+                "train_path": "TRAIN_PATH",
+                "file_info": "TRAIN_FILE_META_INFO",
+                "test_audio": "TEST_AUDIO_PATH",
+                "silence_path": "SILECE_DATA_PATH",
+                "feature_cache": "FEATURE_CACHE_PATH",
+                "packed_audio": "PACKED_AUDIO_PATH",
+                "stretch_bank": "STRETCH_BANK_PATH",
+                "feature_store": "FEATURE_STORE_PATH",
+                "oof_store": "OOF_STORE_PATH"}
+
+
+def apply_config(args):
+    """set the path flags on config and in the environment
+
+    Fold and trial processes are spawned and import config afresh, they
+    pick the overrides up from the CONFIG_<NAME> variables.
+    """
+    for flag, name in CONFIG_FLAGS.items():
+        value = getattr(args, flag)
+        if value is not None:
+            setattr(config, name, value)
+            os.environ[config.ENV_PREFIX + name] = value
+
+
+def index(args):
+    import extract_meta_info
+    extract_meta_info.main(workers=args.workers)
+
+
+def make_silence(args):
+    import make_silence_clip
+    print(make_silence_clip.main(args.size, args.seed))
+
+
+def train_cv(args):
+    import experiment
+    kwargs = {"n_splits": args.splits,
+              "sample_size": args.sample_size,
+              "batch_size": args.batch_size,
+              "workers": args.workers,
+              "use_cache": not args.no_cache,
+              "packed_path": args.packed_path,
+              "noise_mix": not args.no_noise_mix,
+              "instrumented": args.instrumented,
+              "profile": args.profile,
+              "predict_test": not args.no_predict_test}
+    if args.fold_workers is not None:
+        kwargs["threads"] = args.threads
+    print(experiment.main(args.silence_version, args.cv_version, args.seed,
+                          args.name, args.frontend, args.filters,
+                          args.fold_workers, **kwargs))
+
+
+def predict(args):
+    import submit
+    print(submit.main(args.cv_path, args.name, args.frontend, args.filters,
+                      args.out, args.packed_path, args.workers,
+                      args.backend, args.runtime))
+
+
+def submit_blend(args):
+    import blend
+    runs = [tuple(run.split("/", 1)) for run in args.runs]
+    print(blend.main(runs, args.method, args.out))
+
+
+def plot(args):
+    import matplotlib
+    matplotlib.use("Agg")
+    import loss_visualize
+    print(loss_visualize.main(args.path, args.fold, args.out))
+
+
+def bench(args):
+    import benchmark
+    if args.compare:
+        benchmark.compare(*args.compare)
+        return
+    benchmark.main(corpus_path=args.corpus,
+                   n_clips=args.clips,
+                   batch_size=args.batch_size,
+                   repeat=args.repeat,
+                   with_model=not args.no_model,
+                   bench_path=args.bench_path,
+                   frontends=tuple(args.frontends))
+
+
+def pack(args):
+    import packed
+    print(packed.main(args.sources, args.silence_version))
+
+
+def stretch_bank(args):
+    import make_stretch_bank
+    rates = args.rates or make_stretch_bank.RATES
+    print(make_stretch_bank.main(rates, workers=args.workers,
+                                 chunk_size=args.chunk_size))
+
+
+def feature_store(args):
+    import feature_store
+    print(feature_store.main(args.silence_version, dtype=args.dtype,
+                             channels=tuple(args.channels)))
+
+
+def export(args):
+    import export
+    export.main(args.cv_path, args.frontend, not args.no_quantize,
+                args.calibration_clips, not args.no_compare, args.clips)
+
+
+def serve(args):
+    import server
+    server.serve(args.cv_path, args.host, args.port, args.frontend,
+                 args.max_batch_size, args.max_wait_ms,
+                 runtime=args.runtime)
+
+
+def stream(args):
+    import streaming
+    streaming.main(args.weights, args.wav, args.frontend, args.chunk_size,
+                   args.realtime, stride=args.stride,
+                   smoothing=args.smoothing, threshold=args.threshold)
+
+
+def sweep(args):
+    import json
+    import sweep
+    space = None
+    if args.space is not None:
+        with open(args.space) as fin:
+            space = json.load(fin)
+    kwargs = {"min_epochs": args.min_epochs,
+              "max_epochs": args.max_epochs,
+              "eta": args.eta,
+              "sweep_id": args.sweep_id,
+              "model_name": args.name,
+              "seed": args.seed,
+              "trial_workers": args.trial_workers,
+              "threads": args.threads}
+    if args.method == "halving":
+        kwargs["n_trials"] = args.trials
+    sweep.main(space, args.silence_version, args.method, **kwargs)
+
+
+def model_flags(parser):
+    parser.add_argument("--name", default="STFTCNN")
+    parser.add_argument("--frontend", default="stft")
+    parser.add_argument("--filters", type=int, default=16)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py")
+    for flag, name in CONFIG_FLAGS.items():
+        parser.add_argument("--" + flag.replace("_", "-"),
+                            help="overrides config.{} ({})".format(
+                                name, getattr(config, name)))
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    command = commands.add_parser("index", help="build the train file info")
+    command.add_argument("--workers", type=int, default=8)
+    command.set_defaults(func=index)
+
+    command = commands.add_parser("make-silence",
+                                  help="cut silence clips from the noise")
+    command.add_argument("--size", type=int, default=2500)
+    command.add_argument("--seed", type=int, default=2017)
+    command.set_defaults(func=make_silence)
+
+    command = commands.add_parser("train-cv", help="cross validate a model")
+    command.add_argument("--silence-version", default="virtual")
+    command.add_argument("--cv-version")
+    command.add_argument("--seed", type=int, default=2017)
+    model_flags(command)
+    command.add_argument("--splits", type=int, default=5)
+    command.add_argument("--sample-size", type=int, default=1800)
+    command.add_argument("--batch-size", type=int, default=64)
+    command.add_argument("--workers", type=int, default=0,
+                         help="loader processes per fold")
+    command.add_argument("--fold-workers", type=int,
+                         help="train folds in parallel processes")
+    command.add_argument("--threads", type=int,
+                         help="TF threads per fold process")
+    command.add_argument("--packed-path")
+    command.add_argument("--no-cache", action="store_true")
+    command.add_argument("--no-noise-mix", action="store_true")
+    command.add_argument("--no-predict-test", action="store_true")
+    command.add_argument("--instrumented", action="store_true")
+    command.add_argument("--profile", action="store_true")
+    command.set_defaults(func=train_cv)
+
+    command = commands.add_parser("predict",
+                                  help="fold ensemble submission of a run")
+    command.add_argument("--cv-path", required=True)
+    model_flags(command)
+    command.add_argument("--out", help="submission csv")
+    command.add_argument("--packed-path")
+    command.add_argument("--workers", type=int, default=0)
+    command.add_argument("--backend", choices=("numpy", "tf"),
+                         default="numpy")
+    command.add_argument("--runtime", choices=("keras", "pb", "tflite"),
+                         default="keras")
+    command.set_defaults(func=predict)
+
+    command = commands.add_parser(
+        "submit", help="blend cached out-of-fold / test probabilities")
+    command.add_argument("--run", action="append", required=True,
+                         dest="runs",
+                         help="<model>/<cv version>, repeatable")
+    command.add_argument("--method", choices=("mean", "weights", "stack"),
+                         default="weights")
+    command.add_argument("--out", help="submission csv")
+    command.set_defaults(func=submit_blend)
+
+    command = commands.add_parser("plot", help="plot a fold's training log")
+    command.add_argument("path", help="cv/<model>/<version>")
+    command.add_argument("--fold", type=int, default=0)
+    command.add_argument("--out")
+    command.set_defaults(func=plot)
+
+    command = commands.add_parser("bench", help="pipeline benchmark")
+    command.add_argument("--corpus", default="bench/corpus")
+    command.add_argument("--clips", type=int, default=2000)
+    command.add_argument("--batch-size", type=int, default=64)
+    command.add_argument("--repeat", type=int, default=20)
+    command.add_argument("--no-model", action="store_true")
+    command.add_argument("--bench-path", default="bench")
+    command.add_argument("--frontends", nargs="+", default=["stft"])
+    command.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                         help="compare two benchmark json files")
+    command.set_defaults(func=bench)
+
+    command = commands.add_parser("pack", help="pack clips into one buffer")
+    command.add_argument("--sources", nargs="+",
+                         choices=("train", "silence", "test"),
+                         default=["train", "silence", "test"])
+    command.add_argument("--silence-version", default="2017_12_08_15_41_26")
+    command.set_defaults(func=pack)
+
+    command = commands.add_parser("stretch-bank",
+                                  help="precompute time stretched clips")
+    command.add_argument("--rates", type=float, nargs="+",
+                         help="stretch rates (default 0.8 0.9 1.1 1.2)")
+    command.add_argument("--workers", type=int, default=4)
+    command.add_argument("--chunk-size", type=int, default=1000)
+    command.set_defaults(func=stretch_bank)
+
+    command = commands.add_parser("feature-store",
+                                  help="precompute the train features")
+    command.add_argument("--silence-version", default="virtual")
+    command.add_argument("--dtype", choices=("float16", "uint8"),
+                         default="uint8")
+    command.add_argument("--channels", nargs="+", choices=("phase", "amp"),
+                         default=["amp"])
+    command.set_defaults(func=feature_store)
+
+    command = commands.add_parser("export",
+                                  help="frozen and int8 fold models")
+    command.add_argument("--cv-path", required=True)
+    command.add_argument("--frontend", default="stft")
+    command.add_argument("--no-quantize", action="store_true")
+    command.add_argument("--calibration-clips", type=int, default=200)
+    command.add_argument("--no-compare", action="store_true",
+                         help="skip the runtime report")
+    command.add_argument("--clips", type=int, default=2000,
+                         help="validation clips of the runtime report")
+    command.set_defaults(func=export)
+
+    command = commands.add_parser("serve", help="micro-batching http server")
+    command.add_argument("--cv-path", required=True)
+    command.add_argument("--host", default="127.0.0.1")
+    command.add_argument("--port", type=int, default=8000)
+    command.add_argument("--frontend", default="stft")
+    command.add_argument("--max-batch-size", type=int, default=32)
+    command.add_argument("--max-wait-ms", type=float, default=5.0)
+    command.add_argument("--runtime", choices=("keras", "pb", "tflite"),
+                         default="keras")
+    command.set_defaults(func=serve)
+
+    command = commands.add_parser("stream",
+                                  help="replay a wav through the spotter")
+    command.add_argument("wav")
+    command.add_argument("--weights", required=True,
+                         help="fold checkpoint, .pb or .tflite")
+    command.add_argument("--frontend", default="stft")
+    command.add_argument("--chunk-size", type=int, default=1600)
+    command.add_argument("--realtime", action="store_true")
+    command.add_argument("--stride", type=int, default=10)
+    command.add_argument("--smoothing", type=int, default=3)
+    command.add_argument("--threshold", type=float, default=0.8)
+    command.set_defaults(func=stream)
+
+    command = commands.add_parser("sweep", help="hyperparameter sweep")
+    command.add_argument("--method", choices=("hyperband", "halving"),
+                         default="hyperband")
+    command.add_argument("--space", help="json search space file")
+    command.add_argument("--silence-version", default="2017_12_08_15_41_26")
+    command.add_argument("--sweep-id", help="resume this sweep")
+    command.add_argument("--name", default="STFTCNN")
+    command.add_argument("--trials", type=int, default=27,
+                         help="trials of a halving sweep")
+    command.add_argument("--min-epochs", type=int, default=1)
+    command.add_argument("--max-epochs", type=int, default=27)
+    command.add_argument("--eta", type=int, default=3)
+    command.add_argument("--seed", type=int, default=2017)
+    command.add_argument("--trial-workers", type=int, default=4)
+    command.add_argument("--threads", type=int,
+                         help="TF threads per trial process")
+    command.set_defaults(func=sweep)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    apply_config(args)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,6 +1,18 @@
-TRAIN_AUDIO_PATH = "input/train/audio"
-TRAIN_PATH = "input/train"
-TRAIN_FILE_META_INFO = "data/train_file_info.csv"
+import os
+
+# paths can be overridden with CONFIG_<NAME> environment variables, which
+# also reach spawned fold and trial processes (see cli.apply_config)
+ENV_PREFIX = "CONFIG_"
+
+
+def _path(name, default):
+    return os.environ.get(ENV_PREFIX + name) or default
+
+
+TRAIN_AUDIO_PATH = _path("TRAIN_AUDIO_PATH", "input/train/audio")
+TRAIN_PATH = _path("TRAIN_PATH", "input/train")
+TRAIN_FILE_META_INFO = _path("TRAIN_FILE_META_INFO",
+                             "data/train_file_info.csv")
 POSSIBLE_LABELS = ['yes',
                    'no',
                    'up',
@@ -13,5 +25,12 @@ POSSIBLE_LABELS = ['yes',
                    'go',
                    'silence',
                    'unknown']
-TEST_AUDIO_PATH = "input/test/audio"
-SILECE_DATA_PATH = "data/silence"
+TEST_AUDIO_PATH = _path("TEST_AUDIO_PATH", "input/test/audio")
+SILECE_DATA_PATH = _path("SILECE_DATA_PATH", "data/silence")
+# disk tier of feature_cache.FeatureCache, off unless set: it holds every
+# featurized clip (about 13 GB for the train set) and is never pruned
+FEATURE_CACHE_PATH = _path("FEATURE_CACHE_PATH", None)
+PACKED_AUDIO_PATH = _path("PACKED_AUDIO_PATH", "data/packed")
+STRETCH_BANK_PATH = _path("STRETCH_BANK_PATH", "data/stretch")
+FEATURE_STORE_PATH = _path("FEATURE_STORE_PATH", "data/features.h5")
+OOF_STORE_PATH = _path("OOF_STORE_PATH", "data/oof")
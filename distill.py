@@ -0,0 +1,151 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import config
+import frontend as frontends
+import generator
+import oof
+
+"""
+Fold ensemble -> single model distillation.
+
+teacher_probs scores every clip once with the fold checkpoints of a cross
+validation run and caches the mean probabilities in the run directory
+(teacher_probs.npy, rows in the order of teacher_paths.csv).
+soft_targets and distillation_loss train the student on them, see
+experiment.distillation, which writes its artifacts to cv_path/distill/.
+Every fold but one has trained on a clip, so the student's validation
+clips are scored with oof_teacher_probs instead.
+"""
+
+PROBS_FILE = "teacher_probs.npy"
+PATHS_FILE = "teacher_paths.csv"
+
+
+def temper(probs, temperature):
+    """softmax(logits / temperature) from softmax(logits)"""
+    logits = np.log(np.maximum(probs, 1e-12)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    tempered = np.exp(logits)
+    return tempered / tempered.sum(axis=1, keepdims=True)
+
+
+def soft_targets(probs, labels, temperature=4.0):
+    """(clips, 2 * labels) one-hot labels next to the tempered teacher probs
+
+    The student is trained on them with distillation_loss.
+    """
+    hard = np.eye(probs.shape[1], dtype=np.float32)[labels]
+    tempered = temper(probs, temperature)
+    return np.hstack([hard, tempered]).astype(np.float32)
+
+
+def distillation_loss(temperature=4.0, alpha=0.7):
+    """keras loss of a softmax student on soft_targets
+
+    alpha * T^2 * cross entropy between the tempered teacher probs and
+    softmax(student logits / T), plus (1 - alpha) * cross entropy with the
+    labels. The logits are recovered as log of the student's softmax
+    output. Rows without teacher probs (plain one-hot targets, as in
+    validation) get the hard cross entropy alone.
+    """
+    from tensorflow.python.keras import backend as K
+    label_num = len(config.POSSIBLE_LABELS)
+
+    def loss(y_true, y_pred):
+        hard, soft = y_true[:, :label_num], y_true[:, label_num:]
+        log_probs = K.log(K.clip(y_pred, K.epsilon(), 1.))
+        tempered = log_probs / temperature
+        tempered -= K.logsumexp(tempered, axis=-1, keepdims=True)
+        soft_loss = -K.sum(soft * tempered, axis=-1) * temperature ** 2
+        hard_loss = -K.sum(hard * log_probs, axis=-1)
+        has_soft = K.sum(soft, axis=-1)
+        return (alpha * soft_loss +
+                (1. - alpha * has_soft) * hard_loss)
+    return loss
+
+
+def acc(y_true, y_pred):
+    """accuracy on the one-hot half of soft_targets"""
+    from tensorflow.python.keras import backend as K
+    hard = y_true[:, :len(config.POSSIBLE_LABELS)]
+    return K.cast(K.equal(K.argmax(hard, axis=-1),
+                          K.argmax(y_pred, axis=-1)), K.floatx())
+
+
+def compile_student(model, temperature=4.0, alpha=0.7):
+    model.compile(optimizer='rmsprop',
+                  loss=distillation_loss(temperature, alpha),
+                  metrics=[acc])
+    return model
+
+
+def _cached(cv_path, paths):
+    probs_path = Path(cv_path)/PROBS_FILE
+    paths_path = Path(cv_path)/PATHS_FILE
+    if not (probs_path.exists() and paths_path.exists()):
+        return None
+    cached_paths = pd.read_csv(str(paths_path)).path.astype(str).values
+    rows = pd.Series(np.arange(len(cached_paths)), index=cached_paths)
+    if not np.isin(paths, cached_paths).all():
+        return None
+    probs = np.load(str(probs_path), mmap_mode="r")
+    return np.asarray(probs[rows[paths].values])
+
+
+def teacher_probs(teacher, cv_path, input_df, bg_paths, cache=None,
+                  reader=None, batch_size=64):
+    """(len(input_df), labels) mean fold probabilities of teacher
+
+    Read from cv_path when every clip of input_df was scored before,
+    otherwise all of input_df is scored and the cache rewritten. Clips are
+    scored unaugmented, virtual silence with its fixed valid-mode cut.
+    """
+    paths = input_df.path.astype(str).values
+    probs = _cached(cv_path, paths)
+    if probs is not None:
+        return probs
+
+    import submit
+    cv_models = submit.load_cv_models(teacher, cv_path)
+    test_gen = generator.batch_generator(input_df, batch_size,
+                                         len(config.POSSIBLE_LABELS),
+                                         bg_paths,
+                                         mode='test',
+                                         cache=cache,
+                                         reader=reader,
+                                         frontend=frontends.get(
+                                             teacher.frontend))
+    steps = int(np.ceil(len(input_df)/batch_size))
+
+    probs = np.lib.format.open_memmap(
+        str(Path(cv_path)/PROBS_FILE), mode="w+", dtype=np.float32,
+        shape=(len(input_df), len(config.POSSIBLE_LABELS)))
+    start = 0
+    for fold_probs in submit.ensemble_batches(cv_models, test_gen, steps):
+        end = start + fold_probs.shape[1]
+        probs[start:end] = fold_probs.mean(axis=0)
+        start = end
+    probs.flush()
+    pd.DataFrame({"path": paths}).to_csv(str(Path(cv_path)/PATHS_FILE),
+                                         index=False)
+    return np.asarray(probs)
+
+
+def oof_teacher_probs(model_name, cv_version, input_df,
+                      root=config.OOF_STORE_PATH):
+    """(len(input_df), labels) out-of-fold probabilities of a run
+
+    Every clip is scored by the fold that held it out, so no fold model
+    has trained on it. None when the oof.OOFStore of the run is missing or
+    lacks a clip of input_df.
+    """
+    try:
+        index, fold_probs = oof.OOFStore(model_name, cv_version, root).oof()
+    except ValueError:
+        return None
+    index = index.set_index("clip")
+    paths = input_df.path.astype(str).values
+    if not np.isin(paths, index.index.values).all():
+        return None
+    return oof.gather(fold_probs, index.loc[paths])
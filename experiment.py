@@ -1,11 +1,24 @@
+import hashlib
+import json
+import multiprocessing as mp
+import time
 from pathlib import Path
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import KFold
+import augment
 import config
+import distill
+import feature_cache
+import frontend
 import generator
 import learner
+import loader
+import make_silence_clip
 import model
+import oof
+import packed
+import tf_pipeline
 import utils
 
 """
@@ -18,17 +31,57 @@ Todo:
 
 
 def data_load(silence_data_version):
-    file_df = pd.read_csv(config.TRAIN_FILE_META_INFO)
+    """train file info, background noise paths and silence rows
+
+    silence_data_version "virtual" uses silence cut from the background
+    noise on the fly instead of a data/silence/<version> directory.
+    """
+    file_df = utils.read_file_info()
     file_df = file_df[["path", "uid", "possible_label", "plnum", "is_valid"]]
     bg_paths = file_df[file_df["possible_label"] == "_background_noise_"]
     file_df = file_df[file_df["possible_label"] != "_background_noise_"]
 
-    silence_data_path = Path(config.SILECE_DATA_PATH)/silence_data_version
-    silence_df = pd.read_csv(silence_data_path/"file_info.csv")
+    if silence_data_version == make_silence_clip.VIRTUAL_VERSION:
+        silence_df = make_silence_clip.virtual_silence_df()
+    else:
+        silence_data_path = Path(config.SILECE_DATA_PATH)/silence_data_version
+        silence_df = pd.read_csv(silence_data_path/"file_info.csv")
 
     return file_df, bg_paths, silence_df
 
 
+def build_augmentation(bg_paths, reader=None, noise_mix=True, augment_ops=()):
+    """train time augment.Augmentation, None when nothing is enabled"""
+    ops = list()
+    if noise_mix:
+        bank = generator.load_noise_bank(bg_paths.path, reader)
+        ops.append(augment.NoiseMix(bank))
+    ops.extend(augment_ops)
+    if not ops:
+        return None
+    return augment.Augmentation(ops)
+
+
+def store_shape(store):
+    """model input shape for a feature store, None for the front end's"""
+    return None if store is None else store.feature_shape
+
+
+def data_resources(bg_paths, use_cache=True, packed_path=None,
+                   noise_mix=True, augment_ops=(), frontend_name="stft"):
+    """feature cache, packed reader and train augmentation for a run"""
+    cache = None
+    if use_cache:
+        cache = feature_cache.FeatureCache(
+            frontend.get(frontend_name).cache_params())
+    reader = None
+    if packed_path is not None:
+        reader = packed.PackedReader(packed_path)
+    augmentation = build_augmentation(bg_paths, reader,
+                                      noise_mix, augment_ops)
+    return cache, reader, augmentation
+
+
 def experiment(estimator,
                train_df,
                valid_df,
@@ -36,28 +89,119 @@ def experiment(estimator,
                batch_size,
                sample_size,
                version_path=None,
-               csv_log_path=None):
-    
+               csv_log_path=None,
+               cache=None,
+               reader=None,
+               workers=0,
+               seed=None,
+               augmentation=None,
+               instrumented=False,
+               profile=False,
+               backend="numpy",
+               store=None,
+               targets=None,
+               epochs=20,
+               initial_epoch=0,
+               learner_options=None):
+    """train estimator on train_df, validate on valid_df
+
+    backend "numpy" builds batches with generator.batch_generator, or with
+    loader.PrefetchLoader when workers > 0; backend "tf" uses the tf.data
+    pipeline in tf_pipeline.py (workers is the number of parallel map
+    calls, a cache, instrumented or a store raise). instrumented writes
+    per epoch data wait / train step timings and make_batch stage timings
+    next to the csv log (see instrument.py), profile adds a cProfile dump
+    per epoch. store, a feature_store.FeatureStore, replaces featurizing;
+    it needs the numpy backend with workers=0 and no augmentation, and
+    estimator built with input_shape=store.feature_shape. Features come
+    from the front end named by estimator.frontend. targets, one row per
+    train_df row, replaces the one-hot train labels (see distillation);
+    validation stays one-hot. Training runs from initial_epoch to epochs,
+    learner_options are passed on to learner.Learner (patience,
+    lr_factor, lr_patience, state_path).
+    """
+
     label_num = len(config.POSSIBLE_LABELS)
-    train_generator = generator.batch_generator(train_df,
-                                                batch_size,
-                                                label_num,
-                                                bg_paths,
-                                                sampling_size=sample_size)
-    valid_generator = generator.batch_generator(valid_df,
-                                                batch_size,
-                                                label_num,
-                                                bg_paths,
-                                                mode='valid',
-                                                sampling_size=sample_size)
+    front_end = frontend.get(estimator.frontend)
+    if backend == "tf" and front_end.name != "stft":
+        raise ValueError("the tf backend only has the stft front end")
+    if backend == "tf" and targets is not None:
+        raise ValueError("the tf backend does not take soft targets")
+    if backend == "tf" and (cache is not None or instrumented):
+        raise ValueError("the tf backend has no feature cache and no "
+                         "stage timings, pass cache=None and "
+                         "instrumented=False")
+    if store is not None and (backend == "tf" or workers > 0):
+        raise ValueError("a feature store is read by the numpy backend "
+                         "with workers=0")
+    if store is not None and augmentation is not None:
+        raise ValueError("a feature store cannot be augmented, pass "
+                         "noise_mix=False and no augment_ops")
+    learn = learner.Learner(estimator, version_path, csv_log_path,
+                            instrumented=instrumented,
+                            profile=profile,
+                            **(learner_options or dict()))
+    if backend == "tf":
+        def make_generator(input_df, mode, augmentation, timer, targets):
+            return tf_pipeline.TFDataLoader(input_df,
+                                            batch_size,
+                                            label_num,
+                                            bg_paths,
+                                            mode=mode,
+                                            sampling_size=sample_size,
+                                            reader=reader,
+                                            augmentation=augmentation,
+                                            parallel_calls=max(workers, 1),
+                                            seed=seed)
+    elif workers > 0:
+        def make_generator(input_df, mode, augmentation, timer, targets):
+            return loader.PrefetchLoader(input_df,
+                                         batch_size,
+                                         label_num,
+                                         bg_paths,
+                                         mode=mode,
+                                         sampling_size=sample_size,
+                                         cache=cache,
+                                         reader=reader,
+                                         augmentation=augmentation,
+                                         workers=workers,
+                                         seed=seed,
+                                         timer=timer,
+                                         frontend=front_end,
+                                         targets=targets)
+    else:
+        def make_generator(input_df, mode, augmentation, timer, targets):
+            return generator.batch_generator(input_df,
+                                             batch_size,
+                                             label_num,
+                                             bg_paths,
+                                             mode=mode,
+                                             sampling_size=sample_size,
+                                             cache=cache,
+                                             reader=reader,
+                                             augmentation=augmentation,
+                                             timer=timer,
+                                             store=store,
+                                             frontend=front_end,
+                                             targets=targets)
+
+    train_generator = make_generator(train_df, 'train', augmentation,
+                                     learn.timer, targets)
+    valid_generator = make_generator(valid_df, 'valid', None, None, None)
     valid_steps = int(np.ceil(valid_df.shape[0]/batch_size))
     steps_per_epoch = int(np.ceil(sample_size*label_num/batch_size))
 
-    learn = learner.Learner(estimator, version_path, csv_log_path)
-    result = learn.learn(train_generator,
-                         valid_generator,
-                         valid_steps,
-                         steps_per_epoch=steps_per_epoch)
+    try:
+        result = learn.learn(train_generator,
+                             valid_generator,
+                             valid_steps,
+                             steps_per_epoch=steps_per_epoch,
+                             epochs=epochs,
+                             initial_epoch=initial_epoch)
+    finally:
+        # loaders, tf pipelines and plain generators all stop on close()
+        train_generator.close()
+        valid_generator.close()
     return result
 
 
@@ -65,7 +209,16 @@ def validation(silence_data_version,
                estimator,
                sample_size=2000,
                batch_size=64,
-               silence_train_size=2000):
+               silence_train_size=2000,
+               use_cache=True,
+               packed_path=None,
+               workers=0,
+               noise_mix=True,
+               augment_ops=(),
+               instrumented=False,
+               profile=False,
+               store=None):
+    """train on the is_valid split, see experiment() for store"""
     file_df, bg_paths, silence_df = data_load(silence_data_version)
     train_df = file_df[~file_df.is_valid]
     valid_df = file_df[file_df.is_valid]
@@ -75,21 +228,332 @@ def validation(silence_data_version,
     train_df = pd.concat([train_df, silence_train])
     valid_df = pd.concat([valid_df, silence_valid])
 
-    estimator.model_init()
+    cache, reader, augmentation = data_resources(bg_paths, use_cache,
+                                                 packed_path, noise_mix,
+                                                 augment_ops,
+                                                 estimator.frontend)
+
+    estimator.model_init(store_shape(store))
     result = experiment(estimator, train_df, valid_df, bg_paths,
-                        batch_size, sample_size)
+                        batch_size, sample_size,
+                        cache=cache,
+                        reader=reader,
+                        workers=workers,
+                        augmentation=augmentation,
+                        instrumented=instrumented,
+                        profile=profile,
+                        store=store)
     return result
 
 
+def compare_frontends(silence_data_version,
+                      names=("stft", "logmel40", "logmel64", "mfcc40"),
+                      **kwargs):
+    """validation accuracy and training time per front end
+
+    Runs validation() once per front end with the same arguments and
+    returns {name: {"val_acc", "epochs", "seconds_per_epoch"}}; pair it
+    with benchmark.run(frontends=names) for the throughput side.
+    """
+    results = dict()
+    for name in names:
+        cnn = model.STFTCNN(frontend=name)
+        start = time.time()
+        history = validation(silence_data_version, cnn, **kwargs)
+        epochs = len(history.history["val_acc"])
+        results[name] = {"val_acc": max(history.history["val_acc"]),
+                         "epochs": epochs,
+                         "seconds_per_epoch": (time.time() - start) / epochs}
+        print(name, results[name])
+    return results
+
+
+def distillation(silence_data_version,
+                 teacher,
+                 cv_path,
+                 student=None,
+                 temperature=4.0,
+                 alpha=0.7,
+                 sample_size=2000,
+                 batch_size=64,
+                 silence_train_size=2000,
+                 use_cache=True,
+                 packed_path=None,
+                 workers=0,
+                 noise_mix=True,
+                 augment_ops=()):
+    """train one student on the fold ensemble of cv_path
+
+    teacher is the estimator the cross validation in cv_path was run
+    with; student defaults to an STFTCNN on the same front end (pass
+    filters=8 for a smaller one). The split is the one of validation().
+    The student trains with distill.distillation_loss on the cached
+    teacher probabilities and is validated on the hard labels. Checkpoint,
+    log and the report cv_path/distill/<version>.json go to their own
+    directory, out of the way of the fold_*.hdf5 globs; the report
+    compares the student's best val_acc with the teacher's out-of-fold
+    accuracy on the same clips (the run's oof.OOFStore). Without the
+    store the teacher is scored by the fold ensemble, whose folds trained
+    on the validation clips: the report then says "comparable": false and
+    leaves "retained" out.
+    """
+    from tensorflow.python.keras import backend as K
+
+    if student is None:
+        student = model.STFTCNN(name="STFTCNN_student",
+                                frontend=teacher.frontend)
+    file_df, bg_paths, silence_df = data_load(silence_data_version)
+    train_df = pd.concat([file_df[~file_df.is_valid],
+                          silence_df.iloc[:silence_train_size]])
+    valid_df = pd.concat([file_df[file_df.is_valid],
+                          silence_df.iloc[silence_train_size:]])
+
+    cache, reader, augmentation = data_resources(bg_paths, use_cache,
+                                                 packed_path, noise_mix,
+                                                 augment_ops,
+                                                 student.frontend)
+    teacher_cache = cache if teacher.frontend == student.frontend else None
+    valid_probs = distill.oof_teacher_probs(teacher.name,
+                                            Path(cv_path).name, valid_df)
+    comparable = valid_probs is not None
+    if comparable:
+        train_probs = distill.teacher_probs(teacher, cv_path, train_df,
+                                            bg_paths, teacher_cache, reader,
+                                            batch_size)
+    else:
+        probs = distill.teacher_probs(teacher, cv_path,
+                                      pd.concat([train_df, valid_df]),
+                                      bg_paths, teacher_cache, reader,
+                                      batch_size)
+        train_probs = probs[:len(train_df)]
+        valid_probs = probs[len(train_df):]
+    teacher.model_init()
+    teacher_params = teacher.model.count_params()
+    n_folds = len(list(Path(cv_path).glob("fold_*.hdf5")))
+    K.clear_session()
+
+    version = utils.now()
+    distill_path = Path(cv_path)/"distill"
+    distill_path.mkdir(exist_ok=True)
+    targets = distill.soft_targets(train_probs, train_df.plnum.values,
+                                   temperature)
+    student.model_init()
+    distill.compile_student(student.model, temperature, alpha)
+    history = experiment(student, train_df, valid_df, bg_paths,
+                         batch_size, sample_size,
+                         version_path=str(distill_path/"{}.hdf5"
+                                          .format(version)),
+                         csv_log_path=str(distill_path/"{}_log.csv"
+                                          .format(version)),
+                         cache=cache,
+                         reader=reader,
+                         workers=workers,
+                         augmentation=augmentation,
+                         targets=targets)
+
+    teacher_acc = float(np.mean(np.argmax(valid_probs, axis=1) ==
+                                valid_df.plnum.values))
+    student_acc = float(max(history.history["val_acc"]))
+    report = {"teacher_val_acc": teacher_acc,
+              "student_val_acc": student_acc,
+              "comparable": comparable,
+              "retained": (student_acc / teacher_acc
+                           if comparable and teacher_acc > 0 else None),
+              "folds": n_folds,
+              "teacher_params": teacher_params,
+              "student_params": student.model.count_params(),
+              "inference_cost": (student.model.count_params() /
+                                 (n_folds * teacher_params)),
+              "temperature": temperature,
+              "alpha": alpha,
+              "student": student.name,
+              "student_filters": student.filters}
+    with open(str(distill_path/"{}.json".format(version)), "w") as fout:
+        json.dump(report, fout, indent=2)
+    print(report)
+    return report
+
+
+SPLIT_NAMES = ("train", "test", "train_silence", "test_silence")
+
+
+def clip_ordering(file_df, silence_data):
+    """digest of the clip paths in file_df and silence_data row order"""
+    paths = np.concatenate([file_df.path.values, silence_data.path.values])
+    return hashlib.sha1("\n".join(paths.astype(str)).encode()).hexdigest()
+
+
+def fold_splits(file_df, silence_data, n_splits, split_path=None):
+    """(train, test, train_silence, test_silence) row positions per fold
+
+    file_df is split by uid, silence_data by row. With split_path the
+    splits are saved on the first call and loaded afterwards, so reruns
+    and retried folds train on the same split. n_splits None only loads
+    split_path, which then has to exist. The positions are only valid for
+    the rows they were drawn from: split_path keeps a digest of the clip
+    ordering and a file written for another ordering raises ValueError.
+    """
+    if n_splits is None and (split_path is None or
+                             not Path(split_path).exists()):
+        raise FileNotFoundError("no saved fold splits at {}".format(
+            split_path))
+    ordering = clip_ordering(file_df, silence_data)
+    if split_path is not None and Path(split_path).exists():
+        saved = np.load(str(split_path))
+        if "ordering" not in saved.files or saved["ordering"] != ordering:
+            raise ValueError("{} was split for another train file info or "
+                             "silence data, delete it to split again"
+                             .format(split_path))
+        n_saved = (len(saved.files) - 1) // len(SPLIT_NAMES)
+        return [tuple(saved["{}_{}".format(name, i)] for name in SPLIT_NAMES)
+                for i in range(n_saved)]
+
+    uid_list = file_df.uid.unique()
+    kfold_data = KFold(n_splits=n_splits, shuffle=True).split(uid_list)
+    kfold_silence = KFold(n_splits=n_splits, shuffle=True).split(silence_data)
+    uids = file_df.uid.values
+
+    splits = list()
+    for (train, test), (train_silence, test_silence) in zip(kfold_data,
+                                                            kfold_silence):
+        splits.append((np.flatnonzero(np.isin(uids, uid_list[train])),
+                       np.flatnonzero(np.isin(uids, uid_list[test])),
+                       train_silence,
+                       test_silence))
+
+    if split_path is not None:
+        np.savez(str(split_path),
+                 ordering=ordering,
+                 **{"{}_{}".format(name, i): positions
+                    for i, split in enumerate(splits)
+                    for name, positions in zip(SPLIT_NAMES, split)})
+    return splits
+
+
+def cross_validation_fold(estimator, fold, split, file_df, silence_data,
+                          bg_paths, version_path, batch_size, sample_size,
+                          cache=None, reader=None, workers=0,
+                          augmentation=None, instrumented=False,
+                          profile=False, test_paths=None, store=None):
+    """train one fold into version_path/fold_{fold}.hdf5
+
+    fold_{fold}.done is written once the fold finished, so reruns can
+    skip it. With instrumented, fold_{fold}_throughput.csv is written
+    next to fold_{fold}_log.csv. The best checkpoint then scores the held
+    out clips, and test_paths when given, into the oof.OOFStore of the
+    run. store trains and scores the held out clips from a
+    feature_store.FeatureStore.
+    """
+    train, test, train_silence, test_silence = split
+    train = pd.concat([file_df.iloc[train],
+                       silence_data.iloc[train_silence]])
+    test = pd.concat([file_df.iloc[test],
+                      silence_data.iloc[test_silence]])
+    print(fold, len(train), len(test))
+
+    fold_dump_path = str(version_path / "fold_{}.hdf5".format(fold))
+    csv_log_path = str(version_path / "fold_{}_log.csv".format(fold))
+
+    estimator.model_init(store_shape(store))  # initialize model
+
+    res_fold = experiment(estimator, train, test, bg_paths,
+                          batch_size, sample_size,
+                          version_path=fold_dump_path,
+                          csv_log_path=csv_log_path,
+                          cache=cache,
+                          reader=reader,
+                          workers=workers,
+                          augmentation=augmentation,
+                          instrumented=instrumented,
+                          profile=profile,
+                          store=store)
+    estimator.model.load_weights(fold_dump_path)
+    store_fold_predictions(estimator, fold, test, bg_paths, version_path,
+                           test_paths, cache, reader, store)
+    (version_path / "fold_{}.done".format(fold)).touch()
+    return res_fold
+
+
+def store_fold_predictions(estimator, fold, test, bg_paths, version_path,
+                           test_paths=None, cache=None, reader=None,
+                           feature_store=None):
+    """out-of-fold (and test) probabilities of estimator.model"""
+    store = oof.OOFStore(estimator.name, version_path.name)
+    front_end = frontend.get(estimator.frontend)
+    store.write_oof(fold, test.path.values, test.plnum.values,
+                    oof.predict_probs(estimator.model, test, bg_paths,
+                                      front_end, cache, reader,
+                                      store=feature_store))
+    if test_paths is not None:
+        fnames = test_paths["path"].astype(str).str.split("/").str[-1]
+        store.write_test(fold, fnames.values,
+                         oof.predict_probs(estimator.model, test_paths,
+                                           bg_paths, front_end,
+                                           reader=reader))
+
+
+def check_store(store, predict_test):
+    if store is not None and predict_test:
+        raise ValueError("the feature store has no test clips, pass "
+                         "predict_test=False")
+
+
+def test_paths_for(predict_test, reader=None, store=None):
+    check_store(store, predict_test)
+    if not predict_test:
+        return None
+    import submit
+    return submit.test_data_load(reader)[0]
+
+
+def backfill_oof(estimator, silence_data_version, cv_version,
+                 predict_test=True, use_cache=True, packed_path=None):
+    """fill the oof.OOFStore of a run trained before the store existed
+
+    Uses the run's folds.npz and fold_{i}.hdf5 checkpoints.
+    """
+    version_path = Path("cv/")/estimator.name/cv_version
+    file_df, bg_paths, silence_data = data_load(silence_data_version)
+    file_df = file_df.drop(["is_valid"], axis=1)
+    splits = fold_splits(file_df, silence_data, None,
+                         version_path/"folds.npz")
+    cache, reader, _ = data_resources(bg_paths, use_cache, packed_path,
+                                      noise_mix=False,
+                                      frontend_name=estimator.frontend)
+    test_paths = test_paths_for(predict_test, reader)
+
+    for fold, (_, test, _, test_silence) in enumerate(splits):
+        estimator.model_init()
+        estimator.model.load_weights(
+            str(version_path/"fold_{}.hdf5".format(fold)))
+        test_df = pd.concat([file_df.iloc[test],
+                             silence_data.iloc[test_silence]])
+        store_fold_predictions(estimator, fold, test_df, bg_paths,
+                               version_path, test_paths, cache, reader)
+
+
 def cross_validation(estimator,
                      silence_data_version,
                      cv_version,
                      n_splits=5,
                      sample_size=1800,
                      batch_size=64,
-                     silence_train_size=1800):
-    
+                     silence_train_size=1800,
+                     use_cache=True,
+                     packed_path=None,
+                     workers=0,
+                     noise_mix=True,
+                     augment_ops=(),
+                     instrumented=False,
+                     profile=False,
+                     predict_test=True,
+                     store=None):
+
     """cross_validation func with silence_data
+
+    Out-of-fold probabilities go to the oof.OOFStore of the run, test
+    probabilities too with predict_test. store, a
+    feature_store.FeatureStore, replaces featurizing (see experiment()).
     """
 
     version_path = Path("cv/")/estimator.name/cv_version
@@ -97,40 +561,174 @@ def cross_validation(estimator,
     file_df, bg_paths, silence_data = data_load(silence_data_version)
     file_df = file_df.drop(["is_valid"], axis=1)
 
-    uid_list = file_df.uid.unique()
-    kfold_data = KFold(n_splits=n_splits, shuffle=True).split(uid_list)
-    kfold_silence = KFold(n_splits=n_splits, shuffle=True).split(silence_data)
-    kfold = zip(kfold_data, kfold_silence)
+    splits = fold_splits(file_df, silence_data, n_splits,
+                         version_path/"folds.npz")
     result = list()
 
-    for i, ((train, test), (train_silence, test_silence)) in enumerate(kfold):
-        train_uid = uid_list[train]
-        test_uid = uid_list[test]
+    # folds share one cache, so each clip is featurized once per run
+    cache, reader, augmentation = data_resources(bg_paths, use_cache,
+                                                 packed_path, noise_mix,
+                                                 augment_ops,
+                                                 estimator.frontend)
+    test_paths = test_paths_for(predict_test, reader, store)
 
-        train = file_df[file_df.uid.isin(train_uid)]
-        test = file_df[file_df.uid.isin(test_uid)]
-        train = pd.concat([train, silence_data.iloc[train_silence]])
-        test = pd.concat([test, silence_data.iloc[test_silence]])
-        print(i, len(train), len(test))
+    for i, split in enumerate(splits):
+        res_fold = cross_validation_fold(estimator, i, split,
+                                         file_df, silence_data, bg_paths,
+                                         version_path,
+                                         batch_size, sample_size,
+                                         cache=cache,
+                                         reader=reader,
+                                         workers=workers,
+                                         augmentation=augmentation,
+                                         instrumented=instrumented,
+                                         profile=profile,
+                                         test_paths=test_paths,
+                                         store=store)
+        result.append(res_fold)
 
-        fold_dump_path = str(version_path / "fold_{}.hdf5".format(i))
-        csv_log_path = str(version_path / "fold_{}_log.csv".format(i))
+    return result
 
-        estimator.model_init()  # initialize model
 
-        res_fold = experiment(estimator, train, test, bg_paths,
-                              batch_size, sample_size,
-                              version_path=fold_dump_path,
-                              csv_log_path=csv_log_path)
-        result.append(res_fold)
+def _fold_worker(estimator, fold, silence_data_version, version_path,
+                 threads, seed, batch_size, sample_size, workers, options,
+                 instrumented=False, profile=False, predict_test=True,
+                 store=None):
+    utils.set_seed(seed)
+    utils.configure_session(threads)
 
-    return result
+    file_df, bg_paths, silence_data = data_load(silence_data_version)
+    file_df = file_df.drop(["is_valid"], axis=1)
+    splits = fold_splits(file_df, silence_data, None,
+                         version_path/"folds.npz")
+    cache, reader, augmentation = data_resources(bg_paths, **options)
 
+    cross_validation_fold(estimator, fold, splits[fold],
+                          file_df, silence_data, bg_paths,
+                          version_path, batch_size, sample_size,
+                          cache=cache,
+                          reader=reader,
+                          workers=workers,
+                          augmentation=augmentation,
+                          instrumented=instrumented,
+                          profile=profile,
+                          test_paths=test_paths_for(predict_test, reader,
+                                                    store),
+                          store=store)
 
-if __name__ == "__main__":
-    utils.set_seed(2017)
 
-    cnn = model.STFTCNN()
-    silence_data_version = "2017_12_08_15_41_26"
-    cv_version = utils.now()
-    res = cross_validation(cnn, silence_data_version, cv_version)
+def parallel_cross_validation(estimator,
+                              silence_data_version,
+                              cv_version,
+                              n_splits=5,
+                              sample_size=1800,
+                              batch_size=64,
+                              fold_workers=None,
+                              threads=None,
+                              folds=None,
+                              retries=1,
+                              seed=2017,
+                              workers=0,
+                              use_cache=True,
+                              packed_path=None,
+                              noise_mix=True,
+                              augment_ops=(),
+                              instrumented=False,
+                              profile=False,
+                              predict_test=True,
+                              store=None):
+    """cross_validation with every fold in its own process
+
+    Each fold process gets its own TF session limited to threads intra op
+    threads (cpu count / fold_workers by default) and writes the same
+    fold_{i}.hdf5 / fold_{i}_log.csv as cross_validation. Folds that
+    already have fold_{i}.done are skipped unless listed in folds, and a
+    failed fold is retried up to retries times without touching the
+    others. A store is pickled to the fold processes, which reopen its
+    file. Returns the folds that still failed.
+    """
+    check_store(store, predict_test)
+    version_path = Path("cv/")/estimator.name/cv_version
+    version_path.mkdir(parents=True, exist_ok=True)
+    file_df, _, silence_data = data_load(silence_data_version)
+    file_df = file_df.drop(["is_valid"], axis=1)
+    # written here once, so every fold process reads the same split
+    splits = fold_splits(file_df, silence_data, n_splits,
+                         version_path/"folds.npz")
+
+    if folds is None:
+        folds = [i for i in range(len(splits))
+                 if not (version_path/"fold_{}.done".format(i)).exists()]
+    if fold_workers is None:
+        fold_workers = len(folds)
+    fold_workers = max(1, min(fold_workers, len(folds)))
+    if threads is None:
+        threads = max(1, mp.cpu_count() // fold_workers)
+
+    options = {"use_cache": use_cache,
+               "packed_path": packed_path,
+               "noise_mix": noise_mix,
+               "augment_ops": augment_ops,
+               "frontend_name": estimator.frontend}
+    # TF is not fork safe, fold processes start from a clean interpreter
+    context = mp.get_context("spawn")
+    attempts = {fold: 0 for fold in folds}
+    waiting = list(folds)
+    running = dict()
+    failed = list()
+
+    while waiting or running:
+        while waiting and len(running) < fold_workers:
+            fold = waiting.pop(0)
+            attempts[fold] += 1
+            process = context.Process(target=_fold_worker,
+                                      args=(estimator, fold,
+                                            silence_data_version,
+                                            version_path, threads,
+                                            seed + fold, batch_size,
+                                            sample_size, workers, options,
+                                            instrumented, profile,
+                                            predict_test, store))
+            process.start()
+            running[fold] = process
+
+        for fold, process in list(running.items()):
+            process.join(timeout=1)
+            if process.exitcode is None:
+                continue
+            del running[fold]
+            if process.exitcode == 0:
+                continue
+            print("fold {} failed with exit code {}".format(fold,
+                                                           process.exitcode))
+            if attempts[fold] <= retries:
+                waiting.append(fold)
+            else:
+                failed.append(fold)
+
+    return failed
+
+
+def main(silence_data_version="2017_12_08_15_41_26", cv_version=None,
+         seed=2017, name="STFTCNN", frontend_name="stft", filters=16,
+         fold_workers=None, **kwargs):
+    """cross validate an STFTCNN, returns the cv version
+
+    With fold_workers the folds run in parallel processes
+    (parallel_cross_validation), kwargs go to the cross validation.
+    """
+    utils.set_seed(seed)
+
+    cnn = model.STFTCNN(name, frontend=frontend_name, filters=filters)
+    cv_version = cv_version or utils.now()
+    if fold_workers is None:
+        cross_validation(cnn, silence_data_version, cv_version, **kwargs)
+    else:
+        parallel_cross_validation(cnn, silence_data_version, cv_version,
+                                  fold_workers=fold_workers, seed=seed,
+                                  **kwargs)
+    return cv_version
+
+
+if __name__ == "__main__":
+    main()
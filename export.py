@@ -0,0 +1,308 @@
+import json
+import time
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.keras import backend as K
+from tensorflow.python.keras.models import Model
+from tensorflow.python.keras.layers import Input, Conv2D, MaxPooling2D
+from tensorflow.python.keras.layers import Activation, BatchNormalization
+from tensorflow.python.keras.layers import GlobalAveragePooling2D
+from tensorflow.python.keras.layers import GlobalMaxPool2D
+from tensorflow.python.keras.layers import concatenate, Dense
+import config
+import frontend as frontends
+import generator
+import model
+import utils
+
+"""
+Inference export for STFTCNN fold checkpoints.
+
+export_cv turns every cv/<model>/<version>/fold_{i}.hdf5 into
+cv/<model>/<version>/export/fold_{i}.pb (BatchNorm folded into the convs,
+Dropout stripped, variables frozen) and, with quantize, fold_{i}.tflite
+with int8 weights and activations calibrated on training clips. Both load
+with load_runners, whose runners have the predict_on_batch of a keras
+model, so submit.py, server.py and streaming.py can use them as is.
+compare_runtimes writes export/report.json with accuracy and clips/sec of
+keras vs frozen float32 vs int8.
+"""
+
+EXPORT_DIR = "export"
+
+
+def bn_scale_shift(gamma, beta, mean, variance, epsilon):
+    """inference BatchNorm as y = x * scale + shift"""
+    scale = gamma / np.sqrt(variance + epsilon)
+    return scale, beta - mean * scale
+
+
+def fold_into_conv(kernel, bias, scale, shift):
+    """kernel, bias of conv(x * scale + shift) as a conv of x
+
+    Exact for 'valid' padding only, zero padding would skip the shift.
+    """
+    folded_kernel = kernel * scale[None, None, :, None]
+    folded_bias = bias + np.einsum("hwio,i->o", kernel, shift)
+    return folded_kernel, folded_bias
+
+
+def foldable(scale, padding, pooled):
+    """whether a BatchNorm can move into the next conv
+
+    With a max pool in between this needs a positive scale on every
+    channel, max(x * s + b) = max(x) * s + b only holds for s > 0.
+    """
+    if padding != "valid":
+        return False
+    return not pooled or bool((scale > 0).all())
+
+
+def inference_model(trained, input_shape):
+    """STFTCNN rebuilt for inference with the weights of trained
+
+    Block i of STFTCNN is conv, elu, BatchNorm, max pool, so every
+    BatchNorm is folded forward into the conv after it (the input
+    BatchNorm into the first conv). A BatchNorm that cannot be folded is
+    kept as an inference mode layer.
+    """
+    batch_norms = [x for x in trained.layers
+                   if isinstance(x, BatchNormalization)]
+    convs = [x for x in trained.layers if isinstance(x, Conv2D)]
+    denses = [x for x in trained.layers if isinstance(x, Dense)]
+
+    x_in = Input(shape=input_shape)
+    x = x_in
+    folded = 0
+    for i, (batch_norm, conv) in enumerate(zip(batch_norms, convs)):
+        kernel, bias = conv.get_weights()
+        scale, shift = bn_scale_shift(*batch_norm.get_weights(),
+                                      batch_norm.epsilon)
+        if foldable(scale, conv.padding, pooled=i > 0):
+            kernel, bias = fold_into_conv(kernel, bias, scale, shift)
+            folded += 1
+        else:
+            kept = BatchNormalization.from_config(batch_norm.get_config())
+            x = kept(x)
+            kept.set_weights(batch_norm.get_weights())
+        if i > 0:
+            x = MaxPooling2D((2, 2))(x)
+        x = Conv2D(conv.filters, conv.kernel_size, padding=conv.padding,
+                   weights=[kernel, bias])(x)
+        if i < len(convs) - 1:
+            x = Activation('elu')(x)
+
+    x = concatenate([GlobalAveragePooling2D()(x), GlobalMaxPool2D()(x)])
+    x = Dense(denses[0].units, activation='relu',
+              weights=denses[0].get_weights())(x)
+    x = Dense(denses[1].units, activation='softmax',
+              weights=denses[1].get_weights())(x)
+    print("folded {} of {} BatchNorm layers".format(folded,
+                                                    len(batch_norms)))
+    return Model(inputs=x_in, outputs=x)
+
+
+def freeze(keras_model, pb_path):
+    """write keras_model as a frozen GraphDef, return its metadata"""
+    session = K.get_session()
+    output_name = keras_model.output.op.name
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        session, session.graph.as_graph_def(), [output_name])
+    graph_def = tf.graph_util.remove_training_nodes(graph_def)
+    pb_path = Path(pb_path)
+    tf.train.write_graph(graph_def, str(pb_path.parent), pb_path.name,
+                         as_text=False)
+    return {"input": keras_model.input.op.name,
+            "output": output_name,
+            "input_shape": [int(x) for x in keras_model.input.shape[1:]]}
+
+
+def _lite():
+    if hasattr(tf, "lite"):
+        return tf.lite
+    return tf.contrib.lite
+
+
+def quantize_int8(pb_path, meta, calibration, tflite_path):
+    """post training int8 TFLite model, calibrated on calibration features"""
+    lite = _lite()
+    converter = lite.TFLiteConverter.from_frozen_graph(
+        str(pb_path), [meta["input"]], [meta["output"]],
+        input_shapes={meta["input"]: [1] + meta["input_shape"]})
+    converter.optimizations = [lite.Optimize.DEFAULT]
+    converter.representative_dataset = lambda: (
+        [x[None].astype(np.float32)] for x in calibration)
+    converter.target_spec.supported_ops = [lite.OpsSet.TFLITE_BUILTINS_INT8]
+    Path(tflite_path).write_bytes(converter.convert())
+
+
+def calibration_features(frontend="stft", n_clips=200, seed=2017):
+    """front end features of n_clips random training clips"""
+    file_df = utils.read_file_info()
+    file_df = file_df[(file_df.plnum >= 0) & ~file_df.is_valid]
+    paths = file_df.path.sample(n_clips, random_state=seed).values
+    return generator.make_batch(paths, frontend=frontends.get(frontend))
+
+
+def export_fold(weight_path, export_path, frontend="stft", calibration=None):
+    """fold_{i}.hdf5 -> export_path/fold_{i}.pb (+ .tflite, .json)"""
+    weight_path = Path(weight_path)
+    export_path = Path(export_path)
+    export_path.mkdir(parents=True, exist_ok=True)
+
+    K.clear_session()
+    K.set_learning_phase(0)
+    cnn = model.STFTCNN(frontend=frontend)
+    cnn.model_init()
+    cnn.model.load_weights(str(weight_path))
+    inference = inference_model(cnn.model, frontends.get(frontend)
+                                .feature_shape)
+
+    pb_path = export_path/weight_path.with_suffix(".pb").name
+    meta = freeze(inference, pb_path)
+    meta["frontend"] = frontends.get(frontend).name
+    with open(str(pb_path.with_suffix(".json")), "w") as fout:
+        json.dump(meta, fout, indent=2)
+    if calibration is not None:
+        quantize_int8(pb_path, meta, calibration,
+                      pb_path.with_suffix(".tflite"))
+    return pb_path
+
+
+def export_cv(cv_path, frontend="stft", quantize=True, n_calibration=200):
+    calibration = None
+    if quantize:
+        calibration = calibration_features(frontend, n_calibration)
+    export_path = Path(cv_path)/EXPORT_DIR
+    weight_paths = sorted(Path(cv_path).glob("fold_*.hdf5"))
+    return [export_fold(weight_path, export_path, frontend, calibration)
+            for weight_path in weight_paths]
+
+
+class FrozenRunner():
+    """float32 runner for an exported .pb"""
+
+    def __init__(self, pb_path, threads=None):
+        pb_path = Path(pb_path)
+        with open(str(pb_path.with_suffix(".json"))) as fin:
+            self.meta = json.load(fin)
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(pb_path.read_bytes())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        session_config = None
+        if threads is not None:
+            session_config = tf.ConfigProto(
+                intra_op_parallelism_threads=threads,
+                inter_op_parallelism_threads=1)
+        self.session = tf.Session(graph=self.graph, config=session_config)
+        self.input = self.graph.get_tensor_by_name(self.meta["input"] + ":0")
+        self.output = self.graph.get_tensor_by_name(
+            self.meta["output"] + ":0")
+
+    def predict_on_batch(self, x_batch):
+        return self.session.run(self.output, {self.input: x_batch})
+
+
+class TFLiteRunner():
+    """int8 runner for an exported .tflite, inputs and outputs are float"""
+
+    def __init__(self, tflite_path, threads=None):
+        tflite_path = Path(tflite_path)
+        with open(str(tflite_path.with_suffix(".json"))) as fin:
+            self.meta = json.load(fin)
+        kwargs = dict()
+        if threads is not None:
+            kwargs["num_threads"] = threads
+        self.interpreter = _lite().Interpreter(model_path=str(tflite_path),
+                                               **kwargs)
+        self.input = self.interpreter.get_input_details()[0]["index"]
+        self.output = self.interpreter.get_output_details()[0]["index"]
+        self.batch_size = None
+
+    def predict_on_batch(self, x_batch):
+        if len(x_batch) != self.batch_size:
+            self.interpreter.resize_tensor_input(
+                self.input, [len(x_batch)] + self.meta["input_shape"])
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(x_batch)
+        self.interpreter.set_tensor(self.input,
+                                    np.asarray(x_batch, dtype=np.float32))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output).copy()
+
+
+RUNNERS = {"pb": FrozenRunner, "tflite": TFLiteRunner}
+
+
+def load_runners(cv_path, runtime="pb", threads=None):
+    """one runner per exported fold under cv_path/export"""
+    paths = sorted((Path(cv_path)/EXPORT_DIR).glob("*." + runtime))
+    if not paths:
+        raise ValueError("no exported *.{} models in {}".format(
+            runtime, Path(cv_path)/EXPORT_DIR))
+    return [RUNNERS[runtime](path, threads) for path in paths]
+
+
+def evaluate(fold_models, x_valid, y_valid, batch_size=64):
+    """ensemble accuracy and clips/sec of fold_models on x_valid"""
+    start = time.perf_counter()
+    probs = np.concatenate([
+        np.mean([fold_model.predict_on_batch(x_valid[i:i + batch_size])
+                 for fold_model in fold_models], axis=0)
+        for i in range(0, len(x_valid), batch_size)])
+    elapsed = time.perf_counter() - start
+    return {"accuracy": float(np.mean(np.argmax(probs, axis=1) == y_valid)),
+            "clips_per_sec": len(x_valid) / elapsed,
+            "folds": len(fold_models)}
+
+
+def compare_runtimes(cv_path, frontend="stft", n_clips=2000, seed=2017,
+                     runtimes=("keras", "pb", "tflite")):
+    """accuracy and throughput per runtime on validation clips
+
+    Written to cv_path/export/report.json.
+    """
+    import submit
+
+    file_df = utils.read_file_info()
+    file_df = file_df[(file_df.plnum >= 0) & file_df.is_valid]
+    file_df = file_df.sample(min(n_clips, len(file_df)), random_state=seed)
+    x_valid = generator.make_batch(file_df.path.values,
+                                   frontend=frontends.get(frontend))
+    y_valid = file_df.plnum.values
+
+    report = {"clips": len(file_df),
+              "labels": list(config.POSSIBLE_LABELS)}
+    for runtime in runtimes:
+        if runtime == "keras":
+            K.clear_session()
+            fold_models = submit.load_cv_models(
+                model.STFTCNN(frontend=frontend), cv_path)
+        else:
+            fold_models = load_runners(cv_path, runtime)
+        fold_models[0].predict_on_batch(x_valid[:1])
+        report[runtime] = evaluate(fold_models, x_valid, y_valid)
+        print(runtime, report[runtime])
+
+    with open(str(Path(cv_path)/EXPORT_DIR/"report.json"), "w") as fout:
+        json.dump(report, fout, indent=2)
+    return report
+
+
+def main(cv_path="cv/STFTCNN/2017_12_11_13_14_00", frontend="stft",
+         quantize=True, n_calibration=200, compare=True, n_clips=2000):
+    """export_cv and, with compare, compare_runtimes of cv_path"""
+    export_cv(cv_path, frontend, quantize, n_calibration)
+    if compare:
+        runtimes = ("keras", "pb", "tflite") if quantize else ("keras", "pb")
+        return compare_runtimes(cv_path, frontend, n_clips,
+                                runtimes=runtimes)
+
+
+if __name__ == "__main__":
+    import sys
+    import cli
+    cli.main(["export"] + sys.argv[1:])
@@ -1,64 +1,135 @@
-import re
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 import config
+import utils
 
+"""
+Build data/train_file_info.csv (and .feather) from the training tree.
 
-def extract_uid_and_nohash(wav_path):
-    uid_pattern = r'^(\w+)_nohash_(\d+).wav'
-    label = wav_path.parts[-2]
-    
-    if label == "_background_noise_":
-        uid = 'No User'
-        nohash = -1
-    else:
-        x = re.match(uid_pattern, wav_path.parts[-1])
-        uid = x.group(1)
-        nohash = x.group(2)
-    
-    return pd.Series({"absolute path": wav_path.absolute(),
-                      "label": label,
-                      "uid": uid,
-                      "nohash": nohash})
+Label directories are scanned in parallel. On re-runs, rows whose size and
+mtime did not change since the previous file info are reused as they are.
+"""
 
+UID_PATTERN = r'^(\w+)_nohash_(\d+)\.wav$'
+BACKGROUND_NOISE = "_background_noise_"
 
-def is_list(wav_path, file_list):
-    return '/'.join(wav_path.parts[-2:]) in file_list
+
+def scan_label_dir(label_dir):
+    """(path, size, mtime_ns) for every wav in label_dir"""
+    rows = list()
+    for entry in os.scandir(label_dir):
+        if entry.name.endswith(".wav"):
+            stat = entry.stat()
+            rows.append((os.path.join(label_dir, entry.name),
+                         stat.st_size,
+                         stat.st_mtime_ns))
+    return rows
+
+
+def scan_audio(audio_path, workers=8):
+    label_dirs = sorted(entry.path for entry in os.scandir(str(audio_path))
+                        if entry.is_dir())
+    with ThreadPoolExecutor(workers) as pool:
+        scanned = [row for rows in pool.map(scan_label_dir, label_dirs)
+                   for row in rows]
+    scan_df = pd.DataFrame(scanned, columns=["path", "size", "mtime_ns"])
+    return scan_df.sort_values("path").reset_index(drop=True)
+
+
+def extract_uid_and_nohash(scan_df):
+    columns = ["absolute path", "label", "uid", "nohash"]
+    if len(scan_df) == 0:
+        return pd.DataFrame(columns=columns, index=scan_df.index)
+
+    parts = scan_df.path.str.rsplit(os.sep, n=2, expand=True)
+    label = parts[1]
+    fname = parts[2]
+
+    extracted = fname.str.extract(UID_PATTERN)
+    is_bg = label == BACKGROUND_NOISE
+    uid = extracted[0].where(~is_bg, "No User")
+    nohash = extracted[1].where(~is_bg, "-1").astype(int)
+
+    cwd = os.path.join(os.getcwd(), "")
+    return pd.DataFrame({"absolute path": cwd + scan_df.path,
+                         "label": label,
+                         "uid": uid,
+                         "nohash": nohash},
+                        columns=columns,
+                        index=scan_df.index)
+
+
+def reuse_previous(scan_df, previous):
+    """split scan_df into rows reusable from previous and rows to extract"""
+    if previous is None or "size" not in previous:
+        return None, scan_df
+
+    previous = previous.drop_duplicates("path").set_index("path")
+    known = previous.reindex(scan_df.path)
+    unchanged = ((known["size"].values == scan_df["size"].values) &
+                 (known["mtime_ns"].values == scan_df["mtime_ns"].values))
+    reused = known[unchanged].reset_index()
+    reused.index = scan_df.index[unchanged]
+    return reused, scan_df[~unchanged]
 
 
 def possible_labeling(label, possible):
-    if label == "_background_noise_":
-        return "_background_noise_"
-    elif label not in possible:
-        return "unknown"
-    else:
-        return label
+    possible_label = label.where(label.isin(possible), "unknown")
+    return possible_label.where(label != BACKGROUND_NOISE, BACKGROUND_NOISE)
 
 
-if __name__ == '__main__':
-    audio_path = Path(config.TRAIN_AUDIO_PATH)
-    train_path = Path(config.TRAIN_PATH)
+def build_file_info(audio_path, valid_list, previous=None, workers=8):
     label2n = dict(zip(config.POSSIBLE_LABELS,
                        range(len(config.POSSIBLE_LABELS))))
 
-    train_wavs = pd.Series(audio_path.glob('**/*.wav'), name="path")
-    v = train_wavs.apply(extract_uid_and_nohash)
-    train_file_info = pd.concat([train_wavs, v], axis=1)
-    
-    with open(Path.joinpath(train_path,
-                            "validation_list.txt"), "r") as valid_list:
-        valid_list = valid_list.readlines()
-        
-    valid_list = [fname.replace('\n', '') for fname in valid_list]
-
-    def is_valid(path):
-        return is_list(path, valid_list)
-
-    def possible(label):
-        return possible_labeling(label, config.POSSIBLE_LABELS)
-
-    train_file_info["is_valid"] = train_file_info['path'].apply(is_valid)
-    train_file_info["possible_label"] = train_file_info.label.apply(possible)
-    train_file_info["plnum"] = train_file_info.possible_label.replace(label2n)
-    
-    train_file_info.to_csv("data/train_file_info.csv")
+    scan_df = scan_audio(audio_path, workers)
+    reused, changed = reuse_previous(scan_df, previous)
+    print("{} files, {} new or changed".format(len(scan_df), len(changed)))
+
+    info = extract_uid_and_nohash(changed)
+    if reused is not None:
+        info = pd.concat([reused[info.columns], info]).loc[scan_df.index]
+    train_file_info = pd.concat([scan_df, info], axis=1)
+
+    relative = train_file_info.label + "/" + \
+        train_file_info.path.str.rsplit(os.sep, n=1).str[-1]
+    train_file_info["is_valid"] = relative.isin(set(valid_list))
+    train_file_info["possible_label"] = possible_labeling(
+        train_file_info.label, config.POSSIBLE_LABELS)
+    # background noise clips are not a class, they get -1
+    train_file_info["plnum"] = train_file_info.possible_label.map(label2n)
+    train_file_info["plnum"] = train_file_info.plnum.fillna(-1).astype(int)
+    return train_file_info
+
+
+def write_file_info(train_file_info, csv_path=config.TRAIN_FILE_META_INFO):
+    train_file_info.to_csv(csv_path, index=False)
+    try:
+        train_file_info.to_feather(utils.feather_path(csv_path))
+    except ImportError:
+        print("pyarrow is not installed, skipped the feather copy")
+
+
+def main(audio_path=None, train_path=None, csv_path=None, workers=8):
+    """scan the training tree and write the train file info"""
+    audio_path = Path(audio_path or config.TRAIN_AUDIO_PATH)
+    train_path = Path(train_path or config.TRAIN_PATH)
+    csv_path = csv_path or config.TRAIN_FILE_META_INFO
+
+    with open(str(train_path/"validation_list.txt"), "r") as valid_list:
+        valid_list = [fname.replace('\n', '') for fname in valid_list]
+
+    previous = None
+    if Path(csv_path).exists():
+        previous = utils.read_file_info(csv_path)
+
+    train_file_info = build_file_info(audio_path, valid_list, previous,
+                                      workers)
+    write_file_info(train_file_info, csv_path)
+    return train_file_info
+
+
+if __name__ == '__main__':
+    main()
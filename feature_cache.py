@@ -0,0 +1,100 @@
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import config
+
+
+class FeatureCache():
+    """Two tier (memory LRU + disk) cache for deterministic spectrograms.
+
+    Entries are keyed by file path, mtime and the feature parameters, so
+    editing a wav file or changing the STFT settings never hits a stale
+    entry. The disk tier is only used with a cache_dir, which defaults to
+    config.FEATURE_CACHE_PATH (unset by default).
+    """
+
+    def __init__(self, params,
+                 cache_dir=config.FEATURE_CACHE_PATH,
+                 memory_limit=2 * 1024 ** 3):
+
+        self.raw_params = params
+        self.params = sorted(params.items())
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self.memory_limit = memory_limit
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, fname, mtime=None, kind="feature"):
+        if mtime is None:
+            mtime = os.path.getmtime(fname)
+        raw = "{}|{}|{}|{}".format(kind,
+                                   os.path.abspath(str(fname)),
+                                   mtime,
+                                   self.params)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return self.cache_dir/key[:2]/"{}.npy".format(key)
+
+    def _remember(self, key, feature):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        if feature.nbytes > self.memory_limit:
+            return
+        self.memory[key] = feature
+        self.memory_size += feature.nbytes
+        while self.memory_size > self.memory_limit:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= evicted.nbytes
+
+    def get(self, key, count=True):
+        """cached array or None
+
+        count=False leaves hits and misses alone, for a second lookup of a
+        clip that was already counted.
+        """
+        feature = self.memory.get(key)
+        if feature is None and self.cache_dir is not None:
+            path = self._disk_path(key)
+            if path.exists():
+                feature = np.load(str(path))
+                self._remember(key, feature)
+        elif feature is not None:
+            self.memory.move_to_end(key)
+
+        if count:
+            if feature is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return feature
+
+    def put(self, key, feature):
+        feature = np.array(feature, dtype=np.float32)
+        feature.flags.writeable = False
+        self._remember(key, feature)
+
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # write then rename so readers never see half written files
+                tmp_path = path.with_suffix(".{}.tmp".format(os.getpid()))
+                with open(str(tmp_path), "wb") as fout:
+                    np.save(fout, feature)
+                os.replace(str(tmp_path), str(path))
+
+    def clear_memory(self):
+        self.memory.clear()
+        self.memory_size = 0
+
+    def for_workers(self, workers):
+        """empty cache on the same disk tier for one of workers processes"""
+        return FeatureCache(self.raw_params,
+                            cache_dir=self.cache_dir,
+                            memory_limit=self.memory_limit // workers)
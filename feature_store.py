@@ -0,0 +1,202 @@
+import json
+from pathlib import Path
+import h5py
+import numpy as np
+import pandas as pd
+import config
+import generator
+import make_silence_clip
+import utils
+
+"""
+Precomputed spectrogram store.
+
+All training features in one chunked, lzf compressed HDF5 file, stored as
+float16 or as uint8 with a per clip, per channel scale and offset, with
+either both channels (phase, amp) or a subset of them. Rows are read by
+index and dequantized straight into the float32 model input buffer, so the
+uint8 amp only store of the full training set (about 1.6 GB) fits in RAM.
+"""
+
+CHANNELS = ("phase", "amp")
+DTYPES = ("float16", "uint8")
+
+
+def quantize(features, dtype="float16"):
+    """(stored, scale, offset) for a (batch, 257, 98, channels) array
+
+    uint8 maps every clip and channel from its own [min, max] to [0, 255],
+    float16 is a plain cast with scale 1 and offset 0.
+    """
+    batch, channels = features.shape[0], features.shape[-1]
+    if dtype == "float16":
+        return (features.astype(np.float16),
+                np.ones((batch, channels), dtype=np.float32),
+                np.zeros((batch, channels), dtype=np.float32))
+
+    low = features.min(axis=(1, 2))
+    high = features.max(axis=(1, 2))
+    scale = (high - low) / 255
+    scale[scale == 0] = 1
+    stored = np.rint((features - low[:, None, None, :]) /
+                     scale[:, None, None, :])
+    return (np.clip(stored, 0, 255).astype(np.uint8),
+            scale.astype(np.float32),
+            low.astype(np.float32))
+
+
+def write_store(paths, store_path=config.FEATURE_STORE_PATH,
+                dtype="float16",
+                channels=CHANNELS,
+                chunk_rows=64,
+                compression="lzf",
+                batch_size=256,
+                reader=None,
+                bg_paths=None):
+    """featurize paths in order and write them to store_path
+
+    Clips that are not exactly one second get the single random crop/pad
+    they were given at write time. Virtual silence paths need bg_paths,
+    the background noise files, and are stored with their fixed
+    (validation) cut.
+    """
+    if dtype not in DTYPES:
+        raise ValueError("dtype must be one of {}".format(DTYPES))
+    channel_ids = [CHANNELS.index(x) for x in channels]
+    paths = [str(x) for x in paths]
+    shape = generator.FEATURE_SHAPE[:2] + (len(channel_ids),)
+    silence = None
+    if any(generator.is_virtual_silence(x) for x in paths):
+        if bg_paths is None:
+            raise ValueError("virtual silence paths need bg_paths")
+        silence = generator.SilenceSource(
+            generator.load_noise_bank(bg_paths, reader), fixed=True)
+
+    with h5py.File(str(store_path), "w") as store:
+        features = store.create_dataset(
+            "features",
+            shape=(len(paths),) + shape,
+            dtype=dtype,
+            chunks=(min(chunk_rows, max(len(paths), 1)),) + shape,
+            compression=compression)
+        scales = store.create_dataset("scale", (len(paths), len(channel_ids)),
+                                      dtype=np.float32)
+        offsets = store.create_dataset("offset",
+                                       (len(paths), len(channel_ids)),
+                                       dtype=np.float32)
+        store.create_dataset("path", data=np.array(paths, dtype="S"))
+        store.attrs["channels"] = json.dumps(list(channels))
+        store.attrs["stft_params"] = json.dumps(generator.STFT_PARAMS)
+
+        x_batch = np.empty((batch_size,) + generator.FEATURE_SHAPE,
+                           dtype=np.float32)
+        for start in range(0, len(paths), batch_size):
+            end = min(start + batch_size, len(paths))
+            batch = generator.make_batch(paths[start:end], reader=reader,
+                                         out=x_batch[:end - start],
+                                         silence=silence)
+            stored, scale, offset = quantize(batch[..., channel_ids], dtype)
+            features[start:end] = stored
+            scales[start:end] = scale
+            offsets[start:end] = offset
+            print(end, len(paths))
+
+
+class FeatureStore():
+    """random access reader for a write_store file
+
+    With in_memory=True the (still quantized) arrays are loaded into RAM
+    once, otherwise rows are read through h5py's chunk cache. Pickling
+    reopens the file, like packed.PackedReader.
+    """
+
+    def __init__(self, store_path=config.FEATURE_STORE_PATH,
+                 in_memory=False,
+                 cache_size=512 * 1024 ** 2):
+
+        self.store_path = str(store_path)
+        self.in_memory = in_memory
+        self.cache_size = cache_size
+        self._open()
+        self.channels = tuple(json.loads(self.file.attrs["channels"]))
+        self.feature_shape = self.features.shape[1:]
+        self.paths = pd.Index([x.decode() for x in self.file["path"][:]])
+
+    def _open(self):
+        self.file = h5py.File(self.store_path, "r",
+                              rdcc_nbytes=self.cache_size)
+        self.features = self.file["features"]
+        if self.in_memory:
+            self.features = self.features[:]
+        self.scale = self.file["scale"][:]
+        self.offset = self.file["offset"][:]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("file", "features", "scale", "offset"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def rows(self, paths):
+        """row index of every path, KeyError for paths not in the store"""
+        rows = self.paths.get_indexer([str(x) for x in paths])
+        if (rows < 0).any():
+            missing = np.asarray(paths)[rows < 0]
+            raise KeyError("{} paths are not in {}, e.g. {}".format(
+                len(missing), self.store_path, missing[0]))
+        return rows
+
+    def read(self, rows, out=None):
+        """float32 (len(rows),) + feature_shape features, written to out"""
+        rows = np.asarray(rows)
+        if out is None:
+            out = np.empty((len(rows),) + self.feature_shape,
+                           dtype=np.float32)
+        if self.in_memory:
+            stored = self.features[rows]
+        else:
+            # h5py wants increasing indices
+            unique, inverse = np.unique(rows, return_inverse=True)
+            stored = self.features[unique][inverse]
+
+        np.multiply(stored, self.scale[rows][:, None, None, :], out=out)
+        out += self.offset[rows][:, None, None, :]
+        return out
+
+    def close(self):
+        self.file.close()
+
+
+def main(silence_data_version=make_silence_clip.VIRTUAL_VERSION,
+         store_path=config.FEATURE_STORE_PATH, dtype="uint8",
+         channels=("amp",)):
+    """store every train and silence clip experiment.data_load reads
+
+    so that store.rows() finds every row of a validation or cross
+    validation split.
+    """
+    file_df = utils.read_file_info()
+    is_noise = file_df.possible_label == "_background_noise_"
+    if silence_data_version == make_silence_clip.VIRTUAL_VERSION:
+        silence_df = make_silence_clip.virtual_silence_df()
+    else:
+        silence_df = pd.read_csv(str(Path(config.SILECE_DATA_PATH) /
+                                     silence_data_version / "file_info.csv"))
+    paths = np.concatenate([file_df[~is_noise].path.values,
+                            silence_df.path.values])
+    write_store(paths, store_path, dtype=dtype, channels=channels,
+                bg_paths=file_df[is_noise].path.values)
+    return store_path
+
+
+if __name__ == "__main__":
+    import sys
+    import cli
+    cli.main(["feature-store"] + sys.argv[1:])
@@ -0,0 +1,199 @@
+from functools import lru_cache
+import numpy as np
+import scipy.signal as signal
+import generator
+
+try:
+    from scipy.fft import dct
+except ImportError:
+    from scipy.fftpack import dct
+
+"""
+Feature front ends.
+
+A front end turns a (batch, 16000) float32 waveform array into a
+(batch,) + feature_shape float32 array. make_batch, the loaders and the
+feature cache take one, and STFTCNN builds its input layer from the
+feature_shape of the front end it is given, so switching the input
+representation is a matter of a name:
+
+>>> cnn = model.STFTCNN(frontend="logmel40")
+"""
+
+
+class FrontEnd():
+    """base class
+
+    Subclasses set name, params, feature_shape and the framing (nperseg,
+    hop, nfft, window) and implement frame_features, which turns complex
+    STFT frames into feature columns. That split lets streaming.py update
+    features one hop at a time.
+    """
+
+    name = None
+    params = dict()
+    feature_shape = None
+    nperseg = generator.STFT_PARAMS["nperseg"]
+    hop = generator.HOP_LENGTH
+    nfft = generator.STFT_PARAMS["nfft"]
+    window = generator.WINDOW
+
+    def cache_params(self):
+        """feature cache key parameters, unique per front end setting"""
+        params = dict(self.params)
+        params["frontend"] = self.name
+        return params
+
+    def spectrum(self, wavs):
+        return generator.frame_spectrum(wavs, self.nperseg, self.hop,
+                                        self.nfft, self.window)
+
+    def frame_features(self, specgram):
+        """(..., frames, rows, channels) for (..., frames, bins) frames"""
+        raise NotImplementedError
+
+    def featurize(self, wavs, out=None):
+        features = self.frame_features(self.spectrum(wavs))
+        features = features.transpose(0, 2, 1, 3).astype(np.float32)
+        if out is None:
+            return features
+        out[...] = features
+        return out
+
+
+class PhaseAmp(FrontEnd):
+    """the original (257, 98, 2) phase/amp STFT"""
+
+    name = "stft"
+    params = generator.STFT_PARAMS
+    feature_shape = generator.FEATURE_SHAPE
+
+    def cache_params(self):
+        # same keys as caches built before front ends existed
+        return dict(self.params)
+
+    def frame_features(self, specgram):
+        phase = np.angle(specgram) / np.pi
+        amp = np.log1p(np.abs(specgram))
+        return np.stack([phase, amp], axis=-1)
+
+    def featurize(self, wavs, out=None):
+        return generator.featurize_batch(wavs, out=out)
+
+
+class LogSpectrogram(FrontEnd):
+    """log power spectrogram, 20 ms hann window and 10 ms step
+
+    Same numbers as preprocess/generator.py log_specgram (density scaled
+    scipy spectrogram), laid out as (161, 99, 1).
+    """
+
+    name = "logspec"
+
+    def __init__(self, window_size=20, step_size=10, eps=1e-10,
+                 sample_rate=generator.SAMPLE_RATE):
+        self.nperseg = int(round(window_size * sample_rate / 1e3))
+        self.hop = int(round(step_size * sample_rate / 1e3))
+        self.eps = eps
+        self.params = {"window_size": window_size,
+                       "step_size": step_size,
+                       "eps": eps}
+        self.nfft = self.nperseg
+        window = signal.get_window("hann", self.nperseg)
+        self.window = window.astype(np.float32)
+        # density scaling of signal.spectrogram, one sided
+        self.scale = np.full(self.nperseg // 2 + 1,
+                             2 / (sample_rate * (window ** 2).sum()),
+                             dtype=np.float32)
+        self.scale[0] /= 2
+        if self.nperseg % 2 == 0:
+            self.scale[-1] /= 2
+        n_frames = (sample_rate - self.nperseg) // self.hop + 1
+        self.feature_shape = (self.nperseg // 2 + 1, n_frames, 1)
+
+    def frame_features(self, specgram):
+        power = np.abs(specgram) ** 2 * self.scale
+        return np.log(power + self.eps)[..., None]
+
+
+def hz_to_mel(hz):
+    return 2595 * np.log10(1 + np.asarray(hz) / 700)
+
+
+def mel_to_hz(mel):
+    return 700 * (10 ** (np.asarray(mel) / 2595) - 1)
+
+
+@lru_cache(maxsize=None)
+def mel_filterbank(n_mels, nfft=generator.STFT_PARAMS["nfft"],
+                   sample_rate=generator.SAMPLE_RATE, fmin=20.0, fmax=None):
+    """(n_mels, nfft // 2 + 1) triangular HTK mel filters, read-only"""
+    if fmax is None:
+        fmax = sample_rate / 2
+    bin_hz = np.linspace(0, sample_rate / 2, nfft // 2 + 1)
+    edges = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax),
+                                  n_mels + 2))
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bin_hz - lower) / (center - lower)
+    falling = (upper - bin_hz) / (upper - center)
+    filters = np.maximum(0, np.minimum(rising, falling)).astype(np.float32)
+    filters.flags.writeable = False
+    return filters
+
+
+class LogMel(FrontEnd):
+    """(n_mels, 98, 1) log mel energies on the STFT frames of PhaseAmp"""
+
+    def __init__(self, n_mels=40, eps=1e-6):
+        self.n_mels = n_mels
+        self.eps = eps
+        self.name = "logmel{}".format(n_mels)
+        self.params = dict(generator.STFT_PARAMS, n_mels=n_mels, eps=eps)
+        self.window = signal.get_window(
+            "hann", generator.STFT_PARAMS["nperseg"]).astype(np.float32)
+        self.feature_shape = (n_mels, generator.FEATURE_SHAPE[1], 1)
+
+    def log_mel(self, specgram):
+        """(..., frames, n_mels)"""
+        power = np.abs(specgram) ** 2
+        return np.log(power @ mel_filterbank(self.n_mels).T + self.eps)
+
+    def frame_features(self, specgram):
+        return self.log_mel(specgram)[..., None]
+
+
+class MFCC(LogMel):
+    """(n_mfcc, 98, 1) orthonormal DCT-II of the log mel energies"""
+
+    def __init__(self, n_mfcc=40, n_mels=64, eps=1e-6):
+        super().__init__(n_mels, eps)
+        self.n_mfcc = n_mfcc
+        self.name = "mfcc{}".format(n_mfcc)
+        self.params = dict(self.params, n_mfcc=n_mfcc)
+        self.feature_shape = (n_mfcc, generator.FEATURE_SHAPE[1], 1)
+
+    def frame_features(self, specgram):
+        coefficients = dct(self.log_mel(specgram), type=2, norm="ortho",
+                           axis=-1)
+        return coefficients[..., :self.n_mfcc, None]
+
+
+FRONTENDS = {"stft": PhaseAmp,
+             "logspec": LogSpectrogram,
+             "logmel40": lambda: LogMel(40),
+             "logmel64": lambda: LogMel(64),
+             "mfcc40": MFCC}
+
+_INSTANCES = dict()
+
+
+def get(name="stft"):
+    """front end by registry name, a FrontEnd instance is passed through"""
+    if isinstance(name, FrontEnd):
+        return name
+    if name not in FRONTENDS:
+        raise ValueError("unknown front end {}, expected one of {}".format(
+            name, sorted(FRONTENDS)))
+    if name not in _INSTANCES:
+        _INSTANCES[name] = FRONTENDS[name]()
+    return _INSTANCES[name]
@@ -1,66 +1,399 @@
-import random
+import os
 import numpy as np
 import scipy.signal as signal
+from numpy.lib.stride_tricks import as_strided
 from scipy.io import wavfile
-from tensorflow.python.keras.utils import to_categorical
 import augment
+import instrument
+import sampler
 
+try:
+    from scipy.fft import rfft
+except ImportError:
+    from numpy.fft import rfft
+
+SAMPLE_RATE = 16000
+STFT_PARAMS = {"nperseg": 400,
+               "noverlap": 240,
+               "nfft": 512}
+HOP_LENGTH = STFT_PARAMS["nperseg"] - STFT_PARAMS["noverlap"]
+N_BINS = STFT_PARAMS["nfft"] // 2 + 1
+FEATURE_SHAPE = (N_BINS,
+                 (SAMPLE_RATE - STFT_PARAMS["nperseg"]) // HOP_LENGTH + 1,
+                 2)
+
+# hann window with the 1/sum(window) scaling signal.stft applies
+WINDOW = signal.get_window("hann", STFT_PARAMS["nperseg"])
+WINDOW = (WINDOW / WINDOW.sum()).astype(np.float32)
+# clips per rfft in featurize_batch, about 1 MB of frames per chunk
+FEATURIZE_CHUNK = 4
+
+
+def read_wav_file(fname, reader=None):
+    if reader is not None:
+        return reader.read_wav_file(fname)
 
-def read_wav_file(fname):
     sample_rate, wav = wavfile.read(fname)
     wav = wav.astype(np.float32) / np.iinfo(np.int16).max
     return wav, sample_rate
 
 
-def process_wav_file(fname, bgn_data):
-    wav, sample_rate = read_wav_file(fname)
-
-    if len(wav) > sample_rate:
-        wav = augment.clip_random(wav, sample_rate)
-    elif len(wav) < sample_rate:
-        wav = augment.zero_padding_random(wav, sample_rate)
-        
+def spectrogram(wav, sample_rate):
     specgram = signal.stft(wav, sample_rate,
-                           nperseg=400,
-                           noverlap=240,
-                           nfft=512,
                            padded=False,
-                           boundary=None)
+                           boundary=None,
+                           **STFT_PARAMS)
 
     phase = np.angle(specgram[2]) / np.pi
     amp = np.log1p(np.abs(specgram[2]))
-    
-    return np.stack([phase, amp], axis=2)
 
+    return np.stack([phase, amp], axis=2).astype(np.float32)
 
-def batch_generator(input_df, batch_size, category_num, bgn_paths,
-                    mode='train',
-                    sampling_size=2000):
-    
-    bgn_data = [read_wav_file(x)[0] for x in bgn_paths.path]
-    bgn_data = np.concatenate(bgn_data)
-    
-    def preprocess(wav_file):
-        return process_wav_file(wav_file, bgn_data)
-    
-    while True:
-        if mode == 'train':
-            grouped = input_df.groupby('plnum')
-            base_df = grouped.apply(lambda x: x.sample(n=sampling_size))
-            base_df_id = random.sample(range(base_df.shape[0]),
-                                       base_df.shape[0])
+
+def frame_spectrum(wavs, nperseg=STFT_PARAMS["nperseg"], hop=HOP_LENGTH,
+                   nfft=STFT_PARAMS["nfft"], window=WINDOW, windowed=None):
+    """complex (batch, frames, nfft // 2 + 1) STFT of a (batch, length) array
+
+    Frames are cut with stride tricks (no padding, like spectrogram()) and
+    transformed with a single rfft. windowed, a zeroed (batch, frames, nfft)
+    float32 buffer, is reused for the windowed frames when given; only its
+    first nperseg columns are written, the zero padding stays.
+    """
+    wavs = np.ascontiguousarray(wavs, dtype=np.float32)
+    batch, length = wavs.shape
+    n_frames = (length - nperseg) // hop + 1
+    frames = as_strided(wavs,
+                        shape=(batch, n_frames, nperseg),
+                        strides=(wavs.strides[0],
+                                 hop * wavs.strides[1],
+                                 wavs.strides[1]))
+    if windowed is None:
+        windowed = np.zeros((batch, n_frames, nfft), dtype=np.float32)
+    np.multiply(frames, window, out=windowed[..., :nperseg])
+    return rfft(windowed, axis=-1)
+
+
+def featurize_batch(wavs, out=None, chunk_size=FEATURIZE_CHUNK):
+    """phase/amp spectrograms for a (batch, 16000) array
+
+    Same numbers as spectrogram() per clip (phase can flip between 1 and -1
+    where the two are the same angle). The batch goes through frame_spectrum
+    chunk_size clips at a time with the same windowed and phase/amp
+    buffers, so the working set stays in cache. Results are written into
+    out, a (batch, 257, 98, 2) float32 buffer, when given.
+    """
+    wavs = np.ascontiguousarray(wavs, dtype=np.float32)
+    batch, length = wavs.shape
+    n_frames = (length - STFT_PARAMS["nperseg"]) // HOP_LENGTH + 1
+    if out is None:
+        out = np.empty((batch, N_BINS, n_frames, 2), dtype=np.float32)
+
+    chunk_size = max(1, min(chunk_size, batch))
+    windowed = np.zeros((chunk_size, n_frames, STFT_PARAMS["nfft"]),
+                        dtype=np.float32)
+    buf = np.empty((chunk_size, n_frames, N_BINS), dtype=np.float32)
+    for start in range(0, batch, chunk_size):
+        end = min(start + chunk_size, batch)
+        specgram = frame_spectrum(wavs[start:end],
+                                  windowed=windowed[:end - start])
+        chunk_buf = buf[:end - start]
+        np.arctan2(specgram.imag, specgram.real, out=chunk_buf)
+        chunk_buf *= 1 / np.pi
+        out[start:end, ..., 0] = chunk_buf.transpose(0, 2, 1)
+        np.abs(specgram, out=chunk_buf)
+        np.log1p(chunk_buf, out=chunk_buf)
+        out[start:end, ..., 1] = chunk_buf.transpose(0, 2, 1)
+    return out
+
+
+def fit_length(wav, sample_rate):
+    return augment.fit_length(wav, sample_rate)
+
+
+def load_clip(fname, cache=None, reader=None, need_wav=False):
+    """return (feature, wav, feature_key) for fname
+
+    feature is set on a cache hit, otherwise wav is the cropped/padded
+    one second clip. feature_key is set when the clip is deterministic and
+    its spectrogram should be written back to the cache. need_wav skips
+    the spectrogram lookup for clips that are augmented afterwards.
+
+    With a cache, one second clips are stored as finished spectrograms.
+    Other clips get a random crop/pad every call, so only their decoded
+    waveform is cached and the crop/pad runs on the cached copy.
+    """
+    wav = None
+    feature_key = None
+    if cache is not None:
+        if reader is not None:
+            mtime = reader.mtime(fname)
         else:
-            base_df = input_df
-            base_df_id = list(range(input_df.shape[0]))
-        for start in range(0, len(base_df), batch_size):
-            end = min(start + batch_size, len(base_df))
-            batch_df_id = base_df_id[start:end]
-            batch_df = base_df.iloc[batch_df_id]
-
-            x_batch = np.stack(batch_df.path.apply(preprocess).values)
-            if mode != 'test':
-                y_batch = batch_df.plnum.values
-                y_batch = to_categorical(y_batch, num_classes=category_num)
-                yield x_batch, y_batch
+            mtime = os.path.getmtime(fname)
+        if not need_wav:
+            feature_key = cache.key(fname, mtime)
+            feature = cache.get(feature_key)
+            if feature is not None:
+                return feature, None, None
+        wav_key = cache.key(fname, mtime, kind="wav")
+        # the feature lookup above already counted this clip
+        wav = cache.get(wav_key, count=need_wav)
+
+    if wav is None:
+        wav, sample_rate = read_wav_file(fname, reader)
+        if cache is not None and len(wav) != sample_rate:
+            cache.put(wav_key, wav)
+
+    if len(wav) != SAMPLE_RATE:
+        feature_key = None
+    return None, fit_length(wav, SAMPLE_RATE), feature_key
+
+
+def process_wav_file(fname, bgn_data, cache=None, reader=None):
+    """read fname and return its (257, 98, 2) phase/amp spectrogram"""
+    feature, wav, feature_key = load_clip(fname, cache, reader)
+    if feature is None:
+        feature = spectrogram(wav, SAMPLE_RATE)
+        if feature_key is not None:
+            cache.put(feature_key, feature)
+    return feature
+
+
+def make_batch(paths, cache=None, reader=None, out=None,
+               augmentation=None, silence=None, timer=None, frontend=None):
+    """(batch, 257, 98, 2) features for paths
+
+    augmentation draws its randomness for the whole batch up front, so
+    clips it leaves untouched can still come from the cache. Cache hits
+    are copied in, every other clip is featurized together with
+    featurize_batch. Virtual silence paths are cut from silence, a
+    SilenceSource. timer, an instrument.StageTimer, records the time spent
+    in load, augment, featurize and cache_put. frontend (see frontend.py)
+    replaces the phase/amp STFT; the cache must then be built with its
+    cache_params().
+    """
+    if timer is None:
+        timer = instrument.NULL_TIMER
+    featurize = featurize_batch
+    feature_shape = FEATURE_SHAPE
+    if frontend is not None:
+        featurize = frontend.featurize
+        feature_shape = frontend.feature_shape
+    x_batch = out
+    if x_batch is None:
+        x_batch = np.empty((len(paths),) + feature_shape, dtype=np.float32)
+
+    touched = np.zeros(len(paths), dtype=bool)
+    if augmentation is not None:
+        params = augmentation.sample(len(paths), np.random, paths)
+        touched = augmentation.touched(params)
+
+    wavs = np.zeros((len(paths), SAMPLE_RATE), dtype=np.float32)
+    rows = list()
+    keys = list()
+    with timer.stage("load"):
+        for i, fname in enumerate(paths):
+            if silence is not None and is_virtual_silence(fname):
+                wavs[i] = silence.clip(fname, SAMPLE_RATE)
+                rows.append(i)
+                keys.append(None)
+                continue
+
+            feature, wav, feature_key = load_clip(fname, cache, reader,
+                                                  need_wav=touched[i])
+            if feature is not None:
+                x_batch[i] = feature
             else:
-                yield x_batch
+                wavs[i] = wav
+                rows.append(i)
+                keys.append(feature_key)
+
+    if augmentation is not None and touched.any():
+        with timer.stage("augment"):
+            wavs = augmentation.apply(wavs, params, paths)
+
+    with timer.stage("featurize"):
+        if len(rows) == len(paths):
+            featurize(wavs, out=x_batch)
+        elif rows:
+            x_batch[rows] = featurize(wavs[rows])
+
+    with timer.stage("cache_put"):
+        for i, feature_key in zip(rows, keys):
+            if feature_key is not None:
+                cache.put(feature_key, x_batch[i])
+    return x_batch
+
+
+class NoiseBank():
+    """read-only concatenation of the background noise clips
+
+    Use load_noise_bank, which loads each set of clips once per process.
+    Pickling only sends the paths, so loader workers load (or, when
+    forked, share) the bank instead of receiving a copy of it.
+    """
+
+    def __init__(self, paths, reader=None):
+        self.paths = tuple(str(x) for x in paths)
+        self.reader = reader
+        data = [read_wav_file(x, reader)[0] for x in self.paths]
+        self.data = np.concatenate(data)
+        self.data.flags.writeable = False
+
+    def __reduce__(self):
+        return (load_noise_bank, (self.paths, self.reader))
+
+    def __len__(self):
+        return len(self.data)
+
+    def segments(self, offsets, length):
+        """(len(offsets), length) noise, one slice per offset"""
+        return self.data[offsets[:, None] + np.arange(length)]
+
+
+_NOISE_BANKS = dict()
+
+
+def load_noise_bank(paths, reader=None):
+    paths = tuple(str(x) for x in paths)
+    if paths not in _NOISE_BANKS:
+        _NOISE_BANKS[paths] = NoiseBank(paths, reader)
+    return _NOISE_BANKS[paths]
+
+
+SILENCE_SCHEME = "silence://"
+
+
+def is_virtual_silence(path):
+    return str(path).startswith(SILENCE_SCHEME)
+
+
+def virtual_silence_path(seed, i):
+    return "{}{}/{}".format(SILENCE_SCHEME, seed, i)
+
+
+class SilenceSource():
+    """one second silence clips cut from a NoiseBank on the fly
+
+    A virtual silence path (silence://<seed>/<i>) stands for a clip at an
+    offset drawn from that seed. With fixed=True (validation) every path
+    always gives the same clip; otherwise each call draws a new offset,
+    so training sees a different slice every epoch. gain_range scales the
+    clip and with probability mix_p a second slice is mixed in.
+    """
+
+    def __init__(self, bank, fixed=False, gain_range=(1.0, 1.0), mix_p=0.0):
+        self.bank = bank
+        self.fixed = fixed
+        self.gain_range = gain_range
+        self.mix_p = mix_p
+
+    def clip(self, path, length):
+        if self.fixed:
+            seed, i = str(path)[len(SILENCE_SCHEME):].split("/")
+            rng = np.random.RandomState((int(seed) * 1000003 + int(i)) %
+                                        (2 ** 32))
+        else:
+            rng = np.random
+
+        offsets = rng.randint(0, len(self.bank) - length, size=2)
+        wav = self.bank.segments(offsets[:1], length)[0]
+        if rng.rand() < self.mix_p:
+            mix_rate = rng.rand()
+            second = self.bank.segments(offsets[1:], length)[0]
+            wav = augment.mix_two_wav(wav, second, mix_rate)
+        return wav * rng.uniform(self.gain_range[0], self.gain_range[1])
+
+
+def batch_targets(labels, targets, positions, category_num):
+    """y_batch of the rows at positions, one-hot unless targets is given"""
+    if targets is not None:
+        return targets[positions]
+    return np.eye(category_num, dtype=np.float32)[labels[positions]]
+
+
+def batch_generator(input_df, batch_size, category_num, bgn_paths,
+                    mode='train',
+                    sampling_size=2000,
+                    cache=None,
+                    reader=None,
+                    augmentation=None,
+                    timer=None,
+                    store=None,
+                    frontend=None,
+                    targets=None):
+    """yield (x_batch, y_batch) forever, or x_batch alone in test mode
+
+    augmentation is applied to the waveforms before featurizing; pass it
+    for the train generator only. Virtual silence rows are cut from the
+    bgn_paths noise, fixed per row outside of train mode. timer collects
+    make_batch stage timings (see instrument.StageTimer). With store, a
+    feature_store.FeatureStore, features are read from the store instead
+    of being computed, and augmentation cannot be used. frontend is
+    passed on to make_batch. targets, a (len(input_df), category_num)
+    array, replaces the one-hot labels as y_batch (soft targets for
+    distillation); classes are still sampled by plnum.
+    """
+    if store is not None:
+        if augmentation is not None:
+            raise ValueError("a feature store cannot be augmented")
+        yield from store_batch_generator(input_df, batch_size,
+                                         category_num, store, mode,
+                                         sampling_size, targets)
+        return
+
+    silence = None
+    if input_df.path.astype(str).str.startswith(SILENCE_SCHEME).any():
+        silence = SilenceSource(load_noise_bank(bgn_paths.path, reader),
+                                fixed=(mode != 'train'))
+
+    paths = input_df.path.values
+    if mode != 'test':
+        labels = input_df.plnum.values
+    else:
+        labels = np.zeros(len(input_df), dtype=np.int64)
+    epoch_sampler = sampler.EpochSampler(labels, mode, sampling_size)
+
+    # close() on the generator stops the sampler's lookahead thread
+    try:
+        for base_df_id in epoch_sampler:
+            for start in range(0, len(base_df_id), batch_size):
+                batch_df_id = base_df_id[start:start + batch_size]
+
+                x_batch = make_batch(paths[batch_df_id], cache, reader,
+                                     augmentation=augmentation,
+                                     silence=silence,
+                                     timer=timer,
+                                     frontend=frontend)
+                if mode != 'test':
+                    yield x_batch, batch_targets(labels, targets,
+                                                 batch_df_id, category_num)
+                else:
+                    yield x_batch
+    finally:
+        epoch_sampler.close()
+
+
+def store_batch_generator(input_df, batch_size, category_num, store,
+                          mode='train',
+                          sampling_size=2000,
+                          targets=None):
+    """batch_generator over a feature_store.FeatureStore"""
+    rows = store.rows(input_df.path.values)
+    if mode != 'test':
+        labels = input_df.plnum.values
+    else:
+        labels = np.zeros(len(input_df), dtype=np.int64)
+    epoch_sampler = sampler.EpochSampler(labels, mode, sampling_size)
+
+    try:
+        for base_df_id in epoch_sampler:
+            for start in range(0, len(base_df_id), batch_size):
+                batch_df_id = base_df_id[start:start + batch_size]
+                x_batch = store.read(rows[batch_df_id])
+                if mode != 'test':
+                    yield x_batch, batch_targets(labels, targets,
+                                                 batch_df_id, category_num)
+                else:
+                    yield x_batch
+    finally:
+        epoch_sampler.close()
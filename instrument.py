@@ -0,0 +1,102 @@
+import threading
+import time
+from pathlib import Path
+
+"""
+Opt-in instrumentation for the training loop.
+
+StageTimer collects per-stage preprocessing time from make_batch (and from
+PrefetchLoader workers), learner.ThroughputLogger is the keras callback
+that splits every epoch into time spent waiting for batches and time spent
+in the train step and writes one row per epoch to fold_{i}_throughput.csv.
+Nothing here imports keras, so the data pipeline can use it without TF.
+"""
+
+
+# every stage make_batch records, the stage_* columns of the throughput csv
+STAGES = ("load", "augment", "featurize", "cache_put")
+
+
+class _NullStage():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _Stage():
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class StageTimer():
+    """seconds and call counts per named stage, safe to share with threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = dict()
+        self.counts = dict()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, seconds, count=1):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def merge(self, timings):
+        """add timings returned by pop() of another timer"""
+        for name, (seconds, count) in timings.items():
+            self.add(name, seconds, count)
+
+    def pop(self):
+        """{name: (seconds, count)} since the last pop"""
+        with self.lock:
+            timings = {name: (self.seconds[name], self.counts[name])
+                       for name in self.seconds}
+            self.seconds = dict()
+            self.counts = dict()
+        return timings
+
+
+class NullTimer():
+    """StageTimer stand-in used when instrumentation is off"""
+
+    def stage(self, name):
+        return _NullStage()
+
+
+NULL_TIMER = NullTimer()
+
+
+def _log_stem(csv_log_path):
+    path = Path(csv_log_path)
+    stem = path.stem
+    if stem.endswith("_log"):
+        stem = stem[:-len("_log")]
+    return path, stem
+
+
+def throughput_path(csv_log_path):
+    """fold_0_log.csv -> fold_0_throughput.csv"""
+    path, stem = _log_stem(csv_log_path)
+    return str(path.with_name("{}_throughput.csv".format(stem)))
+
+
+def profile_path(csv_log_path):
+    """fold_0_log.csv -> fold_0_profile/"""
+    path, stem = _log_stem(csv_log_path)
+    return str(path.with_name("{}_profile".format(stem)))
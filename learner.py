@@ -1,15 +1,138 @@
+import cProfile
+import csv
+import json
+import time
 from pathlib import Path
+from tensorflow.python.keras.callbacks import Callback
 from tensorflow.python.keras.callbacks import EarlyStopping, ModelCheckpoint
 from tensorflow.python.keras.callbacks import ReduceLROnPlateau
 from tensorflow.python.keras.callbacks import CSVLogger
+import instrument
 import utils
 
 
+class ThroughputLogger(Callback):
+    """per epoch data wait / train step split, samples/sec and stage times
+
+    data_wait is the time between the end of one batch and the start of
+    the next, which is where keras blocks on the generator queue, so a
+    high wait_fraction means the model is starved by the input pipeline.
+    timer is the StageTimer given to the train generator, generator is
+    sampled for queue_depth() when it has one (PrefetchLoader). With
+    profile_dir every epoch of the training thread is dumped to
+    profile_dir/epoch_{n}.prof (batches built in keras' generator thread
+    show up in the stage_* columns instead). With append, rows go after
+    those of an earlier run, as when training resumes from initial_epoch.
+    """
+
+    FIELDS = ("epoch", "batches", "samples", "epoch_time", "data_wait",
+              "train_step", "wait_fraction", "samples_per_sec",
+              "queue_depth") + tuple("stage_" + name
+                                     for name in instrument.STAGES)
+
+    def __init__(self, csv_path, timer=None, generator=None,
+                 profile_dir=None, append=False):
+        super().__init__()
+        self.csv_path = csv_path
+        self.timer = timer
+        self.generator = generator
+        self.profile_dir = profile_dir
+        self.append = append
+        self.profiler = None
+
+    def on_train_begin(self, logs=None):
+        if not (self.append and Path(self.csv_path).exists()):
+            with open(self.csv_path, "w", newline="") as fout:
+                csv.DictWriter(fout, fieldnames=self.FIELDS).writeheader()
+        if self.profile_dir is not None:
+            Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.batches = 0
+        self.samples = 0
+        self.data_wait = 0.0
+        self.train_step = 0.0
+        self.queue_depths = list()
+        if self.timer is not None:
+            self.timer.pop()
+        if self.profile_dir is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.epoch_start = time.perf_counter()
+        self.batch_end = self.epoch_start
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+        self.data_wait += self.batch_start - self.batch_end
+        if hasattr(self.generator, "queue_depth"):
+            self.queue_depths.append(self.generator.queue_depth())
+
+    def on_batch_end(self, batch, logs=None):
+        self.batch_end = time.perf_counter()
+        self.train_step += self.batch_end - self.batch_start
+        self.batches += 1
+        self.samples += (logs or dict()).get("size", 0)
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self.epoch_start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(str(Path(self.profile_dir) /
+                                         "epoch_{}.prof".format(epoch)))
+            self.profiler = None
+
+        busy = self.data_wait + self.train_step
+        row = {"epoch": epoch,
+               "batches": self.batches,
+               "samples": self.samples,
+               "epoch_time": elapsed,
+               "data_wait": self.data_wait,
+               "train_step": self.train_step,
+               "wait_fraction": self.data_wait / busy if busy else 0.0,
+               "samples_per_sec": self.samples / busy if busy else 0.0}
+        if self.queue_depths:
+            row["queue_depth"] = sum(self.queue_depths) / \
+                len(self.queue_depths)
+        if self.timer is not None:
+            for name, (seconds, count) in sorted(self.timer.pop().items()):
+                row["stage_" + name] = seconds
+        self.write(row)
+
+    def write(self, row):
+        with open(self.csv_path, "a", newline="") as fout:
+            csv.DictWriter(fout, fieldnames=self.FIELDS).writerow(row)
+
+
+# counters of EarlyStopping, ReduceLROnPlateau and ModelCheckpoint that
+# on_train_begin resets, kept across resumed runs with state_path
+CALLBACK_STATE = ("wait", "best", "cooldown_counter")
+
+
+class RestoreState(Callback):
+    """sets saved callback counters after their on_train_begin reset"""
+
+    def __init__(self, callbacks, state):
+        super().__init__()
+        self.callbacks = callbacks
+        self.state = state
+
+    def on_train_begin(self, logs=None):
+        for callback, values in zip(self.callbacks, self.state):
+            for name, value in values.items():
+                setattr(callback, name, value)
+
+
 class Learner():
 
     def __init__(self, model,
                  dump_path=None,
-                 csv_log_path=None):
+                 csv_log_path=None,
+                 instrumented=False,
+                 profile=False,
+                 patience=5,
+                 lr_factor=0.1,
+                 lr_patience=3,
+                 state_path=None):
 
         version = utils.now()
         if dump_path is None:
@@ -27,13 +150,13 @@ class Learner():
 
         self.model = model.model
         self.callbacks = [EarlyStopping(monitor='val_loss',
-                                        patience=5,
+                                        patience=patience,
                                         verbose=1,
                                         min_delta=0.01,
                                         mode='min'),
                           ReduceLROnPlateau(monitor='val_loss',
-                                            factor=0.1,
-                                            patience=3,
+                                            factor=lr_factor,
+                                            patience=lr_patience,
                                             verbose=1,
                                             epsilon=0.01,
                                             mode='min'),
@@ -44,15 +167,61 @@ class Learner():
                                           mode='min'),
                           CSVLogger(self.csv_log_path)]
 
+        # stage timings of the train generator, None when not instrumented
+        self.timer = instrument.StageTimer() if instrumented else None
+        self.profile = profile
+        # callback counters are written here after training and restored
+        # when training resumes from initial_epoch > 0
+        self.state_path = state_path
+
+    def callback_state(self):
+        return [{name: float(getattr(callback, name))
+                 for name in CALLBACK_STATE if hasattr(callback, name)}
+                for callback in self.callbacks]
+
+    def throughput_logger(self, train_generator, append=False):
+        profile_dir = None
+        if self.profile:
+            profile_dir = instrument.profile_path(self.csv_log_path)
+        return ThroughputLogger(
+            instrument.throughput_path(self.csv_log_path),
+            timer=self.timer,
+            generator=train_generator,
+            profile_dir=profile_dir,
+            append=append)
+
     def learn(self, train_generator, valid_generator, validation_steps,
               steps_per_epoch=344,
-              epochs=20):
-        history = self.model.fit_generator(generator=train_generator,
-                                           steps_per_epoch=steps_per_epoch,
-                                           epochs=epochs,
-                                           callbacks=self.callbacks,
-                                           validation_data=valid_generator,
-                                           validation_steps=validation_steps)
+              epochs=20,
+              initial_epoch=0):
+        callbacks = list(self.callbacks)
+        if self.timer is not None:
+            callbacks.append(self.throughput_logger(train_generator,
+                                                    initial_epoch > 0))
+        if self.state_path is not None and initial_epoch > 0:
+            with open(str(self.state_path)) as fin:
+                callbacks.append(RestoreState(self.callbacks, json.load(fin)))
+        if hasattr(train_generator, "dataset"):
+            # tf_pipeline.TFDataLoader, batches stay in the graph
+            history = self.model.fit(train_generator.dataset,
+                                     steps_per_epoch=steps_per_epoch,
+                                     epochs=epochs,
+                                     initial_epoch=initial_epoch,
+                                     callbacks=callbacks,
+                                     validation_data=valid_generator.dataset,
+                                     validation_steps=validation_steps)
+        else:
+            history = self.model.fit_generator(
+                generator=train_generator,
+                steps_per_epoch=steps_per_epoch,
+                epochs=epochs,
+                initial_epoch=initial_epoch,
+                callbacks=callbacks,
+                validation_data=valid_generator,
+                validation_steps=validation_steps)
+        if self.state_path is not None:
+            with open(str(self.state_path), "w") as fout:
+                json.dump(self.callback_state(), fout)
         return history
 
     def predict(self, test_generator, steps):
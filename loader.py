@@ -0,0 +1,210 @@
+import multiprocessing as mp
+import queue
+import random
+import threading
+import traceback
+import numpy as np
+import generator
+import instrument
+import sampler
+
+
+def _worker(tasks, results, buffer, buffer_shape, paths, cache, reader,
+            augmentation, silence, timed, frontend):
+    slots = np.frombuffer(buffer, dtype=np.float32).reshape(buffer_shape)
+    timer = instrument.StageTimer() if timed else None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_no, slot, positions, seed = task
+        try:
+            # every batch gets its own seed, so the output does not depend
+            # on which worker picked the task up
+            np.random.seed(seed)
+            random.seed(seed)
+            generator.make_batch(paths[positions], cache, reader,
+                                 out=slots[slot, :len(positions)],
+                                 augmentation=augmentation,
+                                 silence=silence,
+                                 timer=timer,
+                                 frontend=frontend)
+            timings = timer.pop() if timed else None
+            results.put((task_no, slot, None, timings))
+        except Exception:
+            results.put((task_no, slot, traceback.format_exc(), None))
+
+
+class PrefetchLoader():
+    """batch_generator replacement that builds batches in worker processes
+
+    Workers write finished batches into shared memory slots, at most depth
+    batches are in flight, and batches are yielded in the same order as
+    batch_generator would yield them. Call close() (or use it as a context
+    manager) before building the next fold's loader. Workers are spawned,
+    not forked, since the loader is built after TF and the sampler
+    thread started; a worker that dies raises instead of blocking
+    next(). Stage timings of the workers are merged into timer, an
+    instrument.StageTimer, when given.
+    frontend is passed on to make_batch and targets replaces the one-hot
+    labels, as in batch_generator.
+    """
+
+    def __init__(self, input_df, batch_size, category_num, bgn_paths,
+                 mode='train',
+                 sampling_size=2000,
+                 cache=None,
+                 reader=None,
+                 augmentation=None,
+                 workers=4,
+                 depth=8,
+                 seed=None,
+                 timer=None,
+                 frontend=None,
+                 targets=None):
+
+        self.batch_size = batch_size
+        self.category_num = category_num
+        self.mode = mode
+        self.timer = timer
+        self.targets = targets
+        self.depth = max(depth, workers)
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        self.seed = seed
+
+        if mode != 'test':
+            self.labels = input_df.plnum.values
+        else:
+            self.labels = np.zeros(len(input_df), dtype=np.int64)
+        self.sampler = sampler.EpochSampler(
+            self.labels, mode, sampling_size,
+            random_state=np.random.RandomState(seed))
+        paths = input_df.path.astype(str).values
+        silence = None
+        if any(generator.is_virtual_silence(x) for x in paths):
+            bank = generator.load_noise_bank(bgn_paths.path, reader)
+            silence = generator.SilenceSource(bank, fixed=(mode != 'train'))
+        if cache is not None:
+            # each worker keeps its own memory tier, the disk tier is shared
+            cache = cache.for_workers(workers)
+
+        feature_shape = generator.FEATURE_SHAPE
+        if frontend is not None:
+            feature_shape = frontend.feature_shape
+        buffer_shape = (self.depth, batch_size) + feature_shape
+        context = mp.get_context("spawn")
+        self.buffer = context.RawArray('f', int(np.prod(buffer_shape)))
+        self.slots = np.frombuffer(self.buffer,
+                                   dtype=np.float32).reshape(buffer_shape)
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = [context.Process(target=_worker,
+                                     args=(self.tasks, self.results,
+                                           self.buffer, buffer_shape,
+                                           paths, cache, reader,
+                                           augmentation, silence,
+                                           timer is not None, frontend),
+                                     daemon=True)
+                          for _ in range(workers)]
+        for process in self.processes:
+            process.start()
+        self.closed = False
+
+        self.lock = threading.Lock()
+        self.free_slots = list(range(self.depth))
+        self.pending = dict()
+        self.ready = dict()
+        self.task_no = 0
+        self.next_task_no = 0
+        self.order = np.zeros(0, dtype=np.int64)
+        self.order_start = 0
+        self._fill()
+
+    def _next_positions(self):
+        if self.order_start >= len(self.order):
+            self.order = self.sampler.next_plan()
+            self.order_start = 0
+        end = min(self.order_start + self.batch_size, len(self.order))
+        positions = self.order[self.order_start:end]
+        self.order_start = end
+        return positions
+
+    def _fill(self):
+        while self.free_slots:
+            slot = self.free_slots.pop()
+            positions = self._next_positions()
+            seed = (self.seed * 1000003 + self.task_no) % (2 ** 32)
+            self.tasks.put((self.task_no, slot, positions, seed))
+            self.pending[self.task_no] = positions
+            self.task_no += 1
+
+    def _result(self, poll=1.0):
+        while True:
+            try:
+                return self.results.get(timeout=poll)
+            except queue.Empty:
+                pass
+            dead = [process.exitcode for process in self.processes
+                    if not process.is_alive()]
+            if dead:
+                self.close()
+                raise RuntimeError("loader worker died with exit code "
+                                   "{}".format(dead[0]))
+
+    def queue_depth(self):
+        """batches finished by workers but not yet consumed"""
+        return len(self.ready)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            if self.closed:
+                raise StopIteration
+            while self.next_task_no not in self.ready:
+                task_no, slot, error, timings = self._result()
+                if error is not None:
+                    self.close()
+                    raise RuntimeError("loader worker failed\n" + error)
+                if timings is not None:
+                    self.timer.merge(timings)
+                self.ready[task_no] = slot
+
+            slot = self.ready.pop(self.next_task_no)
+            positions = self.pending.pop(self.next_task_no)
+            self.next_task_no += 1
+            # keras queues batches, so the slot is copied before reuse
+            x_batch = self.slots[slot, :len(positions)].copy()
+            self.free_slots.append(slot)
+            self._fill()
+
+        if self.mode == 'test':
+            return x_batch
+        y_batch = generator.batch_targets(self.labels, self.targets,
+                                          positions, self.category_num)
+        return x_batch, y_batch
+
+    def close(self):
+        if getattr(self, 'closed', True):
+            return
+        self.closed = True
+        self.sampler.close()
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.tasks.close()
+        self.results.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
@@ -3,11 +3,50 @@ import matplotlib.pyplot as plt
 import pandas as pd
 
 
-if __name__ == "__main__":
+def plot_fold(path, fold=0):
+    """accuracy curves, plus throughput when fold_{i}_throughput.csv exists"""
+    history = pd.read_csv(path/"fold_{}_log.csv".format(fold))
+    throughput_path = path/"fold_{}_throughput.csv".format(fold)
+    if not throughput_path.exists():
+        plt.plot(history.epoch, history.acc, label="train_acc")
+        plt.plot(history.epoch, history.val_acc, label="val_acc")
+        plt.legend()
+        return
+
+    throughput = pd.read_csv(throughput_path)
+    fig, (acc_ax, speed_ax, time_ax) = plt.subplots(1, 3, figsize=(15, 4))
+    acc_ax.plot(history.epoch, history.acc, label="train_acc")
+    acc_ax.plot(history.epoch, history.val_acc, label="val_acc")
+    acc_ax.legend()
+
+    speed_ax.plot(throughput.epoch, throughput.samples_per_sec,
+                  label="samples/sec")
+    if "queue_depth" in throughput:
+        depth_ax = speed_ax.twinx()
+        depth_ax.plot(throughput.epoch, throughput.queue_depth,
+                      color="gray", linestyle="--", label="queue_depth")
+        depth_ax.legend(loc="lower right")
+    speed_ax.legend(loc="upper left")
+
+    time_ax.plot(throughput.epoch, throughput.data_wait, label="data_wait")
+    time_ax.plot(throughput.epoch, throughput.train_step, label="train_step")
+    for column in throughput.columns:
+        if column.startswith("stage_"):
+            time_ax.plot(throughput.epoch, throughput[column],
+                         linestyle=":", label=column[len("stage_"):])
+    time_ax.set_ylabel("seconds per epoch")
+    time_ax.legend()
+    fig.tight_layout()
 
-    path = Path("cv/STFTCNN/2017_12_12_01_45_32")
-    history = pd.read_csv(path/"fold_0_log.csv")
-    plt.plot(history.epoch, history.acc, label="train_acc")
-    plt.plot(history.epoch, history.val_acc, label="val_acc")
-    plt.legend()
-    plt.savefig(path/"visualize_loss.pdf")
+
+def main(path="cv/STFTCNN/2017_12_12_01_45_32", fold=0, out=None):
+    """plot_fold saved to out, path/visualize_loss.pdf by default"""
+    path = Path(path)
+    plot_fold(path, fold)
+    out = out or path/"visualize_loss.pdf"
+    plt.savefig(str(out))
+    return out
+
+
+if __name__ == "__main__":
+    main()
@@ -8,14 +8,35 @@ import utils
 
 
 def silence_data_load():
-    file_df = pd.read_csv(config.TRAIN_FILE_META_INFO)
+    file_df = utils.read_file_info()
     silence_df = file_df[file_df.possible_label == "_background_noise_"]
     return silence_df
 
 
-if __name__ == "__main__":
-    utils.set_seed(2017)
-    
+VIRTUAL_VERSION = "virtual"
+
+
+def virtual_silence_df(size=2500, seed=2017):
+    """file_info.csv style rows for silence cut on the fly by generator
+
+    Use it in place of a data/silence/<version> directory, the paths are
+    resolved by generator.SilenceSource instead of being read from disk.
+    """
+    import generator
+    return pd.DataFrame({"path": [generator.virtual_silence_path(seed, i)
+                                  for i in range(size)],
+                         "possible_label": "silence",
+                         "uid": "Nothing",
+                         "plnum": config.POSSIBLE_LABELS.index("silence")})
+
+
+def main(size=2500, seed=2017, silence_path=None):
+    """cut size one second clips from the background noise
+
+    Written to <silence_path>/<version>/ with a file_info.csv, returns the
+    version.
+    """
+    rng = np.random.RandomState(seed)
     silence_df = silence_data_load()
 
     silence_data = [wavfile.read(x)[1] for x in silence_df.path]
@@ -24,19 +45,19 @@ if __name__ == "__main__":
 
     version = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
 
-    size = 2500
-    dir_path = Path("data/silence/{}".format(version))
-    dir_path.mkdir(exist_ok=True)
+    dir_path = Path(silence_path or config.SILECE_DATA_PATH)/version
+    dir_path.mkdir(parents=True, exist_ok=True)
 
     path_list = [dir_path/"simple_slice_{}.wav".format(i) for i in range(size)]
     uid_list = ["Nothing" for _ in range(size)]
     possible_label_list = ["silence" for _ in range(size)]
-    plnum_list = [10 for _ in range(size)]
-    
-    for i in range(2500):
-        start = np.random.randint(0, len(silence_data) - length)
+    plnum_list = [config.POSSIBLE_LABELS.index("silence")
+                  for _ in range(size)]
+
+    for i in range(size):
+        start = rng.randint(0, len(silence_data) - length)
         wav = silence_data[start:start+length]
-        wavfile.write(path_list[i],
+        wavfile.write(str(path_list[i]),
                       length,
                       wav)
 
@@ -46,3 +67,8 @@ if __name__ == "__main__":
                  "plnum": plnum_list}
     pd.DataFrame(file_info).to_csv(dir_path/"file_info.csv",
                                    index=False)
+    return version
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from multiprocessing import Pool
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import config
+import generator
+import packed
+import utils
+
+"""
+Offline time stretch variants for augment.Stretch.
+
+Every training clip is stretched once per rate, at its full stretched
+length, and stored in the packed format (data/stretch/<rate>/audio.bin +
+audio_index.csv); Stretch crops or pads it like generator.fit_length.
+Chunks are written to data/stretch/<rate>/parts first, so an interrupted
+run picks up where it stopped. A part records its clip paths, rate, first
+row and PART_VERSION and is written again when any of them changed.
+"""
+
+RATES = (0.8, 0.9, 1.1, 1.2)
+# bump when the content of a part changes
+PART_VERSION = 2
+
+
+def bank_path(rate, stretch_path=config.STRETCH_BANK_PATH):
+    return Path(stretch_path)/"{:.2f}".format(rate)
+
+
+def load_banks(rates=RATES, stretch_path=config.STRETCH_BANK_PATH):
+    return {rate: packed.PackedReader(bank_path(rate, stretch_path))
+            for rate in rates}
+
+
+def part_matches(part_path, paths, rate, start):
+    """part_path holds this chunk, written with the current PART_VERSION"""
+    if not part_path.exists():
+        return False
+    with np.load(str(part_path)) as part:
+        if "version" not in part.files or part["version"] != PART_VERSION:
+            return False
+        return (part["rate"] == rate and
+                part["start"] == start and
+                np.array_equal(part["paths"], np.asarray(paths).astype(str)))
+
+
+def write_part(part_path, wavs, paths, rate, start):
+    tmp_path = part_path.with_suffix(".tmp.npz")
+    np.savez(str(tmp_path), wav=np.concatenate(wavs),
+             length=np.array([len(x) for x in wavs]),
+             paths=np.asarray(paths).astype(str),
+             rate=rate,
+             start=start,
+             version=PART_VERSION)
+    os.replace(str(tmp_path), str(part_path))
+
+
+def stretch_chunk(task):
+    import librosa
+    paths, rate, start, part_path = task
+    if part_matches(part_path, paths, rate, start):
+        return part_path
+
+    wavs = list()
+    for path in paths:
+        wav = generator.read_wav_file(path)[0]
+        wav = librosa.effects.time_stretch(wav, rate=rate)
+        wav = wav * np.iinfo(np.int16).max
+        wavs.append(np.clip(wav, np.iinfo(np.int16).min,
+                            np.iinfo(np.int16).max).astype(np.int16))
+    write_part(part_path, wavs, paths, rate, start)
+    return part_path
+
+
+def make_bank(file_df, rate,
+              stretch_path=config.STRETCH_BANK_PATH,
+              workers=4,
+              chunk_size=1000):
+    out_path = bank_path(rate, stretch_path)
+    parts_path = out_path/"parts"
+    parts_path.mkdir(parents=True, exist_ok=True)
+
+    paths = file_df.path.values
+    tasks = [(paths[start:start + chunk_size],
+              rate,
+              start,
+              parts_path/"part_{:05d}.npz".format(start // chunk_size))
+             for start in range(0, len(paths), chunk_size)]
+    with Pool(workers) as pool:
+        for i, _ in enumerate(pool.imap_unordered(stretch_chunk, tasks)):
+            print(rate, i + 1, len(tasks))
+
+    lengths = list()
+    with open(str(out_path/packed.BIN_NAME), "wb") as fout:
+        for _, _, _, part_path in tasks:
+            with np.load(str(part_path)) as part:
+                fout.write(part["wav"].astype("<i2").tobytes())
+                lengths.append(part["length"])
+    lengths = np.concatenate(lengths)
+
+    index = pd.DataFrame({"path": [packed.normalize_path(x) for x in paths],
+                          "source": "train",
+                          "row": file_df.index.values,
+                          "offset": np.cumsum(lengths) - lengths,
+                          "length": lengths,
+                          "sample_rate": generator.SAMPLE_RATE})
+    index.to_csv(out_path/packed.INDEX_NAME, index=False)
+    return index
+
+
+def main(rates=RATES, stretch_path=config.STRETCH_BANK_PATH, workers=4,
+         chunk_size=1000):
+    """one bank per rate for every training clip, returns stretch_path"""
+    file_df = utils.read_file_info()
+    file_df = file_df.reset_index(drop=True)
+    file_df = file_df[file_df.possible_label != "_background_noise_"]
+
+    for rate in rates:
+        make_bank(file_df, rate, stretch_path, workers, chunk_size)
+    return stretch_path
+
+
+if __name__ == "__main__":
+    import sys
+    import cli
+    cli.main(["stretch-bank"] + sys.argv[1:])
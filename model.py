@@ -5,29 +5,55 @@ from tensorflow.python.keras.layers import GlobalAveragePooling2D
 from tensorflow.python.keras.layers import GlobalMaxPool2D
 from tensorflow.python.keras.layers import concatenate, Dense, Dropout
 import config
+import frontend as frontends
+
+
+def conv_padding(input_shape, blocks=4):
+    """'valid' when the conv/pool blocks fit input_shape, else 'same'"""
+    for size in input_shape[:2]:
+        for _ in range(blocks):
+            size = (size - 2) // 2
+        if size < 1:
+            return 'same'
+    return 'valid'
 
 
 class STFTCNN():
 
     def __init__(self,
-                 name="STFTCNN"):
+                 name="STFTCNN",
+                 frontend="stft",
+                 filters=16):
 
         self.name = name
+        self.frontend = frontend
+        # filters of the first conv block, the rest of the net scales along
+        self.filters = filters
+
+    def __getstate__(self):
+        # the keras model is rebuilt by model_init in the receiving process
+        state = self.__dict__.copy()
+        state.pop("model", None)
+        return state
+
+    def model_init(self, input_shape=None):
+        """build and compile the model, input shape from the front end"""
+        if input_shape is None:
+            input_shape = frontends.get(self.frontend).feature_shape
+        padding = conv_padding(input_shape)
 
-    def model_init(self, input_shape=(257, 98, 2)):
-        
         x_in = Input(shape=input_shape)
         x = BatchNormalization()(x_in)
         for i in range(4):
-            x = Conv2D(16*(2 ** i), (3, 3))(x)
+            x = Conv2D(self.filters*(2 ** i), (3, 3), padding=padding)(x)
             x = Activation('elu')(x)
             x = BatchNormalization()(x)
             x = MaxPooling2D((2, 2))(x)
-        x = Conv2D(128, (1, 1))(x)
+        x = Conv2D(self.filters*8, (1, 1))(x)
         x_branch_1 = GlobalAveragePooling2D()(x)
         x_branch_2 = GlobalMaxPool2D()(x)
         x = concatenate([x_branch_1, x_branch_2])
-        x = Dense(256, activation='relu')(x)
+        x = Dense(self.filters*16, activation='relu')(x)
         x = Dropout(0.5)(x)
         x = Dense(len(config.POSSIBLE_LABELS), activation='softmax')(x)
         model = Model(inputs=x_in, outputs=x)
@@ -0,0 +1,123 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import config
+import generator
+
+"""
+Out-of-fold and test probability store.
+
+Every cross validation fold writes, under
+data/oof/<model>/<cv_version>/,
+
+fold_{i}_oof.npy   float16 probabilities of the clips held out of fold i
+fold_{i}_oof.csv   their clip ids (train path) and plnum, in row order
+fold_{i}_test.npy  float16 probabilities of the test clips
+test.csv           test file names, in row order
+
+Arrays are read memory mapped, so blend.py can combine runs without a
+forward pass.
+"""
+
+
+def predict_probs(fold_model, input_df, bg_paths, frontend=None, cache=None,
+                  reader=None, batch_size=64, store=None):
+    """(len(input_df), labels) probabilities of fold_model, in row order"""
+    test_gen = generator.batch_generator(input_df, batch_size,
+                                         len(config.POSSIBLE_LABELS),
+                                         bg_paths,
+                                         mode='test',
+                                         cache=cache,
+                                         reader=reader,
+                                         store=store,
+                                         frontend=frontend)
+    steps = int(np.ceil(len(input_df)/batch_size))
+    return np.concatenate([fold_model.predict_on_batch(next(test_gen))
+                           for _ in range(steps)])
+
+
+def gather(fold_probs, index, out=None):
+    """float32 (len(index), labels) probabilities of the rows of index
+
+    fold_probs and index as returned by OOFStore.oof(), index may be any
+    subset or order of its rows. Only those rows are read.
+    """
+    if out is None:
+        n_labels = next(iter(fold_probs.values())).shape[1]
+        out = np.empty((len(index), n_labels), dtype=np.float32)
+    folds = index["fold"].values
+    rows = index["row"].values
+    for fold, probs in fold_probs.items():
+        positions = np.flatnonzero(folds == fold)
+        if len(positions):
+            out[positions] = probs[rows[positions]]
+    return out
+
+
+class OOFStore():
+    """the probabilities of one cross validation run"""
+
+    def __init__(self, model_name, cv_version, root=config.OOF_STORE_PATH):
+        self.model_name = model_name
+        self.cv_version = cv_version
+        self.path = Path(root)/model_name/cv_version
+
+    def _write(self, name, probs):
+        self.path.mkdir(parents=True, exist_ok=True)
+        out = np.lib.format.open_memmap(str(self.path/name), mode="w+",
+                                        dtype=np.float16, shape=probs.shape)
+        out[:] = probs
+        out.flush()
+
+    def write_oof(self, fold, clips, labels, probs):
+        self._write("fold_{}_oof.npy".format(fold), probs)
+        pd.DataFrame({"clip": np.asarray(clips).astype(str),
+                      "plnum": labels}).to_csv(
+            str(self.path/"fold_{}_oof.csv".format(fold)), index=False)
+
+    def write_test(self, fold, fnames, probs):
+        fnames = np.asarray(fnames).astype(str)
+        index_path = self.path/"test.csv"
+        if index_path.exists():
+            if not np.array_equal(pd.read_csv(str(index_path)).fname.values
+                                  .astype(str), fnames):
+                raise ValueError("test clips differ from {}".format(
+                    index_path))
+        self._write("fold_{}_test.npy".format(fold), probs)
+        if not index_path.exists():
+            pd.DataFrame({"fname": fnames}).to_csv(str(index_path),
+                                                   index=False)
+
+    def folds(self, kind="oof"):
+        return sorted(int(x.name.split("_")[1])
+                      for x in self.path.glob("fold_*_{}.npy".format(kind)))
+
+    def oof(self):
+        """(index, {fold: (clips, labels) float16 memmap})
+
+        index has clip, plnum, fold and row, the clip's row in the array
+        of its fold. The folds stay on disk, read rows with gather().
+        """
+        folds = self.folds("oof")
+        if not folds:
+            raise ValueError("no out-of-fold probabilities in {}".format(
+                self.path))
+        index = list()
+        for fold in folds:
+            fold_index = pd.read_csv(
+                str(self.path/"fold_{}_oof.csv".format(fold)))
+            index.append(fold_index.assign(fold=fold,
+                                           row=np.arange(len(fold_index))))
+        probs = {fold: np.load(str(self.path/"fold_{}_oof.npy".format(fold)),
+                               mmap_mode="r") for fold in folds}
+        return pd.concat(index, ignore_index=True), probs
+
+    def test(self):
+        """(test file names, (folds, clips, labels) probs)"""
+        folds = self.folds("test")
+        if not folds:
+            raise ValueError("no test probabilities in {}".format(self.path))
+        fnames = pd.read_csv(str(self.path/"test.csv")).fname.values
+        probs = [np.load(str(self.path/"fold_{}_test.npy".format(fold)),
+                         mmap_mode="r") for fold in folds]
+        return fnames, np.stack(probs)
@@ -0,0 +1,130 @@
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.io import wavfile
+import config
+import utils
+
+"""
+Packed audio corpus.
+
+All clips are stored back to back in one int16 buffer (audio.bin) with an
+offset/length index (audio_index.csv), so reading a clip is a slice of a
+np.memmap instead of opening and parsing a wav file.
+"""
+
+BIN_NAME = "audio.bin"
+INDEX_NAME = "audio_index.csv"
+
+
+def normalize_path(path):
+    return os.path.normpath(str(path))
+
+
+def source_paths(sources, silence_data_version=None):
+    """paths per source, train rows keep the order of train_file_info.csv"""
+    frames = list()
+    if "train" in sources:
+        file_df = utils.read_file_info()
+        frames.append(pd.DataFrame({"path": file_df.path.values,
+                                    "source": "train",
+                                    "row": np.arange(len(file_df))}))
+    if "silence" in sources:
+        silence_path = Path(config.SILECE_DATA_PATH)/silence_data_version
+        silence_df = pd.read_csv(silence_path/"file_info.csv")
+        frames.append(pd.DataFrame({"path": silence_df.path.values,
+                                    "source": "silence",
+                                    "row": np.arange(len(silence_df))}))
+    if "test" in sources:
+        test_paths = sorted(Path(config.TEST_AUDIO_PATH).glob("*wav"))
+        frames.append(pd.DataFrame({"path": test_paths,
+                                    "source": "test",
+                                    "row": np.arange(len(test_paths))}))
+
+    index = pd.concat(frames, ignore_index=True)
+    index["path"] = index.path.apply(normalize_path)
+    return index
+
+
+def pack(index, pack_path=config.PACKED_AUDIO_PATH):
+    pack_path = Path(pack_path)
+    pack_path.mkdir(parents=True, exist_ok=True)
+
+    offsets = np.zeros(len(index), dtype=np.int64)
+    lengths = np.zeros(len(index), dtype=np.int64)
+    sample_rates = np.zeros(len(index), dtype=np.int64)
+    offset = 0
+    with open(str(pack_path/BIN_NAME), "wb") as fout:
+        for i, path in enumerate(index.path):
+            sample_rate, wav = wavfile.read(path)
+            if wav.dtype != np.int16:
+                raise ValueError("{} is not 16bit pcm".format(path))
+            fout.write(wav.astype("<i2").tobytes())
+            offsets[i] = offset
+            lengths[i] = len(wav)
+            sample_rates[i] = sample_rate
+            offset += len(wav)
+
+    index = index.assign(offset=offsets,
+                         length=lengths,
+                         sample_rate=sample_rates)
+    index.to_csv(pack_path/INDEX_NAME, index=False)
+    return index
+
+
+class PackedReader():
+
+    def __init__(self, pack_path=config.PACKED_AUDIO_PATH):
+        pack_path = Path(pack_path)
+        self.bin_path = str(pack_path/BIN_NAME)
+        self.index = pd.read_csv(pack_path/INDEX_NAME)
+        self.data = np.memmap(self.bin_path, dtype="<i2", mode="r")
+        self.position = dict(zip(self.index.path,
+                                 zip(self.index.offset.values,
+                                     self.index.length.values,
+                                     self.index.sample_rate.values)))
+        self.pack_mtime = os.path.getmtime(self.bin_path)
+
+    def __contains__(self, path):
+        return normalize_path(path) in self.position
+
+    def __getstate__(self):
+        # workers reopen the memmap instead of pickling the mapped data
+        state = self.__dict__.copy()
+        del state["data"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.data = np.memmap(self.bin_path, dtype="<i2", mode="r")
+
+    def read(self, path):
+        """int16 view into the packed buffer, no copy"""
+        offset, length, sample_rate = self.position[normalize_path(path)]
+        return self.data[offset:offset + length], sample_rate
+
+    def read_wav_file(self, path):
+        wav, sample_rate = self.read(path)
+        wav = wav.astype(np.float32) / np.iinfo(np.int16).max
+        return wav, sample_rate
+
+    def mtime(self, path):
+        return self.pack_mtime
+
+    def paths(self, source):
+        return self.index[self.index.source == source].path
+
+
+def main(sources=("train", "silence", "test"),
+         silence_data_version="2017_12_08_15_41_26",
+         pack_path=config.PACKED_AUDIO_PATH):
+    """pack the clips of sources, returns pack_path"""
+    pack(source_paths(list(sources), silence_data_version), pack_path)
+    return pack_path
+
+
+if __name__ == "__main__":
+    import sys
+    import cli
+    cli.main(["pack"] + sys.argv[1:])
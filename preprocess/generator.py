@@ -1,4 +1,5 @@
-import scipy as sp
+import numpy as np
+from scipy import signal
 
 
 # from https://www.kaggle.com/davids1992/speech-visualization-and-exploration
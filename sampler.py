@@ -0,0 +1,81 @@
+import queue
+import threading
+import numpy as np
+
+
+class EpochSampler():
+    """epoch plans as integer row positions, no pandas involved
+
+    In train mode every plan draws sampling_size rows per class (without
+    replacement) and shuffles them, like groupby('plnum').sample did. The
+    other modes walk the rows in order. With lookahead > 0 the next plans
+    are built in a background thread, so epoch boundaries do not stall.
+    """
+
+    def __init__(self, labels,
+                 mode='train',
+                 sampling_size=2000,
+                 lookahead=2,
+                 random_state=None):
+
+        labels = np.asarray(labels)
+        self.size = len(labels)
+        self.mode = mode
+        self.sampling_size = sampling_size
+        if random_state is None:
+            random_state = np.random.RandomState(np.random.randint(2 ** 31))
+        self.random_state = random_state
+
+        if mode == 'train':
+            self.class_positions = [np.flatnonzero(labels == label)
+                                    for label in np.unique(labels)]
+            too_small = [len(x) for x in self.class_positions
+                         if len(x) < sampling_size]
+            if too_small:
+                raise ValueError("sampling_size {} is larger than a class "
+                                 "of {} rows".format(sampling_size,
+                                                     min(too_small)))
+
+        self.plans = None
+        self.stopped = threading.Event()
+        if lookahead > 0 and mode == 'train':
+            self.plans = queue.Queue(maxsize=lookahead)
+            self.thread = threading.Thread(target=self._fill, daemon=True)
+            self.thread.start()
+
+    def plan(self):
+        if self.mode != 'train':
+            return np.arange(self.size)
+
+        picks = [self.random_state.choice(positions,
+                                          self.sampling_size,
+                                          replace=False)
+                 for positions in self.class_positions]
+        return self.random_state.permutation(np.concatenate(picks))
+
+    def _fill(self):
+        while not self.stopped.is_set():
+            plan = self.plan()
+            while not self.stopped.is_set():
+                try:
+                    self.plans.put(plan, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def next_plan(self):
+        if self.plans is None:
+            return self.plan()
+        return self.plans.get()
+
+    def __len__(self):
+        if self.mode != 'train':
+            return self.size
+        return self.sampling_size * len(self.class_positions)
+
+    def __iter__(self):
+        while True:
+            yield self.next_plan()
+
+    def close(self):
+        self.stopped.set()
@@ -0,0 +1,320 @@
+import asyncio
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from scipy.io import wavfile
+import config
+import frontend as frontends
+import generator
+
+"""
+Local inference server with dynamic micro-batching.
+
+POST /predict with the bytes of a 16 kHz 16bit wav file returns
+{"label": ..., "probs": {label: p, ...}} averaged over the loaded fold
+checkpoints. Requests that arrive within max_wait_ms of each other are
+featurized and scored as one batch of up to max_batch_size clips. GET
+/stats returns request and batch counters, GET /health returns ok.
+
+>>> serve("cv/STFTCNN/<version>", port=8000)
+>>> load_test(wav_paths, port=8000, concurrency=16, requests=2000)
+"""
+
+
+class FoldEnsemble():
+    """fold checkpoints loaded once, scored together on a wav batch"""
+
+    def __init__(self, cv_path, frontend="stft", runtime="keras"):
+        from tensorflow.python.keras import backend as K
+        import model
+        import submit
+        self.frontend = frontends.get(frontend)
+        self.models = submit.load_cv_models(
+            model.STFTCNN(frontend=frontend), cv_path, runtime)
+        if not self.models:
+            raise ValueError(
+                "no fold_*.hdf5 checkpoints in {}".format(cv_path))
+        # predictions run in an executor thread, which needs the session
+        # and graph the models were built in
+        self.session = K.get_session()
+
+    def __call__(self, wavs):
+        x_batch = self.frontend.featurize(wavs)
+        with self.session.graph.as_default(), self.session.as_default():
+            return np.mean([fold_model.predict_on_batch(x_batch)
+                            for fold_model in self.models], axis=0)
+
+
+def decode_wav(body):
+    """one second float32 clip from wav file bytes
+
+    Raises ValueError, answered with a 400, for anything but non-empty
+    16 kHz 16bit mono audio.
+    """
+    sample_rate, wav = wavfile.read(io.BytesIO(body))
+    if sample_rate != generator.SAMPLE_RATE:
+        raise ValueError("expected {} Hz audio, got {}".format(
+            generator.SAMPLE_RATE, sample_rate))
+    if wav.dtype != np.int16:
+        raise ValueError("expected 16bit pcm audio")
+    if wav.ndim != 1:
+        raise ValueError("expected mono audio, got {} channels".format(
+            wav.shape[1]))
+    if len(wav) == 0:
+        raise ValueError("empty audio")
+    wav = wav.astype(np.float32) / np.iinfo(np.int16).max
+    return generator.fit_length(wav, generator.SAMPLE_RATE)
+
+
+class MicroBatcher():
+    """groups concurrent predict() calls into batches for predict_fn
+
+    A batch is closed when it has max_batch_size clips or max_wait_ms
+    after its first clip arrived. predict_fn runs in a single worker
+    thread; while it is busy the next batch keeps growing (up to
+    max_batch_size), so batches get bigger exactly when the server is
+    loaded.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(1)
+        self.queue = None
+        self.task = None
+        self.running = None
+        self.batches = 0
+        self.clips = 0
+
+    def start(self):
+        """start collecting, from a coroutine on the serving loop"""
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._collect())
+
+    async def predict(self, wav):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((wav, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            if self.running is not None:
+                # waits without re-raising, a failed batch already
+                # reported to its own callers
+                await asyncio.wait([self.running])
+                while (len(batch) < self.max_batch_size and
+                       not self.queue.empty()):
+                    batch.append(self.queue.get_nowait())
+            # callers that gave up (timeout, disconnect) are not scored
+            batch = [item for item in batch if not item[1].done()]
+            if batch:
+                self.running = loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            wavs = np.stack([wav for wav, _ in batch])
+            probs = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.predict_fn, wavs)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.batches += 1
+        self.clips += len(batch)
+        for (_, future), row in zip(batch, probs):
+            if not future.done():
+                future.set_result(row)
+
+    def stats(self):
+        return {"batches": self.batches,
+                "clips": self.clips,
+                "mean_batch_size": self.clips / max(self.batches, 1)}
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+
+async def read_request(reader):
+    """(method, path, headers, body), or None when the client hung up"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, value = line.decode("latin-1").split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, headers, body
+
+
+def write_response(writer, status, payload):
+    body = json.dumps(payload).encode()
+    writer.write("HTTP/1.1 {}\r\nContent-Type: application/json\r\n"
+                 "Content-Length: {}\r\n\r\n".format(status,
+                                                      len(body)).encode())
+    writer.write(body)
+
+
+class InferenceServer():
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.labels = list(config.POSSIBLE_LABELS)
+        self.requests = 0
+        self.errors = 0
+
+    async def handle(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return "200 OK", {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            stats = dict(self.batcher.stats(), requests=self.requests,
+                         errors=self.errors)
+            return "200 OK", stats
+        if method != "POST" or path != "/predict":
+            return "404 Not Found", {"error": "unknown route"}
+
+        self.requests += 1
+        try:
+            wav = decode_wav(body)
+        except ValueError as error:
+            self.errors += 1
+            return "400 Bad Request", {"error": str(error)}
+        probs = await self.batcher.predict(wav)
+        return "200 OK", {"label": self.labels[int(np.argmax(probs))],
+                          "probs": dict(zip(self.labels,
+                                            map(float, probs)))}
+
+    async def connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, payload = await self.handle(method, path, body)
+                except Exception as error:
+                    self.errors += 1
+                    status, payload = "500 Internal Server Error", {
+                        "error": str(error)}
+                write_response(writer, status, payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(server, host, port):
+    server.batcher.start()
+    listener = await asyncio.start_server(server.connection, host, port)
+    print("serving on {}:{}".format(host, port))
+    try:
+        await listener.serve_forever()
+    finally:
+        listener.close()
+        await listener.wait_closed()
+        server.batcher.close()
+
+
+def serve(cv_path, host="127.0.0.1", port=8000, frontend="stft",
+          max_batch_size=32, max_wait_ms=5.0, predict_fn=None,
+          runtime="keras"):
+    """load the fold checkpoints under cv_path and serve until interrupted
+
+    runtime "pb" or "tflite" serves the export.py models of cv_path.
+    """
+    if predict_fn is None:
+        predict_fn = FoldEnsemble(cv_path, frontend, runtime)
+    batcher = MicroBatcher(predict_fn, max_batch_size, max_wait_ms)
+    try:
+        asyncio.run(_serve(InferenceServer(batcher), host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _client(host, port, bodies, latencies, remaining):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while remaining:
+            body = bodies[remaining.pop() % len(bodies)]
+            start = time.perf_counter()
+            writer.write("POST /predict HTTP/1.1\r\nHost: {}\r\n"
+                         "Content-Length: {}\r\n\r\n".format(
+                             host, len(body)).encode())
+            writer.write(body)
+            await writer.drain()
+            status = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            if b" 200 " in status:
+                latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+def load_test(wav_paths, host="127.0.0.1", port=8000, concurrency=8,
+              requests=1000):
+    """send requests wav files from concurrency keep-alive connections
+
+    Returns QPS and p50/p90/p99 latency of the successful requests.
+    """
+    bodies = [Path(x).read_bytes() for x in wav_paths]
+    latencies = list()
+    remaining = list(range(requests))
+
+    async def clients():
+        await asyncio.gather(*[_client(host, port, bodies, latencies,
+                                       remaining)
+                               for _ in range(concurrency)])
+
+    start = time.perf_counter()
+    asyncio.run(clients())
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    report = {"requests": requests,
+              "ok": len(latencies),
+              "concurrency": concurrency,
+              "qps": len(latencies) / elapsed}
+    for q in (50, 90, 99):
+        report["latency_ms_p{}".format(q)] = float(
+            np.percentile(latencies, q)) if len(latencies) else 0.0
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    import cli
+    cli.main(["serve"] + sys.argv[1:])
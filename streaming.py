@@ -0,0 +1,223 @@
+import time
+from collections import deque, namedtuple
+from pathlib import Path
+import numpy as np
+import config
+import frontend as frontends
+import generator
+
+"""
+Streaming keyword spotting.
+
+StreamingSpotter takes PCM chunks of any length, computes STFT frames only
+for the new audio (one frame per 160 sample hop), keeps the last second of
+feature columns in a ring buffer and runs the model on that window every
+stride frames. Posteriors are averaged over the last smoothing runs and a
+Detection is emitted when a keyword stays above threshold.
+
+>>> spotter = load_spotter("cv/STFTCNN/<version>/fold_0.hdf5")
+>>> detections = spotter.push(pcm_chunk)
+"""
+
+Detection = namedtuple("Detection", ["time", "label", "score"])
+
+# labels that are never reported as detections
+BACKGROUND_LABELS = ("silence", "unknown")
+
+
+class StreamingSpotter():
+    """incremental front end + sliding window model + posterior smoothing
+
+    model is a keras model (or anything with predict_on_batch) built for
+    the given front end. stride is the number of new frames between model
+    runs (10 frames = 100 ms), smoothing the number of runs averaged, and
+    refractory the seconds a label is muted after it was detected.
+    """
+
+    def __init__(self, model,
+                 frontend="stft",
+                 stride=10,
+                 smoothing=3,
+                 threshold=0.8,
+                 refractory=1.0,
+                 sample_rate=generator.SAMPLE_RATE):
+
+        self.model = model
+        self.frontend = frontends.get(frontend)
+        self.stride = stride
+        self.threshold = threshold
+        self.refractory = refractory
+        self.sample_rate = sample_rate
+        self.labels = np.array(config.POSSIBLE_LABELS)
+        self.keyword = ~np.isin(self.labels, BACKGROUND_LABELS)
+
+        rows, self.n_frames, channels = self.frontend.feature_shape
+        # every column is written twice, so the latest window is always
+        # the contiguous slice columns[:, head:head + n_frames]
+        self.columns = np.zeros((rows, 2 * self.n_frames, channels),
+                                dtype=np.float32)
+        self.x_batch = np.empty((1,) + self.frontend.feature_shape,
+                                dtype=np.float32)
+        self.posteriors = deque(maxlen=smoothing)
+        self.reset()
+
+    def reset(self):
+        self.samples = np.zeros(0, dtype=np.float32)
+        self.head = 0
+        self.frames = 0
+        self.since_run = 0
+        self.last_detection = dict()
+        self.posteriors.clear()
+        self.columns[:] = 0
+        self.frontend_seconds = list()
+        self.model_seconds = list()
+        self.audio_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def _to_float(self, chunk):
+        chunk = np.asarray(chunk)
+        if chunk.dtype == np.int16:
+            return chunk.astype(np.float32) / np.iinfo(np.int16).max
+        return chunk.astype(np.float32)
+
+    def _add_frames(self, max_frames):
+        """featurize up to max_frames complete frames, return the count"""
+        nperseg, hop = self.frontend.nperseg, self.frontend.hop
+        if len(self.samples) < nperseg:
+            return 0
+        n_new = min((len(self.samples) - nperseg) // hop + 1, max_frames)
+        start = time.perf_counter()
+        segment = self.samples[None, :nperseg + (n_new - 1) * hop]
+        features = self.frontend.frame_features(
+            self.frontend.spectrum(segment))[0]
+        for column in features:
+            self.columns[:, self.head] = column
+            self.columns[:, self.head + self.n_frames] = column
+            self.head = (self.head + 1) % self.n_frames
+        self.samples = self.samples[n_new * hop:]
+        self.frontend_seconds.append((time.perf_counter() - start) / n_new)
+        return n_new
+
+    def _run_model(self):
+        self.x_batch[0] = self.columns[:, self.head:self.head + self.n_frames]
+        start = time.perf_counter()
+        probs = np.asarray(self.model.predict_on_batch(self.x_batch))[0]
+        self.model_seconds.append(time.perf_counter() - start)
+        self.posteriors.append(probs)
+        return np.mean(self.posteriors, axis=0)
+
+    def _detect(self, smoothed, now):
+        scores = np.where(self.keyword, smoothed, 0)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        label = str(self.labels[best])
+        if now - self.last_detection.get(label, -np.inf) < self.refractory:
+            return None
+        self.last_detection[label] = now
+        return Detection(now, label, float(scores[best]))
+
+    def push(self, chunk):
+        """feed PCM samples (int16 or float), return new Detections"""
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        chunk = self._to_float(chunk)
+        self.audio_seconds += len(chunk) / self.sample_rate
+        self.samples = np.concatenate([self.samples, chunk])
+
+        detections = list()
+        # featurize up to each model run, so every run sees exactly the
+        # window ending at its own hop
+        while True:
+            wanted = self.stride - self.since_run
+            if self.frames < self.n_frames:
+                wanted = max(wanted, self.n_frames - self.frames)
+            added = self._add_frames(wanted)
+            if added == 0:
+                break
+            self.frames += added
+            self.since_run += added
+            if self.frames >= self.n_frames and self.since_run >= self.stride:
+                self.since_run = 0
+                smoothed = self._run_model()
+                now = self.frames * self.frontend.hop / self.sample_rate
+                detection = self._detect(smoothed, now)
+                if detection is not None:
+                    detections.append(detection)
+
+        self.wall_seconds += time.perf_counter() - wall_start
+        self.cpu_seconds += time.process_time() - cpu_start
+        return detections
+
+    def stats(self):
+        """per hop front end latency, per run model latency and cpu load"""
+        def percentiles(seconds):
+            if not seconds:
+                return {"p50_ms": 0.0, "p99_ms": 0.0}
+            seconds = np.array(seconds) * 1000
+            return {"p50_ms": float(np.percentile(seconds, 50)),
+                    "p99_ms": float(np.percentile(seconds, 99))}
+
+        audio = max(self.audio_seconds, 1e-9)
+        return {"frames": self.frames,
+                "model_runs": len(self.model_seconds),
+                "frontend_per_hop": percentiles(self.frontend_seconds),
+                "model_per_run": percentiles(self.model_seconds),
+                "real_time_factor": self.wall_seconds / audio,
+                "cpu_percent": 100 * self.cpu_seconds / audio}
+
+
+def load_spotter(weight_path, frontend="stft", **kwargs):
+    """StreamingSpotter around a trained STFTCNN checkpoint
+
+    A .pb or .tflite path from export.py is run with its export runner.
+    TensorFlow is only imported here, StreamingSpotter itself runs any
+    object with a predict_on_batch.
+    """
+    import export
+    import model
+    runtime = Path(weight_path).suffix[1:]
+    if runtime in export.RUNNERS:
+        return StreamingSpotter(export.RUNNERS[runtime](weight_path),
+                                frontend=frontend, **kwargs)
+    cnn = model.STFTCNN(frontend=frontend)
+    cnn.model_init()
+    cnn.model.load_weights(str(weight_path))
+    return StreamingSpotter(cnn.model, frontend=frontend, **kwargs)
+
+
+def replay_wav(spotter, path, chunk_size=1600, realtime=False):
+    """push a wav file through spotter in chunks, return its Detections
+
+    With realtime the replay sleeps for the duration of every chunk, so
+    cpu_percent in spotter.stats() is measured at live speed.
+    """
+    wav, sample_rate = generator.read_wav_file(str(path))
+    detections = list()
+    for start in range(0, len(wav), chunk_size):
+        chunk = wav[start:start + chunk_size]
+        detections.extend(spotter.push(chunk))
+        if realtime:
+            time.sleep(len(chunk) / sample_rate)
+    return detections
+
+
+def main(weight_path="cv/STFTCNN/2017_12_11_13_14_00/fold_0.hdf5",
+         wav_path="input/train/audio/_background_noise_/running_tap.wav",
+         frontend="stft", chunk_size=1600, realtime=False, **kwargs):
+    """replay wav_path through a spotter, print detections and stats
+
+    kwargs go to StreamingSpotter.
+    """
+    spotter = load_spotter(weight_path, frontend=frontend, **kwargs)
+    for detection in replay_wav(spotter, wav_path, chunk_size, realtime):
+        print(detection)
+    print(spotter.stats())
+    return spotter
+
+
+if __name__ == "__main__":
+    import sys
+    import cli
+    cli.main(["stream"] + sys.argv[1:])
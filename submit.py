@@ -2,85 +2,252 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 import generator
+import loader
 import config
+import export
+import frontend as frontends
 import model
+import packed
+import tf_pipeline
 import utils
 
+FNAMES_FILE = "fnames.csv"
 
-def test_data_load():
-    file_df = pd.read_csv(config.TRAIN_FILE_META_INFO)
+
+def test_data_load(reader=None):
+    file_df = utils.read_file_info()
     df = file_df[["path", "uid", "possible_label", "plnum"]]
     silence_paths = df[df["possible_label"] == "_background_noise_"]
     
-    test_paths = Path(config.TEST_AUDIO_PATH).glob("*wav")
+    if reader is not None:
+        test_paths = reader.paths("test").values
+    else:
+        test_paths = Path(config.TEST_AUDIO_PATH).glob("*wav")
     test_paths = pd.DataFrame(test_paths, columns=["path"])
     return test_paths, silence_paths
 
 
-def predict(test_paths, silence_paths, estimator):
+def test_generator(test_paths, silence_paths, batch_size,
+                   reader=None, workers=0, backend="numpy", frontend=None):
+    if backend == "tf":
+        if frontend is not None and frontend.name != "stft":
+            raise ValueError("the tf backend only has the stft front end")
+        return tf_pipeline.TFDataLoader(test_paths,
+                                        batch_size,
+                                        len(config.POSSIBLE_LABELS),
+                                        silence_paths,
+                                        mode='test',
+                                        reader=reader,
+                                        parallel_calls=max(workers, 1))
+    if workers > 0:
+        return loader.PrefetchLoader(test_paths,
+                                     batch_size,
+                                     len(config.POSSIBLE_LABELS),
+                                     silence_paths,
+                                     mode='test',
+                                     reader=reader,
+                                     workers=workers,
+                                     frontend=frontend)
+    return generator.batch_generator(test_paths,
+                                     batch_size,
+                                     len(config.POSSIBLE_LABELS),
+                                     silence_paths,
+                                     mode='test',
+                                     reader=reader,
+                                     frontend=frontend)
+
+
+def close_generator(test_gen):
+    if isinstance(test_gen, (loader.PrefetchLoader,
+                             tf_pipeline.TFDataLoader)):
+        test_gen.close()
+
+
+def predict(test_paths, silence_paths, estimator, reader=None, workers=0,
+            backend="numpy"):
     batch_size = 64
-    test_generator = generator.batch_generator(test_paths,
-                                               batch_size,
-                                               len(config.POSSIBLE_LABELS),
-                                               silence_paths,
-                                               mode='test')
-
+    test_gen = test_generator(test_paths, silence_paths, batch_size,
+                              reader, workers, backend,
+                              frontends.get(estimator.frontend))
     steps = int(np.ceil(len(test_paths)/batch_size))
-    predict_probs = estimator.model.predict_generator(test_generator, steps)
+    try:
+        if isinstance(test_gen, tf_pipeline.TFDataLoader):
+            predict_probs = estimator.model.predict(test_gen.dataset,
+                                                    steps=steps)
+        else:
+            predict_probs = estimator.model.predict_generator(test_gen,
+                                                              steps)
+    finally:
+        close_generator(test_gen)
     return predict_probs
 
 
-def ensemble(estimator, cv_path, test_paths, silence_paths, sub_path):
-    cv_models = Path(cv_path).glob("*.hdf5")
-    ensemble_probas = list()
-    
-    for estimator_weight_path in cv_models:
-        estimator.model.load_weights(estimator_weight_path)
-        predict_probs = predict(test_paths, silence_paths, estimator)
-        ensemble_probas.append(predict_probs)
-
-    return ensemble_probas
+def load_cv_models(estimator, cv_path, runtime="keras"):
+    """one model per fold checkpoint, built with estimator
+
+    runtime "pb" or "tflite" loads the export.py runners of cv_path
+    instead of the keras checkpoints.
+    """
+    if runtime != "keras":
+        return export.load_runners(cv_path, runtime)
+    cv_models = list()
+    weight_paths = sorted(Path(cv_path).glob("fold_*.hdf5"))
+    for estimator_weight_path in weight_paths:
+        estimator.model_init()
+        estimator.model.load_weights(str(estimator_weight_path))
+        cv_models.append(estimator.model)
+    return cv_models
+
+
+class SubmissionWriter():
+    """streams ensemble predictions to disk in chunks
+
+    Fold probabilities go to sub_path/<fold>_probs.npy (float16, one row per
+    test clip in submission order) with the clip names of the rows in
+    sub_path/fnames.csv, and the fold mean is turned into labels and
+    appended to submit_file, so memory does not grow with the test set.
+    """
+
+    def __init__(self, sub_path, submit_file, n_rows, n_folds):
+        n_labels = len(config.POSSIBLE_LABELS)
+        self.labels = np.array(config.POSSIBLE_LABELS)
+        self.fold_probs = [np.lib.format.open_memmap(
+            str(Path(sub_path)/"{}_probs.npy".format(fold)),
+            mode="w+",
+            dtype=np.float16,
+            shape=(n_rows, n_labels)) for fold in range(n_folds)]
+        self.fnames = open(str(Path(sub_path)/FNAMES_FILE), "w")
+        self.fnames.write("fname\n")
+        self.fout = open(str(submit_file), "w")
+        self.fout.write("fname,label\n")
+        self.start = 0
+
+    def write(self, fnames, fold_probs):
+        end = self.start + len(fnames)
+        for probs, fold_file in zip(fold_probs, self.fold_probs):
+            fold_file[self.start:end] = probs
+        pd.DataFrame({"fname": fnames}).to_csv(self.fnames, header=False,
+                                               index=False)
+        predict_cls = np.argmax(np.mean(fold_probs, axis=0), axis=1)
+        chunk = pd.DataFrame({"fname": fnames,
+                              "label": self.labels[predict_cls]})
+        chunk.to_csv(self.fout, header=False, index=False)
+        self.start = end
+
+    def close(self):
+        for fold_file in self.fold_probs:
+            fold_file.flush()
+        self.fold_probs = list()
+        self.fnames.close()
+        self.fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_fold_probs(sub_path, fnames):
+    """(folds, clips, labels) probs of sub_path in the order of fnames
+
+    Raises ValueError when the rows on disk were written for other clips or
+    in another order.
+    """
+    fnames_path = Path(sub_path)/FNAMES_FILE
+    if not fnames_path.exists():
+        raise ValueError("no clip names in {}".format(sub_path))
+    written = pd.read_csv(str(fnames_path)).fname.values.astype(str)
+    if not np.array_equal(written, np.asarray(fnames).astype(str)):
+        raise ValueError("test clips differ from {}".format(fnames_path))
+    fold_paths = sorted(Path(sub_path).glob("*_probs.npy"),
+                        key=lambda x: int(x.name.split("_")[0]))
+    return np.stack([np.load(str(x), mmap_mode="r") for x in fold_paths])
+
+
+def ensemble_batches(cv_models, test_gen, steps):
+    """(n_folds, batch, labels) probabilities per test batch"""
+    if (isinstance(test_gen, tf_pipeline.TFDataLoader) and
+            all(callable(fold_model) for fold_model in cv_models)):
+        # keras models run on the tf.data batches inside the graph,
+        # export runners take the numpy batches below
+        yield from test_gen.predict_batches(cv_models, steps)
+        return
+    for _ in range(steps):
+        x_batch = next(test_gen)
+        yield np.stack([fold_model.predict_on_batch(x_batch)
+                        for fold_model in cv_models])
+
+
+def ensemble(estimator, cv_path, test_paths, silence_paths, sub_path,
+             submit_file=None, reader=None, workers=0, backend="numpy",
+             runtime="keras"):
+    """write the fold ensemble submission in a single streaming pass
+
+    Every test batch is featurized once, fed to each fold model and handed
+    to SubmissionWriter. When sub_path already holds the fold probabilities
+    of test_paths they are read back and labelled without a forward pass.
+    submit_file defaults to submit/<now>.csv, it is returned.
+    """
+    if submit_file is None:
+        submit_file = 'submit/{}.csv'.format(utils.now())
+    Path(submit_file).parent.mkdir(parents=True, exist_ok=True)
+    test_fname = test_paths["path"].astype(str).str.split("/").str[-1]
+    test_fname = test_fname.values
+    if (Path(sub_path)/FNAMES_FILE).exists():
+        probs = read_fold_probs(sub_path, test_fname).mean(axis=0,
+                                                           dtype=np.float32)
+        labels = np.array(config.POSSIBLE_LABELS)[np.argmax(probs, axis=1)]
+        pd.DataFrame({"fname": test_fname, "label": labels}).to_csv(
+            str(submit_file), index=False)
+        return submit_file
 
+    batch_size = 64
+    cv_models = load_cv_models(estimator, cv_path, runtime)
+    test_gen = test_generator(test_paths, silence_paths, batch_size,
+                              reader, workers, backend,
+                              frontends.get(estimator.frontend))
+    steps = int(np.ceil(len(test_paths)/batch_size))
 
-if __name__ == '__main__':
-
-    version = utils.now()
-    id2name = dict(zip(range(len(config.POSSIBLE_LABELS)),
-                       config.POSSIBLE_LABELS))
-    
-    cnn = model.STFTCNN()
-    cnn.model_init()
-    test_paths, silence_paths = test_data_load()
-    cv_path = "cv/STFTCNN/2017_12_11_13_14_00"
-    sub_path = Path("sub/STFTCNN")/version
-    sub_path.mkdir(parents=True, exist_ok=True)
+    writer = SubmissionWriter(sub_path, submit_file,
+                              len(test_paths), len(cv_models))
+    try:
+        with writer:
+            batches = ensemble_batches(cv_models, test_gen, steps)
+            for fold_probs in batches:
+                end = writer.start + fold_probs.shape[1]
+                writer.write(test_fname[writer.start:end], fold_probs)
+    finally:
+        close_generator(test_gen)
 
-    ensemble_probs = ensemble(cnn,
-                              cv_path,
-                              test_paths,
-                              silence_paths,
-                              sub_path)
+    return submit_file
 
-    test_fname = test_paths["path"].apply(lambda x: Path(x).parts[-1])
 
-    for fold, probs in enumerate(ensemble_probs):
-        sub_fold_plobs = pd.DataFrame(probs,
-                                      columns=config.POSSIBLE_LABELS)
-        sub_fold_plobs_df = pd.concat([test_fname, sub_fold_plobs], axis=1)
-        sub_fold_plobs_df.to_csv(sub_path/"{}_probs.csv".format(fold),
-                                 index=False)
+def main(cv_path="cv/STFTCNN/2017_12_11_13_14_00", name="STFTCNN",
+         frontend="stft", filters=16, submit_file=None, packed_path=None,
+         workers=0, backend="numpy", runtime="keras"):
+    """fold ensemble submission of cv_path, returns the submission file"""
+    version = utils.now()
 
-    predict_probs = np.array(ensemble_probs).mean(axis=0)
-    predict_cls = np.argmax(predict_probs, axis=1)
+    cnn = model.STFTCNN(name, frontend=frontend, filters=filters)
+    reader = None
+    if packed_path is not None:
+        reader = packed.PackedReader(packed_path)
+    test_paths, silence_paths = test_data_load(reader)
+    sub_path = Path("sub")/name/version
+    sub_path.mkdir(parents=True, exist_ok=True)
 
-    submission = dict()
+    return ensemble(cnn,
+                    cv_path,
+                    test_paths,
+                    silence_paths,
+                    sub_path,
+                    submit_file,
+                    reader=reader,
+                    workers=workers,
+                    backend=backend,
+                    runtime=runtime)
 
-    for i in range(len(test_paths)):
-        fname = Path(test_paths.iloc[i][0]).parts[-1]
-        label = id2name[predict_cls[i]]
-        submission[fname] = label
 
-    with open('submit/{}.csv'.format(version), 'w') as fout:
-        fout.write('fname,label\n')
-        for fname, label in submission.items():
-            fout.write('{},{}\n'.format(fname, label))
+if __name__ == '__main__':
+    main()
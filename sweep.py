@@ -0,0 +1,312 @@
+import json
+import math
+import multiprocessing as mp
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import utils
+
+"""
+Successive halving / Hyperband hyperparameter sweeps.
+
+A search space maps parameter names to lists of choices:
+
+>>> space = {"batch_size": [32, 64, 128], "filters": [8, 16, 24],
+...          "lr_factor": [0.1, 0.3, 0.5], "patience": [3, 5]}
+>>> successive_halving(space, "2017_12_08_15_41_26", n_trials=27)
+
+Trials are trained on the validation() split, each one in its own spawn
+process with threads TF threads. A rung trains every trial up to its
+epoch budget, the best 1/eta by val_loss continue to eta times the
+budget from where they stopped: the full model with optimizer state and
+learning rate (model_state.hdf5) and the early stopping / lr schedule
+counters (callbacks.json). Everything goes to cv/<model>/<sweep_id>:
+trial_{k}/config.json, model.hdf5 (best weights), model_state.hdf5,
+callbacks.json, rung_{r}_log.csv, rung_{r}.json and sweep.json with all
+results and the best configuration. Finished rungs are not rerun, so a
+sweep can be resumed with the same sweep_id.
+"""
+
+ESTIMATOR_PARAMS = ("filters", "frontend")
+LEARNER_PARAMS = ("patience", "lr_factor", "lr_patience")
+EXPERIMENT_PARAMS = ("batch_size", "sample_size")
+
+SPACE = {"batch_size": [32, 64, 128],
+         "sample_size": [1200, 1800],
+         "filters": [8, 16, 24],
+         "patience": [3, 5],
+         "lr_factor": [0.1, 0.3, 0.5]}
+
+
+def sample_configs(space, n_trials, seed=2017):
+    """n_trials distinct random configurations, fewer if space is small"""
+    unknown = set(space) - set(ESTIMATOR_PARAMS + LEARNER_PARAMS +
+                               EXPERIMENT_PARAMS)
+    if unknown:
+        raise ValueError("unknown sweep parameters {}".format(
+            sorted(unknown)))
+    rng = np.random.RandomState(seed)
+    n_total = int(np.prod([len(x) for x in space.values()]))
+    configs = list()
+    while len(configs) < min(n_trials, n_total):
+        config = {name: choices[rng.randint(len(choices))]
+                  for name, choices in sorted(space.items())}
+        config = {name: value.item() if hasattr(value, "item") else value
+                  for name, value in config.items()}
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+def _trial_worker(model_name, trial_path, rung, config, epochs,
+                  initial_epoch, silence_data_version, silence_train_size,
+                  threads, seed, workers, use_cache, packed_path):
+    from tensorflow.python.keras.models import load_model
+    import experiment
+    import model
+    utils.set_seed(seed)
+    utils.configure_session(threads)
+
+    file_df, bg_paths, silence_df = experiment.data_load(
+        silence_data_version)
+    train_df = pd.concat([file_df[~file_df.is_valid],
+                          silence_df.iloc[:silence_train_size]])
+    valid_df = pd.concat([file_df[file_df.is_valid],
+                          silence_df.iloc[silence_train_size:]])
+
+    estimator = model.STFTCNN(model_name, **{
+        name: config[name] for name in ESTIMATOR_PARAMS if name in config})
+    cache, reader, augmentation = experiment.data_resources(
+        bg_paths, use_cache, packed_path,
+        frontend_name=estimator.frontend)
+
+    weight_path = trial_path/"model.hdf5"
+    state_path = trial_path/"model_state.hdf5"
+    if initial_epoch > 0:
+        estimator.model = load_model(str(state_path))
+    else:
+        estimator.model_init()
+    learner_options = {name: config[name]
+                       for name in LEARNER_PARAMS if name in config}
+    learner_options["state_path"] = str(trial_path/"callbacks.json")
+    history = experiment.experiment(
+        estimator, train_df, valid_df, bg_paths,
+        config.get("batch_size", 64),
+        config.get("sample_size", 1800),
+        version_path=str(weight_path),
+        csv_log_path=str(trial_path/"rung_{}_log.csv".format(rung)),
+        cache=cache,
+        reader=reader,
+        workers=workers,
+        augmentation=augmentation,
+        epochs=epochs,
+        initial_epoch=initial_epoch,
+        learner_options=learner_options)
+    estimator.model.save(str(state_path))
+
+    result = {"rung": rung,
+              "epochs": epochs,
+              "trained_epochs": len(history.history["val_loss"]),
+              "val_loss": float(min(history.history["val_loss"])),
+              "val_acc": float(max(history.history["val_acc"]))}
+    with open(str(trial_path/"rung_{}.json".format(rung)), "w") as fout:
+        json.dump(result, fout, indent=2)
+
+
+def run_rung(sweep_path, rung, trials, epochs, initial_epoch,
+             silence_data_version, model_name="STFTCNN",
+             trial_workers=None, threads=None, seed=2017, workers=0,
+             use_cache=True, packed_path=None, silence_train_size=2000):
+    """train trials ({trial_no: config}) to epochs, return their results
+
+    Each trial runs in its own spawn process, trial_workers at a time,
+    with threads intra op threads (cpu count / trial_workers by default).
+    A failed trial gets val_loss inf and is not promoted. With use_cache
+    and a config.FEATURE_CACHE_PATH the trials share the disk feature
+    cache, whose entries are written to a per process temporary file and
+    renamed into place.
+    """
+    if trial_workers is None:
+        trial_workers = len(trials)
+    trial_workers = max(1, min(trial_workers, len(trials)))
+    if threads is None:
+        threads = max(1, mp.cpu_count() // trial_workers)
+
+    def result_path(trial_no):
+        return (sweep_path/"trial_{}".format(trial_no)/
+                "rung_{}.json".format(rung))
+
+    # TF is not fork safe, trial processes start from a clean interpreter
+    context = mp.get_context("spawn")
+    waiting = [x for x in sorted(trials) if not result_path(x).exists()]
+    running = dict()
+    while waiting or running:
+        while waiting and len(running) < trial_workers:
+            trial_no = waiting.pop(0)
+            process = context.Process(
+                target=_trial_worker,
+                args=(model_name, sweep_path/"trial_{}".format(trial_no),
+                      rung, trials[trial_no], epochs, initial_epoch,
+                      silence_data_version, silence_train_size, threads,
+                      seed + trial_no, workers, use_cache, packed_path))
+            process.start()
+            running[trial_no] = process
+
+        for trial_no, process in list(running.items()):
+            process.join(timeout=1)
+            if process.exitcode is None:
+                continue
+            del running[trial_no]
+            if process.exitcode != 0:
+                print("trial {} failed with exit code {}".format(
+                    trial_no, process.exitcode))
+
+    results = dict()
+    for trial_no in trials:
+        if result_path(trial_no).exists():
+            with open(str(result_path(trial_no))) as fin:
+                results[trial_no] = json.load(fin)
+        else:
+            results[trial_no] = {"rung": rung, "epochs": epochs,
+                                 "trained_epochs": 0,
+                                 "val_loss": math.inf, "val_acc": 0.0}
+    return results
+
+
+def successive_halving(space, silence_data_version,
+                       n_trials=27,
+                       min_epochs=2,
+                       max_epochs=20,
+                       eta=3,
+                       sweep_id=None,
+                       model_name="STFTCNN",
+                       seed=2017,
+                       first_trial=0,
+                       **kwargs):
+    """random configurations of space, raced by successive halving
+
+    Rung r trains the surviving trials to min_epochs * eta ** r epochs
+    (capped at max_epochs) and keeps the best 1/eta of them by val_loss.
+    kwargs go to run_rung (trial_workers, threads, workers, use_cache,
+    packed_path, silence_train_size). Returns the sweep summary that is
+    also written to sweep.json.
+    """
+    if sweep_id is None:
+        sweep_id = utils.now()
+    sweep_path = Path("cv")/model_name/sweep_id
+    configs = sample_configs(space, n_trials, seed)
+    trials = dict()
+    for trial_no, config in enumerate(configs, first_trial):
+        trial_path = sweep_path/"trial_{}".format(trial_no)
+        trial_path.mkdir(parents=True, exist_ok=True)
+        with open(str(trial_path/"config.json"), "w") as fout:
+            json.dump(config, fout, indent=2)
+        trials[trial_no] = config
+
+    history = {trial_no: list() for trial_no in trials}
+    alive = dict(trials)
+    rung, trained = 0, 0
+    while alive:
+        epochs = min(min_epochs * eta ** rung, max_epochs)
+        results = run_rung(sweep_path, rung, alive, epochs, trained,
+                           silence_data_version, model_name,
+                           seed=seed, **kwargs)
+        for trial_no, result in results.items():
+            history[trial_no].append(result)
+        if epochs >= max_epochs:
+            break
+        ranked = sorted(results, key=lambda x: results[x]["val_loss"])
+        keep = max(1, len(ranked) // eta)
+        alive = {trial_no: trials[trial_no] for trial_no in ranked[:keep]
+                 if math.isfinite(results[trial_no]["val_loss"])}
+        rung, trained = rung + 1, epochs
+
+    return summarize(sweep_path, trials, history, max_epochs)
+
+
+def hyperband(space, silence_data_version,
+              min_epochs=1,
+              max_epochs=27,
+              eta=3,
+              sweep_id=None,
+              model_name="STFTCNN",
+              seed=2017,
+              **kwargs):
+    """Hyperband: successive halving brackets from aggressive to none
+
+    Bracket s starts n = ceil((s_max + 1) / (s + 1) * eta ** s) trials
+    at max_epochs / eta ** s epochs. Brackets share the sweep directory,
+    trial numbers continue across them.
+    """
+    if sweep_id is None:
+        sweep_id = utils.now()
+    s_max = int(math.log(max_epochs / min_epochs, eta) + 1e-9)
+    first_trial = 0
+    summaries = list()
+    for s in range(s_max, -1, -1):
+        n_trials = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        summary = successive_halving(
+            space, silence_data_version,
+            n_trials=n_trials,
+            min_epochs=max(min_epochs, int(max_epochs / eta ** s)),
+            max_epochs=max_epochs,
+            eta=eta,
+            sweep_id=sweep_id,
+            model_name=model_name,
+            seed=seed + s,
+            first_trial=first_trial,
+            **kwargs)
+        first_trial += n_trials
+        summaries.append(summary)
+
+    sweep_path = Path("cv")/model_name/sweep_id
+    trials = dict()
+    history = dict()
+    for summary in summaries:
+        for trial in summary["trials"]:
+            trials[trial["trial"]] = trial["config"]
+            history[trial["trial"]] = trial["rungs"]
+    return summarize(sweep_path, trials, history, max_epochs)
+
+
+def summarize(sweep_path, trials, history, max_epochs):
+    """sweep.json: every trial, the best one and the epochs spent"""
+    def final(trial_no):
+        # longest trained first, then lowest val_loss
+        last = history[trial_no][-1]
+        return -last["epochs"], last["val_loss"]
+
+    best = min(history, key=final)
+    spent = sum(rung["trained_epochs"]
+                for rungs in history.values() for rung in rungs)
+    summary = {"trials": [{"trial": trial_no,
+                           "config": trials[trial_no],
+                           "rungs": history[trial_no]}
+                          for trial_no in sorted(trials)],
+               "best": {"trial": best,
+                        "config": trials[best],
+                        "result": history[best][-1]},
+               "epochs_spent": spent,
+               "epochs_grid": len(trials) * max_epochs}
+    with open(str(sweep_path/"sweep.json"), "w") as fout:
+        json.dump(summary, fout, indent=2)
+    print(summary["best"], spent, summary["epochs_grid"])
+    return summary
+
+
+def main(space=None, silence_data_version="2017_12_08_15_41_26",
+         method="hyperband", **kwargs):
+    """hyperband or successive_halving sweep of space (SPACE by default)
+
+    kwargs go to the sweep function, returns the sweep summary.
+    """
+    if space is None:
+        space = SPACE
+    sweeps = {"hyperband": hyperband, "halving": successive_halving}
+    return sweeps[method](space, silence_data_version, **kwargs)
+
+
+if __name__ == "__main__":
+    import sys
+    import cli
+    cli.main(["sweep"] + sys.argv[1:])
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import augment
+
+
+class FakeBank():
+
+    def __init__(self, clips):
+        self.clips = clips
+
+    def __contains__(self, path):
+        return path in self.clips
+
+    def read_wav_file(self, path):
+        return self.clips[path], 16000
+
+
+def test_stretch_needs_paths():
+    stretch = augment.Stretch({1.1: FakeBank({})}, p=1.0)
+    wavs = np.zeros((2, 100), dtype=np.float32)
+    with pytest.raises(ValueError):
+        stretch(wavs)
+    with pytest.raises(ValueError):
+        augment.Augmentation([stretch])(wavs)
+
+
+def test_stretch_crops_and_skips_missing():
+    np.random.seed(0)
+    long_clip = np.arange(150, dtype=np.float32)
+    short_clip = np.ones(60, dtype=np.float32)
+    stretch = augment.Stretch({1.1: FakeBank({"a": long_clip,
+                                              "b": short_clip})}, p=1.0)
+    paths = ["a", "b", "silence://0"]
+    params = stretch.sample(3, np.random, paths)
+    np.testing.assert_array_equal(stretch.touched(params),
+                                  [True, True, False])
+
+    wavs = np.full((3, 100), -1, dtype=np.float32)
+    wavs = stretch.apply(wavs, params, paths)
+    # a random one second window of the long clip, not its start
+    start = int(wavs[0, 0])
+    np.testing.assert_array_equal(wavs[0], long_clip[start:start + 100])
+    assert wavs[1].sum() == 60
+    np.testing.assert_array_equal(wavs[2], -1)
+
+
+def test_fit_length():
+    np.random.seed(1)
+    assert len(augment.fit_length(np.ones(120), 100)) == 100
+    padded = augment.fit_length(np.ones(80), 100)
+    assert len(padded) == 100 and padded.sum() == 80
+    np.testing.assert_array_equal(augment.fit_length(np.ones(100), 100),
+                                  np.ones(100))
@@ -0,0 +1,43 @@
+import numpy as np
+import blend
+import oof
+
+
+def noisy_probs(labels, noise, seed):
+    random = np.random.RandomState(seed)
+    probs = np.eye(12)[labels] + noise * random.rand(len(labels), 12)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+
+def test_fit_weights_prefers_the_better_run():
+    labels = np.random.RandomState(0).randint(12, size=500)
+    probs = np.stack([noisy_probs(labels, 0.5, 1),
+                      noisy_probs(labels, 50.0, 2)])
+    weights = blend.fit_weights(probs, labels)
+    assert weights.shape == (2,)
+    assert np.isclose(weights.sum(), 1) and (weights >= 0).all()
+    assert weights[0] > weights[1]
+    assert (blend.log_loss(blend.blend(probs, weights), labels) <=
+            blend.log_loss(probs.mean(axis=0), labels) + 1e-9)
+
+
+def test_load_runs_aligns_clips(tmp_path):
+    labels = {"a": 0, "b": 1, "c": 2, "d": 3}
+    first = oof.OOFStore("STFTCNN", "v1", root=tmp_path)
+    first.write_oof(0, ["a", "b"], [0, 1], np.eye(12)[[0, 1]])
+    first.write_oof(1, ["c", "d"], [2, 3], np.eye(12)[[2, 3]])
+    second = oof.OOFStore("STFTCNN_b", "v2", root=tmp_path)
+    second.write_oof(0, ["d", "b", "c"], [3, 1, 2], np.eye(12)[[3, 1, 2]])
+    for store in (first, second):
+        for fold in range(2):
+            store.write_test(fold, ["x.wav"], np.eye(12)[[fold]])
+
+    blended = blend.load_runs([("STFTCNN", "v1"), ("STFTCNN_b", "v2")],
+                              root=tmp_path)
+    assert list(blended.clips) == ["b", "c", "d"]
+    assert list(blended.labels) == [labels[x] for x in blended.clips]
+    assert blended.oof.dtype == np.float32
+    np.testing.assert_array_equal(blended.oof.argmax(axis=2),
+                                  [blended.labels, blended.labels])
+    np.testing.assert_allclose(blended.test[0, 0, :2], [0.5, 0.5],
+                               atol=1e-3)
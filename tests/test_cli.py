@@ -0,0 +1,159 @@
+import os
+import pytest
+import cli
+
+
+def parse(*argv):
+    return cli.build_parser().parse_args(list(argv))
+
+
+def test_index():
+    args = parse("index", "--workers", "2")
+    assert args.func is cli.index
+    assert args.workers == 2
+
+
+def test_make_silence():
+    args = parse("make-silence", "--size", "10", "--seed", "1")
+    assert args.func is cli.make_silence
+    assert (args.size, args.seed) == (10, 1)
+
+
+def test_train_cv():
+    args = parse("train-cv", "--fold-workers", "3", "--filters", "8",
+                 "--no-cache", "--no-predict-test")
+    assert args.func is cli.train_cv
+    assert args.fold_workers == 3
+    assert args.filters == 8
+    assert args.no_cache and args.no_predict_test
+    assert args.silence_version == "virtual"
+
+
+def test_predict():
+    args = parse("predict", "--cv-path", "cv/STFTCNN/x",
+                 "--runtime", "tflite")
+    assert args.func is cli.predict
+    assert (args.cv_path, args.runtime) == ("cv/STFTCNN/x", "tflite")
+
+
+def test_predict_needs_cv_path():
+    with pytest.raises(SystemExit):
+        parse("predict")
+
+
+def test_submit_runs_append():
+    args = parse("submit", "--run", "STFTCNN/a", "--run", "STFTCNN_b/c",
+                 "--method", "stack")
+    assert args.func is cli.submit_blend
+    assert args.runs == ["STFTCNN/a", "STFTCNN_b/c"]
+    assert args.method == "stack"
+
+
+def test_plot():
+    args = parse("plot", "cv/STFTCNN/x", "--fold", "2")
+    assert args.func is cli.plot
+    assert (args.path, args.fold) == ("cv/STFTCNN/x", 2)
+
+
+def test_bench():
+    args = parse("bench", "--no-model", "--frontends", "stft", "mfcc40")
+    assert args.func is cli.bench
+    assert args.no_model
+    assert args.frontends == ["stft", "mfcc40"]
+
+
+def test_config_flags(monkeypatch):
+    import config
+    monkeypatch.setattr(config, "OOF_STORE_PATH", config.OOF_STORE_PATH)
+    # registered so the variable apply_config sets is undone afterwards
+    monkeypatch.setenv("CONFIG_OOF_STORE_PATH", "")
+    args = parse("--oof-store", "/tmp/oof", "index")
+    cli.apply_config(args)
+    assert config.OOF_STORE_PATH == "/tmp/oof"
+    assert os.environ["CONFIG_OOF_STORE_PATH"] == "/tmp/oof"
+
+
+def test_command_required():
+    with pytest.raises(SystemExit):
+        parse()
+
+
+def test_config_flags_reach_spawned_processes(monkeypatch):
+    import multiprocessing as mp
+    import config
+    monkeypatch.setattr(config, "TRAIN_FILE_META_INFO",
+                        config.TRAIN_FILE_META_INFO)
+    monkeypatch.setenv("CONFIG_TRAIN_FILE_META_INFO", "")
+    cli.apply_config(parse("--file-info", "/tmp/info.csv", "index"))
+
+    context = mp.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child_config, args=(queue,))
+    process.start()
+    assert queue.get(timeout=60) == "/tmp/info.csv"
+    process.join()
+
+
+def _child_config(queue):
+    import config
+    queue.put(config.TRAIN_FILE_META_INFO)
+
+
+def test_pack():
+    args = parse("pack", "--sources", "train", "test")
+    assert args.func is cli.pack
+    assert args.sources == ["train", "test"]
+
+
+def test_stretch_bank():
+    args = parse("stretch-bank", "--rates", "0.9", "1.1")
+    assert args.func is cli.stretch_bank
+    assert args.rates == [0.9, 1.1]
+
+
+def test_feature_store():
+    args = parse("feature-store", "--dtype", "float16",
+                 "--channels", "phase", "amp")
+    assert args.func is cli.feature_store
+    assert (args.dtype, args.channels) == ("float16", ["phase", "amp"])
+
+
+def test_export():
+    args = parse("export", "--cv-path", "cv/STFTCNN/x", "--no-quantize")
+    assert args.func is cli.export
+    assert args.no_quantize and not args.no_compare
+
+
+def test_serve():
+    args = parse("serve", "--cv-path", "cv/STFTCNN/x", "--port", "9000",
+                 "--runtime", "pb")
+    assert args.func is cli.serve
+    assert (args.port, args.runtime) == (9000, "pb")
+
+
+def test_stream():
+    args = parse("stream", "clip.wav", "--weights", "fold_0.tflite",
+                 "--threshold", "0.6")
+    assert args.func is cli.stream
+    assert (args.wav, args.weights, args.threshold) == (
+        "clip.wav", "fold_0.tflite", 0.6)
+
+
+def test_sweep():
+    args = parse("sweep", "--method", "halving", "--sweep-id", "s1",
+                 "--trial-workers", "2")
+    assert args.func is cli.sweep
+    assert (args.method, args.sweep_id, args.trial_workers) == (
+        "halving", "s1", 2)
+
+
+def test_module_main_defers_to_cli(tmp_path):
+    import subprocess
+    import sys
+    from pathlib import Path
+    root = Path(cli.__file__).resolve().parent
+    result = subprocess.run([sys.executable, str(root/"packed.py"),
+                             "--help"], cwd=str(tmp_path),
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0
+    assert "--silence-version" in result.stdout
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import distill
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def test_temper_divides_logits():
+    logits = np.random.RandomState(0).randn(5, 12)
+    np.testing.assert_allclose(distill.temper(softmax(logits), 4.0),
+                               softmax(logits / 4.0), rtol=1e-6)
+
+
+def test_temper_one_is_identity():
+    probs = softmax(np.random.RandomState(1).randn(5, 12))
+    np.testing.assert_allclose(distill.temper(probs, 1.0), probs, rtol=1e-6)
+
+
+def test_soft_targets():
+    probs = softmax(np.random.RandomState(2).randn(4, 12))
+    labels = np.array([0, 3, 11, 3])
+    targets = distill.soft_targets(probs, labels, temperature=2.0)
+    assert targets.shape == (4, 24)
+    assert targets.dtype == np.float32
+    np.testing.assert_array_equal(targets[:, :12],
+                                  np.eye(12)[labels])
+    np.testing.assert_allclose(targets[:, 12:], distill.temper(probs, 2.0),
+                               rtol=1e-6)
+
+
+def test_distillation_loss():
+    tf = pytest.importorskip("tensorflow")
+    from tensorflow.python.keras import backend as K
+    random = np.random.RandomState(3)
+    teacher = softmax(random.randn(4, 12))
+    student_logits = random.randn(4, 12)
+    labels = np.array([1, 2, 3, 4])
+    temperature, alpha = 4.0, 0.7
+
+    soft = distill.temper(teacher, temperature)
+    student_soft = softmax(student_logits / temperature)
+    expected = (alpha * temperature ** 2 *
+                -np.sum(soft * np.log(student_soft), axis=1) +
+                (1 - alpha) *
+                -np.log(softmax(student_logits)[np.arange(4), labels]))
+
+    loss = distill.distillation_loss(temperature, alpha)
+    y_true = tf.constant(distill.soft_targets(teacher, labels, temperature))
+    y_pred = tf.constant(softmax(student_logits).astype(np.float32))
+    np.testing.assert_allclose(K.eval(loss(y_true, y_pred)), expected,
+                               rtol=1e-4)
+
+    # one-hot rows without teacher probs: plain cross entropy
+    hard = tf.constant(np.eye(12, dtype=np.float32)[labels])
+    np.testing.assert_allclose(
+        K.eval(loss(hard, y_pred)),
+        -np.log(softmax(student_logits)[np.arange(4), labels]), rtol=1e-4)
+
+
+def test_oof_teacher_probs(tmp_path):
+    import oof
+    import pandas as pd
+    store = oof.OOFStore("STFTCNN", "v1", root=tmp_path)
+    fold_probs = [softmax(np.random.RandomState(4).randn(2, 12)),
+                  softmax(np.random.RandomState(5).randn(1, 12))]
+    store.write_oof(0, ["a.wav", "b.wav"], [0, 1], fold_probs[0])
+    store.write_oof(1, ["c.wav"], [2], fold_probs[1])
+
+    valid_df = pd.DataFrame({"path": ["c.wav", "a.wav"]})
+    np.testing.assert_allclose(
+        distill.oof_teacher_probs("STFTCNN", "v1", valid_df, tmp_path),
+        np.vstack([fold_probs[1][0], fold_probs[0][0]]), atol=1e-3)
+
+    # a clip no fold held out, or no store at all
+    missing = pd.DataFrame({"path": ["a.wav", "d.wav"]})
+    assert distill.oof_teacher_probs("STFTCNN", "v1", missing,
+                                     tmp_path) is None
+    assert distill.oof_teacher_probs("STFTCNN", "v2", valid_df,
+                                     tmp_path) is None
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("sklearn")
+pytest.importorskip("tensorflow")
+import experiment  # noqa: E402
+
+
+def test_fold_splits_missing_file(tmp_path):
+    split_path = tmp_path/"folds.npz"
+    with pytest.raises(FileNotFoundError, match=str(split_path)):
+        experiment.fold_splits(None, None, None, split_path)
+
+
+def test_fold_splits_refuse_other_ordering(tmp_path):
+    import pandas as pd
+    file_df = pd.DataFrame({"path": ["{}.wav".format(i) for i in range(10)],
+                            "uid": [i // 2 for i in range(10)]})
+    silence_data = pd.DataFrame({"path": ["s{}.wav".format(i)
+                                          for i in range(4)]})
+    split_path = tmp_path/"folds.npz"
+    splits = experiment.fold_splits(file_df, silence_data, 2, split_path)
+    loaded = experiment.fold_splits(file_df, silence_data, None, split_path)
+    for split, saved in zip(splits, loaded):
+        for positions, saved_positions in zip(split, saved):
+            assert list(positions) == list(saved_positions)
+
+    with pytest.raises(ValueError):
+        experiment.fold_splits(file_df.iloc[::-1], silence_data, None,
+                               split_path)
@@ -0,0 +1,61 @@
+import multiprocessing as mp
+import numpy as np
+import feature_cache
+
+
+def _put_many(cache_dir, seed):
+    cache = feature_cache.FeatureCache({"n": 1}, cache_dir=cache_dir)
+    feature = np.full((64, 64), seed, dtype=np.float32)
+    for i in range(50):
+        cache.put("{:040x}".format(i), feature)
+
+
+def test_concurrent_puts_leave_whole_files(tmp_path):
+    context = mp.get_context("spawn")
+    processes = [context.Process(target=_put_many, args=(str(tmp_path), i))
+                 for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    cache = feature_cache.FeatureCache({"n": 1}, cache_dir=tmp_path)
+    for i in range(50):
+        feature = cache.get("{:040x}".format(i))
+        assert feature.shape == (64, 64)
+        assert len(np.unique(feature)) == 1
+    assert not list(tmp_path.glob("*/*.tmp"))
+
+
+def test_disk_tier_off_by_default(monkeypatch):
+    import importlib
+    import config
+    monkeypatch.delenv("CONFIG_FEATURE_CACHE_PATH", raising=False)
+    assert importlib.reload(config).FEATURE_CACHE_PATH is None
+    assert feature_cache.FeatureCache({"n": 1}, cache_dir=None).cache_dir \
+        is None
+
+
+def test_one_miss_per_clip(tmp_path):
+    import generator
+    from scipy.io import wavfile
+    path = str(tmp_path/"a.wav")
+    wavfile.write(path, 16000, np.ones(16000, dtype=np.int16))
+    cache = feature_cache.FeatureCache({"n": 1}, cache_dir=None)
+
+    generator.make_batch([path], cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    generator.make_batch([path], cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_memory_limit_evicts_oldest():
+    feature = np.zeros(256, dtype=np.float32)
+    cache = feature_cache.FeatureCache({"n": 1}, cache_dir=None,
+                                       memory_limit=2 * feature.nbytes)
+    for key in ("a", "b", "c"):
+        cache.put(key, feature)
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+    assert cache.memory_size == 2 * feature.nbytes
@@ -0,0 +1,52 @@
+import numpy as np
+from scipy.io import wavfile
+import pytest
+import feature_store
+import generator
+
+
+def write_wav(path, length, seed):
+    wav = np.random.RandomState(seed).randint(-3000, 3000, length)
+    wavfile.write(str(path), 16000, wav.astype(np.int16))
+    return str(path)
+
+
+@pytest.fixture
+def clips(tmp_path):
+    paths = [write_wav(tmp_path/"a.wav", 16000, 0),
+             write_wav(tmp_path/"b.wav", 16000, 1)]
+    noise = [write_wav(tmp_path/"noise.wav", 16000 * 5, 2)]
+    return paths, noise
+
+
+def test_store_round_trip_with_virtual_silence(tmp_path, clips):
+    paths, noise = clips
+    all_paths = paths + ["silence://2017/0", "silence://2017/1"]
+    store_path = tmp_path/"features.h5"
+    feature_store.write_store(all_paths, store_path, bg_paths=noise)
+
+    store = feature_store.FeatureStore(store_path)
+    rows = store.rows(["silence://2017/1", paths[0]])
+    np.testing.assert_array_equal(rows, [3, 0])
+    features = store.read(rows)
+    expected = generator.make_batch(
+        ["silence://2017/1", paths[0]],
+        silence=generator.SilenceSource(generator.load_noise_bank(noise),
+                                        fixed=True))
+    np.testing.assert_allclose(features, expected, rtol=1e-2, atol=1e-2)
+    store.close()
+
+
+def test_virtual_silence_needs_bg_paths(tmp_path):
+    with pytest.raises(ValueError):
+        feature_store.write_store(["silence://2017/0"],
+                                  tmp_path/"features.h5")
+
+
+def test_rows_missing_path(tmp_path, clips):
+    paths, _ = clips
+    feature_store.write_store(paths, tmp_path/"features.h5")
+    store = feature_store.FeatureStore(tmp_path/"features.h5")
+    with pytest.raises(KeyError):
+        store.rows(["missing.wav"])
+    store.close()
@@ -0,0 +1,53 @@
+import numpy as np
+import scipy.signal as signal
+import generator
+
+
+def test_featurize_batch_matches_scipy_stft():
+    # more clips than one chunk, the last chunk partly filled
+    n_clips = 2 * generator.FEATURIZE_CHUNK + 1
+    wavs = np.random.RandomState(0).uniform(
+        -0.5, 0.5, (n_clips, generator.SAMPLE_RATE)).astype(np.float32)
+    got = generator.featurize_batch(wavs)
+    assert got.shape == (n_clips,) + generator.FEATURE_SHAPE
+
+    for wav, features in zip(wavs, got):
+        expected = generator.spectrogram(wav, generator.SAMPLE_RATE)
+        np.testing.assert_allclose(features[..., 1], expected[..., 1],
+                                   atol=1e-5)
+        # phase can flip between 1 and -1 for the same angle
+        diff = np.angle(np.exp(1j * np.pi * (features[..., 0] -
+                                             expected[..., 0])))
+        assert np.abs(diff).max() < 1e-3
+
+
+def test_featurize_batch_writes_into_out():
+    wavs = np.zeros((2, generator.SAMPLE_RATE), dtype=np.float32)
+    out = np.full((2,) + generator.FEATURE_SHAPE, np.nan, dtype=np.float32)
+    assert generator.featurize_batch(wavs, out=out) is out
+    assert not np.isnan(out).any()
+
+
+def test_frame_spectrum_matches_scipy_stft():
+    wavs = np.random.RandomState(1).uniform(
+        -0.5, 0.5, (2, 4000)).astype(np.float32)
+    windowed = np.zeros((2, 23, generator.STFT_PARAMS["nfft"]),
+                        dtype=np.float32)
+    for buffer in (None, windowed, windowed):
+        got = generator.frame_spectrum(wavs, windowed=buffer)
+        for wav, specgram in zip(wavs, got):
+            expected = signal.stft(wav, generator.SAMPLE_RATE,
+                                   padded=False, boundary=None,
+                                   **generator.STFT_PARAMS)[2]
+            np.testing.assert_allclose(specgram.T, expected, atol=1e-6)
+
+
+def test_batch_targets():
+    labels = np.array([0, 2, 1])
+    np.testing.assert_array_equal(
+        generator.batch_targets(labels, None, np.array([1, 0]), 3),
+        [[0, 0, 1], [1, 0, 0]])
+    targets = np.arange(6, dtype=np.float32).reshape(3, 2)
+    np.testing.assert_array_equal(
+        generator.batch_targets(labels, targets, np.array([2]), 3),
+        [[4, 5]])
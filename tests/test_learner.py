@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("tensorflow")
+import instrument  # noqa: E402
+import learner  # noqa: E402
+
+
+def run_epoch(logger, timer, epoch, stage):
+    logger.on_epoch_begin(epoch)
+    timer.add(stage, 0.5)
+    logger.on_batch_begin(0)
+    logger.on_batch_end(0, {"size": 8})
+    logger.on_epoch_end(epoch)
+
+
+def test_throughput_logger_columns_and_resume(tmp_path):
+    csv_path = str(tmp_path/"fold_0_throughput.csv")
+    timer = instrument.StageTimer()
+    logger = learner.ThroughputLogger(csv_path, timer=timer)
+    logger.on_train_begin()
+    run_epoch(logger, timer, 0, "load")
+    # a stage first seen after the first epoch keeps its column
+    run_epoch(logger, timer, 1, "augment")
+
+    resumed = learner.ThroughputLogger(csv_path, timer=timer, append=True)
+    resumed.on_train_begin()
+    run_epoch(resumed, timer, 2, "featurize")
+
+    log = pd.read_csv(csv_path)
+    assert list(log.columns) == list(learner.ThroughputLogger.FIELDS)
+    assert list(log.epoch) == [0, 1, 2]
+    assert log.stage_augment[1] == 0.5
+    assert log.stage_featurize[2] == 0.5
+    assert log.samples.sum() == 24
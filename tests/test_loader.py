@@ -0,0 +1,44 @@
+import os
+import signal
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.io import wavfile
+import generator
+import loader
+
+
+@pytest.fixture
+def input_df(tmp_path):
+    paths = list()
+    for i in range(6):
+        path = str(tmp_path/"{}.wav".format(i))
+        wav = np.random.RandomState(i).randint(-3000, 3000, 16000)
+        wavfile.write(path, 16000, wav.astype(np.int16))
+        paths.append(path)
+    return pd.DataFrame({"path": paths, "plnum": [0, 1, 2] * 2})
+
+
+def test_batches_match_make_batch(input_df):
+    with loader.PrefetchLoader(input_df, 4, 12, None, mode='valid',
+                               workers=2) as batches:
+        x_batch, y_batch = next(batches)
+        np.testing.assert_allclose(
+            x_batch, generator.make_batch(input_df.path.values[:4]),
+            atol=1e-5)
+        np.testing.assert_array_equal(y_batch.argmax(axis=1), [0, 1, 2, 0])
+        x_batch, _ = next(batches)
+        assert len(x_batch) == 2
+    assert all(not p.is_alive() for p in batches.processes)
+
+
+def test_dead_worker_raises(input_df):
+    batches = loader.PrefetchLoader(input_df, 2, 12, None, mode='valid',
+                                    workers=1, depth=1)
+    next(batches)
+    os.kill(batches.processes[0].pid, signal.SIGKILL)
+    batches.processes[0].join()
+    with pytest.raises(RuntimeError):
+        for _ in range(4):
+            next(batches)
+    assert batches.closed
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+import oof
+
+
+def random_probs(n, seed):
+    probs = np.random.RandomState(seed).rand(n, 12)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+
+def test_round_trip(tmp_path):
+    store = oof.OOFStore("STFTCNN", "v1", root=tmp_path)
+    fold_probs = [random_probs(3, 0), random_probs(2, 1)]
+    store.write_oof(0, ["a", "b", "c"], [0, 1, 2], fold_probs[0])
+    store.write_oof(1, ["d", "e"], [3, 4], fold_probs[1])
+
+    index, probs = store.oof()
+    assert list(index["clip"]) == ["a", "b", "c", "d", "e"]
+    assert list(index["fold"]) == [0, 0, 0, 1, 1]
+    assert list(index["row"]) == [0, 1, 2, 0, 1]
+    assert all(isinstance(x, np.memmap) for x in probs.values())
+
+    # any order and subset of rows, float16 on disk
+    subset = index.set_index("clip").loc[["e", "a", "c"]]
+    np.testing.assert_allclose(
+        oof.gather(probs, subset),
+        np.vstack([fold_probs[1][1], fold_probs[0][0], fold_probs[0][2]]),
+        atol=1e-3)
+
+
+def test_test_probs(tmp_path):
+    store = oof.OOFStore("STFTCNN", "v1", root=tmp_path)
+    for fold in range(2):
+        store.write_test(fold, ["x.wav", "y.wav"], random_probs(2, fold))
+    fnames, probs = store.test()
+    assert list(fnames) == ["x.wav", "y.wav"]
+    assert probs.shape == (2, 2, 12)
+    with pytest.raises(ValueError):
+        store.write_test(2, ["y.wav", "x.wav"], random_probs(2, 2))
+
+
+def test_empty_store(tmp_path):
+    with pytest.raises(ValueError):
+        oof.OOFStore("STFTCNN", "missing", root=tmp_path).oof()
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from scipy.io import wavfile
+import generator
+import packed
+
+
+def write_wavs(path, lengths, seed=0):
+    random = np.random.RandomState(seed)
+    paths, wavs = list(), list()
+    for i, length in enumerate(lengths):
+        wav = random.randint(-2 ** 15, 2 ** 15, length).astype(np.int16)
+        wav_path = str(path/"clip_{}.wav".format(i))
+        wavfile.write(wav_path, generator.SAMPLE_RATE, wav)
+        paths.append(packed.normalize_path(wav_path))
+        wavs.append(wav)
+    return paths, wavs
+
+
+def test_pack_round_trip(tmp_path):
+    # one second clips and shorter ones, as in the train set
+    paths, wavs = write_wavs(tmp_path, [16000, 8000, 1, 12345, 16000])
+    index = pd.DataFrame({"path": paths, "source": "train",
+                          "row": np.arange(len(paths))})
+    packed.pack(index, tmp_path/"packed")
+
+    bin_bytes = (tmp_path/"packed"/packed.BIN_NAME).read_bytes()
+    assert bin_bytes == b"".join(wav.astype("<i2").tobytes()
+                                 for wav in wavs)
+
+    reader = packed.PackedReader(tmp_path/"packed")
+    assert list(reader.paths("train")) == paths
+    for path, wav in zip(paths, wavs):
+        got, sample_rate = reader.read(path)
+        assert sample_rate == generator.SAMPLE_RATE
+        np.testing.assert_array_equal(got, wav)
+        np.testing.assert_array_equal(reader.read_wav_file(path)[0],
+                                      generator.read_wav_file(path)[0])
+
+    # packing the same clips again gives the same files byte for byte
+    packed.pack(index, tmp_path/"again")
+    for name in (packed.BIN_NAME, packed.INDEX_NAME):
+        assert ((tmp_path/"packed"/name).read_bytes() ==
+                (tmp_path/"again"/name).read_bytes())
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+import generator
+import sampler
+
+
+def test_train_plan_is_class_balanced():
+    labels = np.repeat(np.arange(3), [10, 20, 30])
+    epoch_sampler = sampler.EpochSampler(
+        labels, sampling_size=5, lookahead=0,
+        random_state=np.random.RandomState(0))
+    plan = epoch_sampler.next_plan()
+    assert len(plan) == len(epoch_sampler) == 15
+    assert len(np.unique(plan)) == 15
+    np.testing.assert_array_equal(np.bincount(labels[plan]), [5, 5, 5])
+
+
+def test_eval_plan_walks_rows_in_order():
+    epoch_sampler = sampler.EpochSampler(np.zeros(7), mode='valid')
+    np.testing.assert_array_equal(epoch_sampler.next_plan(), np.arange(7))
+    assert epoch_sampler.plans is None
+
+
+def test_sampling_size_larger_than_class():
+    with pytest.raises(ValueError):
+        sampler.EpochSampler(np.array([0, 0, 1]), sampling_size=2)
+
+
+def test_lookahead_matches_plans_and_close_stops_thread():
+    labels = np.repeat(np.arange(2), 10)
+    direct = sampler.EpochSampler(labels, sampling_size=4, lookahead=0,
+                                  random_state=np.random.RandomState(1))
+    ahead = sampler.EpochSampler(labels, sampling_size=4, lookahead=2,
+                                 random_state=np.random.RandomState(1))
+    for _ in range(3):
+        np.testing.assert_array_equal(ahead.next_plan(), direct.plan())
+    ahead.close()
+    ahead.thread.join(timeout=5)
+    assert not ahead.thread.is_alive()
+
+
+class FakeStore():
+
+    def rows(self, paths):
+        return np.arange(len(paths))
+
+    def read(self, rows):
+        return np.zeros((len(rows), 2), dtype=np.float32)
+
+
+def test_generator_close_stops_sampler(monkeypatch):
+    samplers = list()
+
+    class Recording(sampler.EpochSampler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            samplers.append(self)
+
+    monkeypatch.setattr(sampler, "EpochSampler", Recording)
+    input_df = pd.DataFrame({"path": ["a", "b", "c", "d"],
+                             "plnum": [0, 0, 1, 1]})
+    batches = generator.batch_generator(input_df, 2, 12, None,
+                                        sampling_size=2, store=FakeStore())
+    x_batch, y_batch = next(batches)
+    assert x_batch.shape == (2, 2) and y_batch.shape == (2, 12)
+    batches.close()
+    samplers[0].thread.join(timeout=5)
+    assert not samplers[0].thread.is_alive()
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import time
+import numpy as np
+import pytest
+from scipy.io import wavfile
+import server
+
+
+def wav_bytes(wav, sample_rate=16000):
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sample_rate, wav)
+    return buffer.getvalue()
+
+
+def test_decode_wav_fits_length():
+    wav = server.decode_wav(wav_bytes(np.ones(8000, dtype=np.int16)))
+    assert wav.shape == (16000,) and wav.dtype == np.float32
+
+
+@pytest.mark.parametrize("body", [
+    wav_bytes(np.ones((16000, 2), dtype=np.int16)),
+    wav_bytes(np.zeros(0, dtype=np.int16)),
+    wav_bytes(np.ones(16000, dtype=np.int16), sample_rate=8000),
+    wav_bytes(np.ones(16000, dtype=np.float32)),
+])
+def test_decode_wav_rejects(body):
+    with pytest.raises(ValueError):
+        server.decode_wav(body)
+
+
+def fake_predict(wavs):
+    probs = np.zeros((len(wavs), 12), dtype=np.float32)
+    probs[:, 2] = 1
+    return probs
+
+
+async def post(port, body):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write("POST /predict HTTP/1.1\r\nContent-Length: {}\r\n"
+                 "Connection: close\r\n\r\n".format(len(body)).encode())
+    writer.write(body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+def test_predict_and_bad_request():
+    async def run():
+        batcher = server.MicroBatcher(fake_predict, max_wait_ms=1)
+        app = server.InferenceServer(batcher)
+        batcher.start()
+        listener = await asyncio.start_server(app.connection,
+                                              "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            ok = await asyncio.gather(*[
+                post(port, wav_bytes(np.ones(16000, dtype=np.int16)))
+                for _ in range(4)])
+            stereo = await post(port, wav_bytes(
+                np.ones((100, 2), dtype=np.int16)))
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            batcher.close()
+        return ok, stereo, batcher.stats()
+
+    ok, stereo, stats = asyncio.run(run())
+    assert all(b" 200 " in response and b'"label": "up"' in response
+               for response in ok)
+    assert b" 400 " in stereo
+    assert stats["clips"] == 4
+
+
+def test_batcher_survives_cancelled_and_failed_requests():
+    calls = list()
+
+    def slow_predict(wavs):
+        calls.append(len(wavs))
+        if len(calls) == 2:
+            raise RuntimeError("model failed")
+        time.sleep(0.05)
+        return fake_predict(wavs)
+
+    async def run():
+        batcher = server.MicroBatcher(slow_predict, max_wait_ms=1)
+        batcher.start()
+        wav = np.zeros(16000, dtype=np.float32)
+        # gives up while its batch is still running
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(batcher.predict(wav), 0.01)
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(batcher.predict(wav), 5)
+        probs = await asyncio.wait_for(batcher.predict(wav), 5)
+        batcher.close()
+        return probs
+
+    assert asyncio.run(run()).argmax() == 2
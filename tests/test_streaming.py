@@ -0,0 +1,53 @@
+import subprocess
+import sys
+from pathlib import Path
+import numpy as np
+import config
+import streaming
+
+SAMPLE_RATE = 16000
+
+
+class StubModel():
+    """"yes" while the window holds any sound, "silence" otherwise"""
+
+    def __init__(self):
+        self.runs = 0
+
+    def predict_on_batch(self, x_batch):
+        self.runs += 1
+        probs = np.full((1, len(config.POSSIBLE_LABELS)), 0.05 / 11)
+        loud = np.abs(x_batch).max() > 0
+        label = "yes" if loud else "silence"
+        probs[0, config.POSSIBLE_LABELS.index(label)] = 0.95
+        return probs
+
+
+def test_spotter_on_synthetic_stream():
+    # 1 s silence, 1 s tone, 2 s silence, pushed in 100 ms chunks
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    tone = 0.5 * np.sin(2 * np.pi * 440 * t)
+    wav = np.concatenate([np.zeros(SAMPLE_RATE), tone,
+                          np.zeros(2 * SAMPLE_RATE)])
+    wav = (wav * np.iinfo(np.int16).max).astype(np.int16)
+
+    stub = StubModel()
+    spotter = streaming.StreamingSpotter(stub, refractory=3.0)
+    detections = list()
+    for start in range(0, len(wav), 1600):
+        detections.extend(spotter.push(wav[start:start + 1600]))
+
+    # the tone reaches the window at frame 99 and the third loud run of
+    # the smoothing at frame 128
+    assert [d.label for d in detections] == ["yes"]
+    assert abs(detections[0].time - 128 * 160 / SAMPLE_RATE) < 1e-9
+    stats = spotter.stats()
+    assert stats["frames"] == (len(wav) - 400) // 160 + 1
+    assert stats["model_runs"] == stub.runs == 31
+
+
+def test_import_without_tensorflow():
+    root = Path(streaming.__file__).resolve().parent
+    code = ("import sys, streaming; "
+            "assert 'tensorflow' not in sys.modules")
+    subprocess.check_call([sys.executable, "-c", code], cwd=str(root))
@@ -0,0 +1,20 @@
+import numpy as np
+import make_stretch_bank
+
+
+def test_part_matches(tmp_path):
+    part_path = tmp_path/"part_00000.npz"
+    paths = ["a/0.wav", "b/1.wav"]
+    wavs = [np.zeros(10, dtype=np.int16), np.ones(12, dtype=np.int16)]
+    assert not make_stretch_bank.part_matches(part_path, paths, 0.9, 0)
+
+    make_stretch_bank.write_part(part_path, wavs, paths, 0.9, 0)
+    assert make_stretch_bank.part_matches(part_path, paths, 0.9, 0)
+    assert not make_stretch_bank.part_matches(part_path, paths[::-1], 0.9, 0)
+    assert not make_stretch_bank.part_matches(part_path, paths, 1.1, 0)
+    assert not make_stretch_bank.part_matches(part_path, paths, 0.9, 1000)
+
+    # parts of an older format are written again
+    np.savez(str(part_path), wav=np.concatenate(wavs),
+             length=np.array([10, 12]))
+    assert not make_stretch_bank.part_matches(part_path, paths, 0.9, 0)
@@ -0,0 +1,84 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.io import wavfile
+
+pytest.importorskip("tensorflow")
+import submit  # noqa: E402
+
+
+def random_probs(n, seed):
+    probs = np.random.RandomState(seed).rand(n, 12)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+
+def test_fold_probs_keep_clip_names(tmp_path):
+    fnames = np.array(["a.wav", "b.wav", "c.wav"])
+    fold_probs = np.stack([random_probs(3, 0), random_probs(3, 1)])
+    submit_file = tmp_path/"submit.csv"
+    with submit.SubmissionWriter(tmp_path, submit_file, 3, 2) as writer:
+        writer.write(fnames[:2], fold_probs[:, :2])
+        writer.write(fnames[2:], fold_probs[:, 2:])
+
+    probs = submit.read_fold_probs(tmp_path, fnames)
+    np.testing.assert_allclose(probs, fold_probs, atol=1e-3)
+    assert list(pd.read_csv(str(submit_file)).fname) == list(fnames)
+    with pytest.raises(ValueError):
+        submit.read_fold_probs(tmp_path, fnames[::-1])
+
+
+class FoldModel():
+    """the same probabilities for every clip, set by load_weights"""
+
+    def __init__(self, fold_probs):
+        self.fold_probs = fold_probs
+        self.probs = None
+
+    def load_weights(self, path):
+        fold = int(Path(path).stem.split("_")[1])
+        self.probs = self.fold_probs[fold]
+
+    def predict_on_batch(self, x_batch):
+        return np.tile(self.probs, (len(x_batch), 1))
+
+
+class Estimator():
+    frontend = "stft"
+
+    def __init__(self, fold_probs):
+        self.fold_probs = fold_probs
+
+    def model_init(self):
+        self.model = FoldModel(self.fold_probs)
+
+
+def test_ensemble_averages_folds(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cv_path = tmp_path/"cv"
+    cv_path.mkdir()
+    # fold 0 alone says "yes", the fold mean says "no"
+    fold_probs = np.zeros((2, 12))
+    fold_probs[0, :2] = [0.7, 0.3]
+    fold_probs[1, :2] = [0.1, 0.9]
+    for fold in range(2):
+        (cv_path/"fold_{}.hdf5".format(fold)).touch()
+
+    paths = list()
+    for i in range(70):
+        path = str(tmp_path/"clip_{:02d}.wav".format(i))
+        wavfile.write(path, 16000, np.zeros(16000, dtype=np.int16))
+        paths.append(path)
+    test_paths = pd.DataFrame({"path": paths})
+    sub_path = tmp_path/"sub"
+    sub_path.mkdir()
+
+    submit_file = submit.ensemble(Estimator(fold_probs), cv_path,
+                                  test_paths, None, sub_path)
+    assert Path(submit_file).parent == Path("submit")
+    submission = pd.read_csv(str(submit_file))
+    assert list(submission.fname) == [Path(x).name for x in paths]
+    assert (submission.label == "no").all()
+    probs = submit.read_fold_probs(sub_path, submission.fname.values)
+    np.testing.assert_allclose(probs[:, 0, :2], fold_probs[:, :2],
+                               atol=1e-3)
@@ -0,0 +1,70 @@
+import json
+import math
+import pytest
+import sweep
+
+SPACE = {"batch_size": [32, 64, 128], "filters": [8, 16],
+         "lr_factor": [0.1, 0.3]}
+
+
+def test_sample_configs_distinct_and_seeded():
+    configs = sweep.sample_configs(SPACE, 5, seed=1)
+    assert len(configs) == 5
+    assert len({json.dumps(x, sort_keys=True) for x in configs}) == 5
+    assert configs == sweep.sample_configs(SPACE, 5, seed=1)
+    for config in configs:
+        assert all(config[name] in SPACE[name] for name in SPACE)
+
+
+def test_sample_configs_capped_by_space():
+    assert len(sweep.sample_configs(SPACE, 100)) == 12
+
+
+def test_sample_configs_unknown_parameter():
+    with pytest.raises(ValueError):
+        sweep.sample_configs({"dropout": [0.1]}, 1)
+
+
+def test_successive_halving_schedule(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    calls = list()
+
+    def fake_run_rung(sweep_path, rung, trials, epochs, initial_epoch,
+                      *args, **kwargs):
+        calls.append((rung, sorted(trials), epochs, initial_epoch))
+        return {trial_no: {"rung": rung, "epochs": epochs,
+                           "trained_epochs": epochs - initial_epoch,
+                           "val_loss": 1.0 / (trial_no + 1) + epochs,
+                           "val_acc": 0.5}
+                for trial_no in trials}
+
+    monkeypatch.setattr(sweep, "run_rung", fake_run_rung)
+    summary = sweep.successive_halving(SPACE, "virtual", n_trials=9,
+                                       min_epochs=1, max_epochs=9, eta=3,
+                                       sweep_id="test")
+    assert [(rung, len(trials), epochs, start)
+            for rung, trials, epochs, start in calls] == [
+        (0, 9, 1, 0), (1, 3, 3, 1), (2, 1, 9, 3)]
+    # the lowest val_loss trials are promoted
+    assert calls[1][1] == [6, 7, 8]
+    assert summary["best"]["trial"] == 8
+    assert summary["epochs_spent"] == 9 * 1 + 3 * 2 + 1 * 6
+    assert summary["epochs_grid"] == 9 * 9
+    assert (tmp_path/"cv/STFTCNN/test/sweep.json").exists()
+
+
+def test_failed_trials_are_not_promoted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def fake_run_rung(sweep_path, rung, trials, epochs, initial_epoch,
+                      *args, **kwargs):
+        return {trial_no: {"rung": rung, "epochs": epochs,
+                           "trained_epochs": 0, "val_loss": math.inf,
+                           "val_acc": 0.0}
+                for trial_no in trials}
+
+    monkeypatch.setattr(sweep, "run_rung", fake_run_rung)
+    summary = sweep.successive_halving(SPACE, "virtual", n_trials=3,
+                                       min_epochs=1, max_epochs=9, eta=3,
+                                       sweep_id="failed")
+    assert all(len(trial["rungs"]) == 1 for trial in summary["trials"])
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import generator
+
+tf = pytest.importorskip("tensorflow")
+tf_pipeline = pytest.importorskip("tf_pipeline")
+
+
+def test_spectrogram_matches_featurize_batch():
+    wavs = np.random.RandomState(0).uniform(
+        -0.5, 0.5, (4, generator.SAMPLE_RATE)).astype(np.float32)
+    expected = generator.featurize_batch(wavs)
+
+    with tf.Graph().as_default():
+        features = tf_pipeline.spectrogram(tf.constant(wavs))
+        with tf.Session() as session:
+            got = session.run(features)
+
+    assert got.shape == expected.shape == (4,) + generator.FEATURE_SHAPE
+    np.testing.assert_allclose(got[..., 1], expected[..., 1], atol=1e-4)
+    # phase is compared as an angle, where the bin has energy
+    diff = np.angle(np.exp(1j * np.pi * (got[..., 0] - expected[..., 0])))
+    energy = expected[..., 1] > 1e-4
+    assert np.abs(diff[energy]).max() < 1e-2
+
+
+def test_loader_feeds_keras_in_graph(tmp_path):
+    import pandas as pd
+    from scipy.io import wavfile
+    from tensorflow.python.keras import backend as K
+    from tensorflow.python.keras.layers import Dense, Flatten, Input
+    from tensorflow.python.keras.models import Model
+
+    paths = list()
+    for i in range(6):
+        path = str(tmp_path/"{}.wav".format(i))
+        wavfile.write(path, 16000, np.random.RandomState(i).randint(
+            -3000, 3000, 16000).astype(np.int16))
+        paths.append(path)
+    input_df = pd.DataFrame({"path": paths, "plnum": [0, 1] * 3})
+
+    K.clear_session()
+    x_in = Input(shape=generator.FEATURE_SHAPE)
+    x_out = Dense(12, activation="softmax")(Flatten()(x_in))
+    model = Model(x_in, x_out)
+    model.compile(optimizer="sgd", loss="categorical_crossentropy")
+
+    train = tf_pipeline.TFDataLoader(input_df, 2, 12, None,
+                                     sampling_size=2, seed=0)
+    valid = tf_pipeline.TFDataLoader(input_df, 2, 12, None, mode="valid")
+    history = model.fit(train.dataset, steps_per_epoch=2, epochs=1,
+                        validation_data=valid.dataset, validation_steps=3)
+    assert len(history.history["val_loss"]) == 1
+
+    test = tf_pipeline.TFDataLoader(input_df, 4, 12, None, mode="test")
+    batches = list(test.predict_batches([model, model], steps=2))
+    assert [x.shape for x in batches] == [(2, 4, 12), (2, 2, 12)]
+    for loader in (train, valid, test):
+        loader.close()
@@ -0,0 +1,243 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.keras import backend as K
+import generator
+import sampler
+
+"""
+tf.data input backend.
+
+Same batches as generator.batch_generator (same epoch plans, crop/pad and
+phase/amp STFT features), but decoding, crop/pad and the STFT run as TF ops
+in TF's own thread pool, so they overlap with the train step instead of
+competing with it for the GIL. TFDataLoader.dataset is passed to keras'
+fit / predict (see learner.Learner.learn and submit.predict), so batches
+go from the pipeline into the model inside the graph; predict_batches
+does the same for a fold ensemble. next() is kept for callers that need
+the numpy batch.
+"""
+
+# decode_wav scales by 1/32768, read_wav_file by 1/32767
+WAV_SCALE = -np.iinfo(np.int16).min / np.iinfo(np.int16).max
+
+
+def _signal_ops():
+    if hasattr(tf, "signal"):
+        return tf.signal
+    return tf.contrib.signal
+
+
+def _decode_wav_ops():
+    if hasattr(tf, "audio"):
+        return tf.audio.decode_wav
+    from tensorflow.contrib.framework.python.ops import audio_ops
+    return audio_ops.decode_wav
+
+
+def decode_wav(path):
+    """float32 samples of a 16bit mono wav, scaled like read_wav_file"""
+    decoded = _decode_wav_ops()(tf.read_file(path), desired_channels=1)
+    return decoded.audio[:, 0] * WAV_SCALE
+
+
+def fit_length(wav, length=generator.SAMPLE_RATE):
+    """random crop or random zero padding to length, as generator.fit_length"""
+    size = tf.shape(wav)[0]
+
+    def crop():
+        start = tf.random_uniform([], 0, size - length, dtype=tf.int32)
+        return wav[start:start + length]
+
+    def pad():
+        rem = length - size
+        before = tf.random_uniform([], 0, rem, dtype=tf.int32)
+        return tf.pad(wav, [[before, rem - before]])
+
+    wav = tf.cond(size > length, crop,
+                  lambda: tf.cond(size < length, pad, lambda: wav))
+    return tf.reshape(wav, [length])
+
+
+def spectrogram(wavs):
+    """(batch, 257, 98, 2) phase/amp features for (batch, 16000) wavs"""
+    specgram = _signal_ops().stft(
+        wavs,
+        frame_length=generator.STFT_PARAMS["nperseg"],
+        frame_step=generator.HOP_LENGTH,
+        fft_length=generator.STFT_PARAMS["nfft"],
+        window_fn=lambda length, dtype: tf.constant(generator.WINDOW, dtype),
+        pad_end=False)
+    specgram = tf.transpose(specgram, [0, 2, 1])
+    phase = tf.atan2(tf.imag(specgram), tf.real(specgram)) / np.pi
+    amp = tf.log1p(tf.abs(specgram))
+    return tf.stack([phase, amp], axis=3)
+
+
+def build_dataset(batches, paths, labels, category_num,
+                  mode='train',
+                  reader=None,
+                  augmentation=None,
+                  silence=None,
+                  parallel_calls=4,
+                  prefetch=4):
+    """dataset of (x_batch, y_batch), or x_batch in test mode
+
+    batches is a python generator of row positions, one array per batch.
+    Clips are read with tf ops, or sliced out of reader (a PackedReader)
+    and virtual silence is cut by silence (a SilenceSource) through
+    py_func. augmentation, when given, runs on the cropped waveforms of
+    each batch through py_func before the STFT.
+    """
+    path_table = tf.constant(list(paths))
+    label_table = tf.constant(labels, dtype=tf.int64)
+    silence_table = tf.constant([generator.is_virtual_silence(x)
+                                 for x in paths])
+
+    def read_packed(path):
+        wav, _ = reader.read(path.decode())
+        return np.asarray(wav)
+
+    def read_silence(path):
+        return silence.clip(path.decode(), generator.SAMPLE_RATE).astype(
+            np.float32)
+
+    def read_clip(path):
+        if reader is not None:
+            wav = tf.py_func(read_packed, [path], tf.int16, stateful=False)
+            wav.set_shape([None])
+            return tf.cast(wav, tf.float32) / np.iinfo(np.int16).max
+        return decode_wav(path)
+
+    def cut_silence(path):
+        wav = tf.py_func(read_silence, [path], tf.float32)
+        wav.set_shape([None])
+        return wav
+
+    def load_one(row):
+        path, is_silence = row
+        if silence is None:
+            wav = read_clip(path)
+        else:
+            wav = tf.cond(is_silence,
+                          lambda: cut_silence(path),
+                          lambda: read_clip(path))
+        return fit_length(wav)
+
+    def augment_batch(wavs, batch_paths):
+        batch_paths = [x.decode() for x in batch_paths]
+        params = augmentation.sample(len(wavs), np.random, batch_paths)
+        return augmentation.apply(wavs.copy(), params,
+                                  batch_paths).astype(np.float32)
+
+    def load_batch(positions):
+        batch_paths = tf.gather(path_table, positions)
+        wavs = tf.map_fn(load_one,
+                         (batch_paths, tf.gather(silence_table, positions)),
+                         dtype=tf.float32,
+                         parallel_iterations=32)
+        if augmentation is not None:
+            wavs = tf.py_func(augment_batch, [wavs, batch_paths],
+                              tf.float32)
+            wavs = tf.reshape(wavs, [-1, generator.SAMPLE_RATE])
+        x_batch = spectrogram(wavs)
+        if mode == 'test':
+            return x_batch
+        y_batch = tf.one_hot(tf.gather(label_table, positions),
+                             category_num)
+        return x_batch, y_batch
+
+    dataset = tf.data.Dataset.from_generator(batches, tf.int64,
+                                             tf.TensorShape([None]))
+    dataset = dataset.map(load_batch, num_parallel_calls=parallel_calls)
+    return dataset.prefetch(prefetch)
+
+
+class TFDataLoader():
+    """batch_generator replacement on top of build_dataset
+
+    Epoch plans come from sampler.EpochSampler, batched per plan exactly
+    like batch_generator. Feed dataset to the model; every next() is a
+    session run of a separate iterator that copies the batch out. The
+    feature cache is not used, the STFT on the fly is the point of this
+    backend. Call close() when done.
+    """
+
+    def __init__(self, input_df, batch_size, category_num, bgn_paths,
+                 mode='train',
+                 sampling_size=2000,
+                 reader=None,
+                 augmentation=None,
+                 parallel_calls=4,
+                 prefetch=4,
+                 seed=None,
+                 session=None):
+
+        self.batch_size = batch_size
+        if mode != 'test':
+            labels = input_df.plnum.values
+        else:
+            labels = np.zeros(len(input_df), dtype=np.int64)
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        self.sampler = sampler.EpochSampler(
+            labels, mode, sampling_size,
+            random_state=np.random.RandomState(seed))
+
+        paths = input_df.path.astype(str).values
+        silence = None
+        if any(generator.is_virtual_silence(x) for x in paths):
+            bank = generator.load_noise_bank(bgn_paths.path, reader)
+            silence = generator.SilenceSource(bank, fixed=(mode != 'train'))
+
+        self.session = session or K.get_session()
+        with self.session.graph.as_default():
+            self.dataset = build_dataset(self.batches, paths, labels,
+                                         category_num,
+                                         mode=mode,
+                                         reader=reader,
+                                         augmentation=augmentation,
+                                         silence=silence,
+                                         parallel_calls=parallel_calls,
+                                         prefetch=prefetch)
+        self._next_batch = None
+
+    @property
+    def next_batch(self):
+        """iterator output tensors, built on first use"""
+        if self._next_batch is None:
+            with self.session.graph.as_default():
+                self._next_batch = (self.dataset.make_one_shot_iterator()
+                                    .get_next())
+        return self._next_batch
+
+    def predict_batches(self, models, steps):
+        """(n_models, batch, labels) per batch for keras models
+
+        The models are applied to the iterator output in the graph, so a
+        batch is featurized once and never leaves TF. test mode only.
+        """
+        with self.session.graph.as_default():
+            probs = tf.stack([fold_model(self.next_batch)
+                              for fold_model in models])
+        for _ in range(steps):
+            yield self.session.run(probs, {K.learning_phase(): 0})
+
+    def batches(self):
+        for plan in self.sampler:
+            for start in range(0, len(plan), self.batch_size):
+                yield plan[start:start + self.batch_size]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.session.run(self.next_batch)
+
+    def close(self):
+        self.sampler.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,14 +1,45 @@
+import os
 import random
 from datetime import datetime
+from pathlib import Path
 import numpy as np
-import tensorflow as tf
+import pandas as pd
+import config
 
 
-def set_seed(seed):
+def set_seed(seed, tensorflow=True):
     random.seed(seed)
     np.random.seed(seed)
-    tf.set_random_seed(seed)
+    if tensorflow:
+        import tensorflow as tf
+        tf.set_random_seed(seed)
+
+
+def configure_session(intra_op_threads, inter_op_threads=2):
+    """give keras a TF session limited to the given thread counts"""
+    import tensorflow as tf
+    from tensorflow.python.keras import backend as K
+    session_config = tf.ConfigProto(
+        intra_op_parallelism_threads=intra_op_threads,
+        inter_op_parallelism_threads=inter_op_threads)
+    K.set_session(tf.Session(config=session_config))
 
 
 def now():
     return datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+
+
+def feather_path(csv_path):
+    return str(Path(csv_path).with_suffix(".feather"))
+
+
+def read_file_info(csv_path=config.TRAIN_FILE_META_INFO):
+    """train file info, from the feather copy when it is up to date"""
+    fpath = feather_path(csv_path)
+    if (os.path.exists(fpath) and
+            os.path.getmtime(fpath) >= os.path.getmtime(csv_path)):
+        try:
+            return pd.read_feather(fpath)
+        except ImportError:
+            pass
+    return pd.read_csv(csv_path)